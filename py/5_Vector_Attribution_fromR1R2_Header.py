@@ -41,6 +41,7 @@
 # Import system module
 from xml.etree import ElementTree
 import arcpy, string, os, shutil, re
+import scene_catalog
 
 # Use of traceback to return more information about the errors should they occur.
 def trace():
@@ -89,15 +90,27 @@ if __name__ == '__main__':
 
 
         elif fileType==".xml":		#Header information extraction for Radarsat-2 xml file
-            with open(inFile,'rt') as f:
-                tree = ElementTree.parse(f)
-            rootText='.//{http://www.rsi.ca/rs2/prod/xml/schemas}'# // is for the tag level followed by the schema/root
-            
-            #searches for xml tags and extract associated text for attribution values
-            satelliteName=str(tree.find(rootText + 'satellite').text)
-            beamMode=str(tree.find(rootText + 'beamModeMnemonic').text)
-            orbit=str(tree.find(rootText + 'passDirection').text)
-            dateTimeUTC=str(tree.find(rootText + 'rawDataStartTime').text)
+            # product.xml unpacked by FT1 (<workspace>\Raw\<scene>\product.xml) is
+            # read from the workspace scene catalog, parsed otherwise
+            catalogFile=os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(inFile)))), scene_catalog.CATALOG_NAME)
+            scene=None
+            if os.path.isfile(catalogFile):
+                scene=scene_catalog.SceneCatalog(catalogFile).add(inFile)
+            if scene is not None:
+                satelliteName=str(scene['satellite'])
+                beamMode=str(scene['beam'])
+                orbit=str(scene['pass_direction'])
+                dateTimeUTC=str(scene['acquired'])
+            else:
+                with open(inFile,'rt') as f:
+                    tree = ElementTree.parse(f)
+                rootText='.//{http://www.rsi.ca/rs2/prod/xml/schemas}'# // is for the tag level followed by the schema/root
+
+                #searches for xml tags and extract associated text for attribution values
+                satelliteName=str(tree.find(rootText + 'satellite').text)
+                beamMode=str(tree.find(rootText + 'beamModeMnemonic').text)
+                orbit=str(tree.find(rootText + 'passDirection').text)
+                dateTimeUTC=str(tree.find(rootText + 'rawDataStartTime').text)
             timeUTC=str(dateTimeUTC[11:19])
             dateUTC=str(dateTimeUTC[0:10])
            
@@ -33,6 +33,12 @@
         fv_seed  Flood Vegetation seed
         nfv_seed Non Flood Vegetation seed
 
+        engine   Filter, scale and threshold engine: PCI (default) or NUMPY (calibration and ortho of
+                 product.xml without import, one pass, no 32-bit channels, cached land cover rasterization)
+        workers  Number of products processed at a time, in worker processes (default 1)
+        ortho_workers Number of products orthorectified at a time (default 1)
+        compact  Flooded vegetation GeoTIFF: 1 for 1-bit, compressed, without empty tiles,
+                 0 for 8-bit uncompressed (default)
         m        Defines processing mode: "production" will delete all intermediate files, not implemented
 
         h        Shows help and exit
@@ -50,11 +56,16 @@
                      [-sc_im scale_image] [-th_im thres_image] [-im_veg image_veg]
                      [-im_pro image_pro] [-im_pix_x image_pixspac_x] [-im_pix_y image_pixspac_y]
                      [-v_th veg_thres] [-ow_th openwater_thres] [-th_cal cal_thres] [-ow_seed openwater_seed]
-                     [-fv_seed floodveg_seed] [-nfv_seed nfloodveg_seed] [-m process_mode] [-v] [-t test]
+                     [-fv_seed floodveg_seed] [-nfv_seed nfloodveg_seed] [-engine engine] [-m process_mode] [-v] [-t test]
+                     [-workers workers] [-ortho_workers ortho_workers] [-compact compact]
                      [-refr_file refr_file] [-refp_file refp_file] [-refp2_file refp2_file]
         EGS_process  [-h ] show help and exit
         EGS_process  [-c config file] [-v] [-t test]
 
+        From another tool, without starting a new interpreter:
+            import EGS_process
+            status = EGS_process.run(EGS_process.read_config('EGS_process.ini'))
+
     Limit ( s) and strain (s) of use:
         veg_flood_process.py must be available
 """
@@ -67,6 +78,8 @@ import sys
 import argparse
 import ConfigParser
 import logging
+import multiprocessing
+import time
 # datetime conflicts with arcpy, therefore declare as dt
 from datetime import datetime as dt
 
@@ -74,9 +87,14 @@ from datetime import datetime as dt
 import veg_flood_process
 import ortho_mosaic
 import EGS_utility
-
-#import required PCI Geomatica modules
-from pci.api import datasource as ds
+import dem_cache
+import landcover_cache
+import scene_catalog
+import seed_stats
+import work_store
+import stage_manifest
+import sar_calibrate
+import sar_ortho
 
 defaultConfigFileName = os.path.basename(__file__)[:-3] + ".ini"
 
@@ -130,6 +148,14 @@ parser.add_argument("--fv_seed",
                         help="Flood Vegetation seed", metavar="fv_seed")
 parser.add_argument("--nfv_seed",
                         help="Non Flood Vegetation seed", metavar="nfv_seed")
+parser.add_argument("--engine", choices=['PCI', 'NUMPY'],
+                        help="Filter, scale and threshold engine (default PCI)", metavar="engine")
+parser.add_argument("--workers", type=int,
+                        help="Number of products processed at a time (default 1)", metavar="workers")
+parser.add_argument("--ortho_workers", type=int,
+                        help="Number of products orthorectified at a time (default 1)", metavar="ortho_workers")
+parser.add_argument("--compact", type=int, choices=[0, 1],
+                        help="1-bit, compressed, sparse flooded vegetation GeoTIFF (default 0)", metavar="compact")
 parser.add_argument("--m",
                         help="defines processing mode: production will delete all intermediate files, not implemented ", metavar="m")
 parser.add_argument("--refr_file",
@@ -143,355 +169,640 @@ parser.add_argument("-v", "--verbose",
 parser.add_argument("-t", "--test", type=int, choices=[0, 1],
                     help="increase test; compare results to reference data. 1=compare only final product.")
 
-verbose = False
-if len(sys.argv) == 1:
-    if os.path.exists(defaultConfigFileName):
-        args = argparse.Namespace(conf_file=defaultConfigFileName)
-    else:
-        parser.print_help();
-        sys.exit(1)
-else:
-    args = parser.parse_args()
-
-refr_file = ''
-refp_file = ''
-refp2_file = ''
-DEM_file = ''
-# =============================================================================
-# 	Mainline
-# =============================================================================
-# Check if config file exists
-if os.path.exists(args.conf_file) and len(sys.argv) <= 4:
+# DEM caches of earlier runs in this interpreter, by DEM file
+dem_caches = {}
+# Land cover caches of earlier runs in this interpreter, by land cover file
+landcover_caches = {}
+# Semaphore limiting the products orthorectified at a time, in worker processes
+ortho_slots = None
+
+
+def read_config(conf_file):
+    """
+    Read the processing parameters of a config file
+
+    Parameters:
+        conf_file -- Config file (e.g. EGS_process.ini)
+
+    Return value:
+        Dictionary of processing parameters, as expected by run.
+
+    """
     Config = ConfigParser.ConfigParser()
-    Config.read(args.conf_file)
-    input_dir       =   Config.get("DirStructure","input_dir")
-    input_anc_dir   =   Config.get("DirStructure","input_anc_dir")
-    work_dir        =   Config.get("DirStructure","work_dir")
-    output_dir      =   Config.get("DirStructure","output_dir")
-    log_dir         =   Config.get("DirStructure","log_dir")
-
-    land_cover      =   Config.get("AncFiles","land_cover")
-    DEM_file        =   Config.get("AncFiles","DEM_file")
-
-    import_image    =   Config.getint("ProcessPar","import_image")
-    ortho_image     =   Config.getint("ProcessPar","ortho_image")
-    filter_image    =   Config.getint("ProcessPar","filter_image")
-    scale_image     =   Config.getint("ProcessPar","scale_image")
-    thres_image     =   Config.getint("ProcessPar","thres_image")
-    import_veg      =   Config.getint("ProcessPar","import_veg")
-    cal_thres       =   Config.getint("ProcessPar","cal_thres")
-
-    image_pro       =   Config.get("DataPar","image_pro")
-    image_pixspac_x =   Config.getint("DataPar","image_pixspac_x")
-    image_pixspac_y =   Config.getint("DataPar","image_pixspac_y")
-    veg_thres       =   Config.getfloat("DataPar","veg_thres")
-    openwater_thres =   Config.getfloat("DataPar","openwater_thres")
-    openwater_seed  =   Config.get("DataPar","openwater_seed")
-    floodveg_seed   =   Config.get("DataPar","floodveg_seed")
-    nfloodveg_seed  =   Config.get("DataPar","nfloodveg_seed")
-
-    mode            =   Config.get("ProcessMode","mode")
-    refr_file       =   Config.get("Testparameters","refr_file")
-    refp_file       =   Config.get("Testparameters","refp_file")
-    refp2_file      =   Config.get("Testparameters","refp2_file")
-
-else:
-    if args.indir is None or args.inadir is None or args.wdir is None or args.outdir is None \
-    or args.logdir is None or args.lc_file is None or args.DEM_file is None or args.imp_im is None \
-    or args.or_im is None or args.fl_im is None or args.sc_im is None or args.th_im is None \
-    or args.im_veg is None or args.im_pro is None or args.im_pix_x is None or args.im_pix_y is None \
-    or args.th_cal is None or args.m is None:
-        print "Missing parameter, see EGS_process.py usage for required argument"
-        parser.print_help();
-        sys.exit(1)
-    elif args.ow_seed is None and args.fv_seed is None and args.nfv_seed is None \
-         and args.v_th is None and args.ow_th is None:
-        print "  \n" \
-              "                  !!!!!  WARNING  !!!!!                \n" \
-              "  \n" \
-              "Missing thresholds parameters, Using default values of -3.5 and -12.5" \
-              " for open water and flooded vegetation respectively" \
-              "  \n"
-
-##        sys.exit(1)
-    if args.indir is not None:
-        input_dir = args.indir
-    if args.inadir is not None:
-        input_anc_dir = args.inadir
-    if args.wdir is not None:
-        work_dir = args.wdir
-    if args.outdir is not None:
-        output_dir = args.outdir
-    if args.logdir is not None:
-        log_dir = args.logdir
-
-    if args.lc_file is not None:
-        land_cover = args.lc_file
-    if args.DEM_file is not None:
-        DEM_file = args.DEM_file
-
-    if args.imp_im is not None:
-        import_image = int(args.imp_im)
-    if args.or_im is not None:
-        ortho_image = int(args.or_im)
-    if args.fl_im is not None:
-        filter_image = int(args.fl_im)
-    if args.sc_im is not None:
-        scale_image = int(args.sc_im)
-    if args.th_im is not None:
-        thres_image = int(args.th_im)
-    if args.im_veg is not None:
-        import_veg = int(args.im_veg)
-
-    if args.im_pro is not None:
-        image_pro = args.im_pro
-    if args.im_pix_x is not None:
-        image_pixspac_x = float(args.im_pix_x)
-    if args.im_pix_y is not None:
-        image_pixspac_y = float(args.im_pix_y)
-    if args.v_th is not None:
-        veg_thres = float(args.v_th)
-    else:
-        veg_thres = None
-    if args.ow_th is not None:
-        openwater_thres = float(args.ow_th)
-    else:
-        openwater_thres = None
-    if args.th_cal is not None:
-        cal_thres = float(args.th_cal)
-    if args.ow_seed is not None:
-        openwater_seed = str(args.ow_seed)
-    else:
-        openwater_seed = None
-    if args.fv_seed is not None:
-        floodveg_seed = str(args.fv_seed)
-    else:
-        floodveg_seed = None
-    if args.nfv_seed is not None:
-        nfloodveg_seed = str(args.nfv_seed)
+    Config.read(conf_file)
+    config = {}
+    config['input_dir']       =   Config.get("DirStructure","input_dir")
+    config['input_anc_dir']   =   Config.get("DirStructure","input_anc_dir")
+    config['work_dir']        =   Config.get("DirStructure","work_dir")
+    config['output_dir']      =   Config.get("DirStructure","output_dir")
+    config['log_dir']         =   Config.get("DirStructure","log_dir")
+
+    config['land_cover']      =   Config.get("AncFiles","land_cover")
+    config['DEM_file']        =   Config.get("AncFiles","DEM_file")
+
+    config['import_image']    =   Config.getint("ProcessPar","import_image")
+    config['ortho_image']     =   Config.getint("ProcessPar","ortho_image")
+    config['filter_image']    =   Config.getint("ProcessPar","filter_image")
+    config['scale_image']     =   Config.getint("ProcessPar","scale_image")
+    config['thres_image']     =   Config.getint("ProcessPar","thres_image")
+    config['import_veg']      =   Config.getint("ProcessPar","import_veg")
+    config['cal_thres']       =   Config.getint("ProcessPar","cal_thres")
+
+    config['image_pro']       =   Config.get("DataPar","image_pro")
+    config['image_pixspac_x'] =   Config.getint("DataPar","image_pixspac_x")
+    config['image_pixspac_y'] =   Config.getint("DataPar","image_pixspac_y")
+    config['veg_thres']       =   Config.getfloat("DataPar","veg_thres")
+    config['openwater_thres'] =   Config.getfloat("DataPar","openwater_thres")
+    config['openwater_seed']  =   Config.get("DataPar","openwater_seed")
+    config['floodveg_seed']   =   Config.get("DataPar","floodveg_seed")
+    config['nfloodveg_seed']  =   Config.get("DataPar","nfloodveg_seed")
+
+    if Config.has_option("ProcessPar","engine"):
+        config['engine']      =   Config.get("ProcessPar","engine").upper()
+    if Config.has_option("ProcessPar","workers"):
+        config['workers']     =   Config.getint("ProcessPar","workers")
+    if Config.has_option("ProcessPar","ortho_workers"):
+        config['ortho_workers'] = Config.getint("ProcessPar","ortho_workers")
+    if Config.has_option("ProcessPar","compact"):
+        config['compact']     =   Config.getint("ProcessPar","compact")
+
+    config['mode']            =   Config.get("ProcessMode","mode")
+    config['refr_file']       =   Config.get("Testparameters","refr_file")
+    config['refp_file']       =   Config.get("Testparameters","refp_file")
+    config['refp2_file']      =   Config.get("Testparameters","refp2_file")
+    return config
+
+
+def run(config):
+    """
+    Create the vegetation flood products of the RADARSAT-2 datasets of a directory
+
+    Called by the command line (main) or directly by another tool (e.g.
+    FT4_FloodVegExtraction) in its own interpreter, so that PCI Geomatica and
+    the other modules are imported once and the DEM tiles clipped by earlier
+    runs are reused.  The log records of the run are written to a new log
+    file in log_dir and passed to the handlers already attached to the root
+    logger (console, ArcGIS tool messages).
+
+    Parameters:
+        config -- Dictionary of processing parameters, keys as in read_config:
+                  input_dir, input_anc_dir, work_dir, output_dir, log_dir,
+                  land_cover, DEM_file, import_image, ortho_image, filter_image,
+                  scale_image, thres_image, import_veg, cal_thres, image_pro,
+                  image_pixspac_x, image_pixspac_y and mode; optionally
+                  veg_thres, openwater_thres, openwater_seed, floodveg_seed,
+                  nfloodveg_seed, engine, workers, ortho_workers, compact, refr_file,
+                  refp_file, refp2_file and test
+
+    Return value:
+        0 when successful, 1 otherwise.
+
+    """
+    log_dir = config['log_dir']
+
+    # Check if Log directory exists
+    if not os.path.isdir(log_dir):
+        print "Log directory not found, creating log directory: ", log_dir
+        os.makedirs(log_dir)
+
+    #Setup logger, one log file per run
+    datetime1 = dt.now().strftime('_%Y_%m_%d_%H_%M_%S_')
+    logfile = log_dir + 'EGS_process_' + datetime1 + '.log'
+    log_handler = logging.FileHandler(logfile)
+    log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root_logger = logging.getLogger('')
+    root_level = root_logger.level
+    root_logger.addHandler(log_handler)
+    root_logger.setLevel(logging.DEBUG)
+    try:
+        return process(config)
+    finally:
+        # Logging of the calling tool (e.g. ArcGIS) left as found
+        root_logger.removeHandler(log_handler)
+        root_logger.setLevel(root_level)
+        log_handler.close()
+
+
+def process(config):
+    """
+    Mainline of run, once the logger is set up
+
+    Parameters:
+        config -- Dictionary of processing parameters, see run
+
+    Return value:
+        0 when successful, 1 otherwise.
+
+    """
+    input_dir       =   config['input_dir']
+    input_anc_dir   =   config['input_anc_dir']
+    work_dir        =   config['work_dir']
+    output_dir      =   config['output_dir']
+    log_dir         =   config['log_dir']
+    land_cover      =   config['land_cover']
+    DEM_file        =   config['DEM_file']
+    import_image    =   config['import_image']
+    ortho_image     =   config['ortho_image']
+    filter_image    =   config['filter_image']
+    scale_image     =   config['scale_image']
+    thres_image     =   config['thres_image']
+    import_veg      =   config['import_veg']
+    cal_thres       =   config['cal_thres']
+    image_pro       =   config['image_pro']
+    image_pixspac_x =   config['image_pixspac_x']
+    image_pixspac_y =   config['image_pixspac_y']
+    veg_thres       =   config.get('veg_thres', None)
+    openwater_thres =   config.get('openwater_thres', None)
+    openwater_seed  =   config.get('openwater_seed', None)
+    floodveg_seed   =   config.get('floodveg_seed', None)
+    nfloodveg_seed  =   config.get('nfloodveg_seed', None)
+    engine          =   config.get('engine', 'PCI')
+    workers         =   int(config.get('workers', 1))
+    ortho_workers   =   int(config.get('ortho_workers', 1))
+    compact         =   int(config.get('compact', 0))
+    mode            =   config.get('mode', '')
+    refr_file       =   config.get('refr_file', '')
+    refp_file       =   config.get('refp_file', '')
+    refp2_file      =   config.get('refp2_file', '')
+    test            =   config.get('test', 0)
+
+    logging.info('Executing  EGS Merge processing: EGS_merge.py' )
+    logging.info('   EGS VEG PROCESS PARAMETER SETTINGS:')
+    logging.info('       Input dir: ' + input_dir)
+    logging.info('       Input ancillary dir: ' + input_anc_dir)
+    logging.info('       Working dir: ' + work_dir)
+    logging.info('       Output dir: ' + output_dir)
+    logging.info('       Log dir: ' + log_dir)
+    logging.info('       land cover: ' + land_cover)
+    logging.info('       DEM file: ' + DEM_file)
+    logging.info('       Import image:' + str(import_image))
+    logging.info('       Ortho image: ' + str(ortho_image))
+    logging.info('       Filter image: ' + str(filter_image))
+    logging.info('       Scale image: ' + str(scale_image))
+    logging.info('       Import Veg Land Cover: ' + str(import_veg))
+    logging.info('       Threshold image: ' + str(thres_image))
+    logging.info('       Veg threshold: ' + str(veg_thres))
+    logging.info('       Open water threshold: ' + str(openwater_thres))
+    logging.info('       Calculate thresholds: ' + str(cal_thres))
+    logging.info('       Open water seed file: ' + str(openwater_seed))
+    logging.info('       Flood Vegetation seed file: ' + str(floodveg_seed))
+    logging.info('       Non Flood Vegetation seed file: ' + str(nfloodveg_seed))
+    logging.info('       Image projection info: ' + str(image_pro))
+    logging.info('       Image pixel spacing x: ' + str(image_pixspac_x))
+    logging.info('       Image pixel spacing y: ' + str(image_pixspac_y))
+    logging.info('       Engine: ' + engine)
+    logging.info('       Workers: {0} ({1} orthorectifying)'.format(workers, ortho_workers))
+    logging.info('       Compact vegflood output: ' + str(compact))
+    logging.info('       Mode: ' + mode)
+    logging.info('       Reference raster file: ' + refr_file)
+    logging.info('       Reference PCIDSK file: ' + refp_file)
+    logging.info('')
+
+    # Check if directory structure is correct.
+    if not os.path.isdir(input_dir):
+        logging.info('No input directory defined by as:  ' + input_dir)
+        logging.info('Creating input directory and exiting. Please add RADARSAT-2 datasets to this')
+        logging.info('directory and restart process.')
+        os.makedirs(input_dir)
+        return 1
+    if not os.path.isdir(input_anc_dir):
+        logging.info('No ancillary directory defined by as:  ' + input_anc_dir)
+        logging.info('Creating ancillary directory and exiting. Please add ancillary datasets')
+        logging.info('(e.g. Vegetation Land Cover data) to this directory and restart process.')
+    ##    os.makedirs(input_anc_dir)
+        return 1
+    if not os.path.isdir(work_dir):
+        logging.info('Working directory not found, creating working directory:  ' + work_dir)
+        os.makedirs(work_dir)
+    if not os.path.isdir(output_dir):
+        logging.info('Output directory not found, creating working directory:  ' + output_dir)
+        os.makedirs(output_dir)
+
+    if cal_thres:
+        logging.info('   Validating thresholds...  ')
+        # if calculating thresholds, check to see if seed files exist.
+        openwater_seed = os.path.join(input_anc_dir, openwater_seed)
+        # Check if open water seed file exists
+        if not os.path.exists(openwater_seed):
+            logging.info('   File must exist in order to import: ' + openwater_seed)
+            logging.info('   Proceding with default values')
+    ##        return 1
+        floodveg_seed = os.path.join(input_anc_dir, floodveg_seed)
+        # Check if flood veg seed file exists
+        if not os.path.exists(floodveg_seed):
+            logging.info('   File must exist in order to import: ' + floodveg_seed)
+            logging.info('   Proceding with default values')
+    ##        return 1
+        nfloodveg_seed = os.path.join(input_anc_dir, nfloodveg_seed)
+        # Check if non-flood veg seed file exists
+        if not os.path.exists(nfloodveg_seed):
+            logging.info('   File must exist in order to import: ' + nfloodveg_seed)
+            logging.info('   Proceding with default values')
+    ##        return 1
+
+    # Determine if the vegetation land cover shapefile exists.
+    # for anc_subdir, anc_dirs, anc_files in os.walk(input_anc_dir):
+        # for anc_file in anc_files:
+            # if anc_file.endswith (land_cover):
+                # in_file_veg = os.path.join(anc_subdir, anc_file)
+                # out_file_veg =  work_dir + os.path.splitext(anc_file)[0] + '.pix'
+                # logging.info('   input Veg Land Cover: ' + in_file_veg)
+                # logging.info('   output Veg Land Cover: ' + out_file_veg)
+
+    in_file_veg = land_cover
+    out_veg_basename = os.path.splitext(os.path.basename(land_cover))
+    out_file_veg = os.path.join(work_dir, 'working', out_veg_basename[0],'.pix')
+    logging.info('   input Veg Land Cover: ' + in_file_veg)
+    logging.info('   output Veg Land Cover: ' + out_file_veg)
+
+    # Check if reference files exists if testing
+    if test > 0:
+        if not os.path.exists(refr_file):
+            logging.info('   Reference raster file must exist when run comparison test: ' + refr_file)
+            return 1
+    if test > 1:
+        if not os.path.exists(refp_file):
+            logging.info('   Reference PCIDSK file must exist when run comparison test: ' + refp_file)
+            return 1
+        if not os.path.exists(refp2_file):
+            logging.info('   Reference PCIDSK file must exist when run comparison test: ' + refp2_file)
+            return 1
+
+    # The NUMPY engine filters, scales and thresholds in one pass, and
+    # calculates thresholds from seed files without the scaled channel
+    fused = engine == 'NUMPY' and filter_image and scale_image and thres_image
+    if engine == 'NUMPY' and not fused:
+        logging.info('   NUMPY engine requires filter, scale and threshold, using PCI engine')
+
+    # Land cover index and DEM index built once, before products are
+    # processed in worker processes
+    if DEM_file not in dem_caches:
+        dem_caches[DEM_file] = dem_cache.DemCache(DEM_file)
+    if engine == 'NUMPY' and land_cover not in landcover_caches:
+        landcover_caches[land_cover] = landcover_cache.LandcoverCache(land_cover)
+    product_config = dict(config)
+    product_config.update({'openwater_seed' : openwater_seed, 'floodveg_seed' : floodveg_seed,
+                           'nfloodveg_seed' : nfloodveg_seed, 'fused' : fused})
+
+    # Process all RADARSAT-2 datasets (products) in the input directory.
+    # Products are listed from the scene catalog; only new or changed
+    # directories and product.xml files are read from disk.
+    scene_cat = scene_catalog.SceneCatalog(os.path.join(work_dir, scene_catalog.CATALOG_NAME))
+    tasks = []
+    for subdir, dirs, files in scene_cat.walk(input_dir):
+        for file in files:
+            if file.endswith ('product.xml'):
+                in_file = os.path.join(subdir, file)
+                scene = scene_cat.scene(in_file)
+                tasks.append((product_config, in_file, scene['bounds'] if scene else None))
+    scene_cat.close()
+
+    # Products are processed concurrently in worker processes, at most
+    # ortho_workers of them orthorectifying at a time
+    if workers > 1 and len(tasks) > 1 and worker_executable() is None:
+        logging.info('   No Python interpreter for worker processes, processing one product at a time')
+        workers = 1
+    if workers > 1 and len(tasks) > 1:
+        logging.info('   Processing {0} products in {1} worker processes'.format(
+                     len(tasks), min(workers, len(tasks))))
+        pool = multiprocessing.Pool(min(workers, len(tasks)), init_worker,
+                                    (multiprocessing.BoundedSemaphore(ortho_workers),))
+        try:
+            results = pool.map(process_product_task, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
     else:
-        nfloodveg_seed = None
-    if args.m is not None:
-        mode = args.m
-    if args.refr_file is not None:
-        refr_file = args.refr_file
-    if args.refp_file is not None:
-        refp_file = args.refp_file
-    if args.refp2_file is not None:
-        refp2_file = args.refp2_file
-
-verbose = False
-if len(sys.argv) > 1:
-    if args.verbose:
-        verbose = True
-
-test =0
-if len(sys.argv) > 1:
-    if args.test:
-        test = args.test
-
-# Check if Log directory exists
-if not os.path.isdir(log_dir):
-    print "Log directory not found, creating log directory: ", log_dir
-    os.makedirs(log_dir)
-
-#Setup logger
-datetime1 = dt.now().strftime('_%Y_%m_%d_%H_%M_%S_')
-logfile = log_dir + 'EGS_process_' + datetime1 + '.log'
-EGS_utility.EGSUtility().setup_logger(logfile, verbose)
-
-logging.info('Executing  EGS Merge processing: EGS_merge.py' )
-logging.info('   EGS VEG PROCESS PARAMETER SETTINGS:')
-logging.info('       Input dir: ' + input_dir)
-logging.info('       Input ancillary dir: ' + input_anc_dir)
-logging.info('       Working dir: ' + work_dir)
-logging.info('       Output dir: ' + output_dir)
-logging.info('       Log dir: ' + log_dir)
-logging.info('       land cover: ' + land_cover)
-logging.info('       DEM file: ' + DEM_file)
-logging.info('       Import image:' + str(import_image))
-logging.info('       Ortho image: ' + str(ortho_image))
-logging.info('       Filter image: ' + str(filter_image))
-logging.info('       Scale image: ' + str(scale_image))
-logging.info('       Import Veg Land Cover: ' + str(import_veg))
-logging.info('       Threshold image: ' + str(thres_image))
-logging.info('       Veg threshold: ' + str(veg_thres))
-logging.info('       Open water threshold: ' + str(openwater_thres))
-logging.info('       Calculate thresholds: ' + str(cal_thres))
-logging.info('       Open water seed file: ' + str(openwater_seed))
-logging.info('       Flood Vegetation seed file: ' + str(floodveg_seed))
-logging.info('       Non Flood Vegetation seed file: ' + str(nfloodveg_seed))
-logging.info('       Image projection info: ' + str(image_pro))
-logging.info('       Image pixel spacing x: ' + str(image_pixspac_x))
-logging.info('       Image pixel spacing y: ' + str(image_pixspac_y))
-logging.info('       Mode: ' + mode)
-logging.info('       Reference raster file: ' + refr_file)
-logging.info('       Reference PCIDSK file: ' + refp_file)
-logging.info('')
-
-# Check if directory structure is correct.
-if not os.path.isdir(input_dir):
-    logging.info('No input directory defined by as:  ' + input_dir)
-    logging.info('Creating input directory and exiting. Please add RADARSAT-2 datasets to this')
-    logging.info('directory and restart process.')
-    os.makedirs(input_dir)
-    sys.exit(1)
-if not os.path.isdir(input_anc_dir):
-    logging.info('No ancillary directory defined by as:  ' + input_anc_dir)
-    logging.info('Creating ancillary directory and exiting. Please add ancillary datasets')
-    logging.info('(e.g. Vegetation Land Cover data) to this directory and restart process.')
-##    os.makedirs(input_anc_dir)
-    sys.exit(1)
-if not os.path.isdir(work_dir):
-    logging.info('Working directory not found, creating working directory:  ' + work_dir)
-    os.makedirs(work_dir)
-if not os.path.isdir(output_dir):
-    logging.info('Output directory not found, creating working directory:  ' + output_dir)
-    os.makedirs(output_dir)
-
-if cal_thres:
-    logging.info('   Validating thresholds...  ')
-    # if calculating thresholds, check to see if seed files exist.
-    openwater_seed = os.path.join(input_anc_dir, openwater_seed)
-    # Check if open water seed file exists
-    if not os.path.exists(openwater_seed):
-        logging.info('   File must exist in order to import: ' + openwater_seed)
-        logging.info('   Proceding with default values')
-##        sys.exit(1)
-    floodveg_seed = os.path.join(input_anc_dir, floodveg_seed)
-    # Check if flood veg seed file exists
-    if not os.path.exists(floodveg_seed):
-        logging.info('   File must exist in order to import: ' + floodveg_seed)
-        logging.info('   Proceding with default values')
-##        sys.exit(1)
-    nfloodveg_seed = os.path.join(input_anc_dir, nfloodveg_seed)
-    # Check if non-flood veg seed file exists
-    if not os.path.exists(nfloodveg_seed):
-        logging.info('   File must exist in order to import: ' + nfloodveg_seed)
-        logging.info('   Proceding with default values')
-##        sys.exit(1)
-
-# Determine if the vegetation land cover shapefile exists.
-# for anc_subdir, anc_dirs, anc_files in os.walk(input_anc_dir):
-    # for anc_file in anc_files:
-        # if anc_file.endswith (land_cover):
-            # in_file_veg = os.path.join(anc_subdir, anc_file)
-            # out_file_veg =  work_dir + os.path.splitext(anc_file)[0] + '.pix'
-            # logging.info('   input Veg Land Cover: ' + in_file_veg)
-            # logging.info('   output Veg Land Cover: ' + out_file_veg)
-
-in_file_veg = land_cover
-out_veg_basename = os.path.splitext(os.path.basename(land_cover))
-out_file_veg = os.path.join(work_dir, 'working', out_veg_basename[0],'.pix')
-logging.info('   input Veg Land Cover: ' + in_file_veg)
-logging.info('   output Veg Land Cover: ' + out_file_veg)
-
-# Check if reference files exists if testing
-if test > 0:
-    if not os.path.exists(refr_file):
-        logging.info('   Reference raster file must exist when run comparison test: ' + refr_file)
-        sys.exit(1)
-if test > 1:
-    if not os.path.exists(refp_file):
-        logging.info('   Reference PCIDSK file must exist when run comparison test: ' + refp_file)
-        sys.exit(1)
-    if not os.path.exists(refp2_file):
-        logging.info('   Reference PCIDSK file must exist when run comparison test: ' + refp2_file)
-        sys.exit(1)
-
-# Assign processing variables
-report_file = work_dir  + 'report.txt'
-veg_process = veg_flood_process.VegFloodProcess()
-ortho_m = ortho_mosaic.OrthoMosaic()
-in_file = ''
-out_file = ''
-out_file_ortho = ''
-out_file_vegflood = ''
-image_stats = []
-filter_channel = ''
-scale_channel = ''
-flood_seg= []
-
-# Process all RADARSAT-2 datasets (products) in the input directory.
-for subdir, dirs, files in os.walk(input_dir):
-    for file in files:
-        if file.endswith ('product.xml'):
-            in_file = os.path.join(subdir, file)
-            out_file =  work_dir + os.path.basename(os.path.normpath(subdir))[30:49] + '.pix'
-            out_file_ortho = work_dir + os.path.basename(os.path.normpath(subdir))[30:49] + '_ortho.pix'
-            out_file_vegflood = output_dir + os.path.basename(os.path.normpath(subdir))[30:49] + '_vegflood.tif'
-
-            logging.info('')
-            logging.info('Processing')
-            logging.info('   input: ' + in_file)
-            logging.info('   PCIPIX output: '  + out_file)
-            logging.info('   ortho output: ' + out_file_ortho)
-            logging.info('')
-
-            # Import RADARSAT-2 Imagery
-            if import_image:
-                if not os.path.isfile(in_file):
-                    logging.info('   File must exist in order to import:' + in_file)
-                else:
-                    if os.path.isfile(out_file):
-                        logging.info('   Not importing, file already exists: ' + out_file)
+        results = [process_product_task(task) for task in tasks]
+
+    logging.info('')
+    logging.info('Products processed')
+    failed = 0
+    for result in results:
+        message = '   {0}: {1}, {2:.0f} s, log file {3}'.format(result['product'],
+                  'completed' if result['status'] == 0 else 'FAILED', result['seconds'], result['log'])
+        if result['status'] != 0:
+            logging.error(message)
+            failed += 1
+        else:
+            logging.info(message)
+    logging.info('Completed EGS_Process')
+    return 1 if failed else 0
+
+
+def worker_executable():
+    """
+    Python interpreter started for the worker processes of process
+
+    On Windows, worker processes are new processes of sys.executable, which
+    is the host application (e.g. ArcMap.exe) when run is called in-process
+    by a tool: the Python interpreter of the installation is used instead.
+
+    Return value:
+        Interpreter, None when no Python interpreter is found.
+
+    """
+    if os.name != 'nt':
+        return sys.executable       # Workers are forked
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    for name in ('python.exe', 'pythonw.exe'):
+        executable = os.path.join(sys.exec_prefix, name)
+        if os.path.isfile(executable):
+            multiprocessing.set_executable(executable)
+            return executable
+    return None
+
+
+def init_worker(ortho_semaphore):
+    """
+    Initialisation of a worker process of process
+
+    Parameters:
+        ortho_semaphore -- Semaphore shared by the workers, limiting the
+                           number of products orthorectified at a time
+
+    """
+    global ortho_slots
+    ortho_slots = ortho_semaphore
+    # Records of the worker only go to the log file of its product
+    root_logger = logging.getLogger('')
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.setLevel(logging.DEBUG)
+
+
+def process_product_task(task):
+    """
+    Process a product, its log records written to a log file of its own
+
+    Parameters:
+        task -- (config, product.xml file, scene bounds), see process_product
+
+    Return value:
+        Dictionary of the product result: 'product' (product.xml file),
+        'status' (0 when successful), 'log' (log file) and 'seconds'.
+
+    """
+    config, in_file, bounds = task
+    product = os.path.basename(os.path.dirname(os.path.abspath(in_file)))[30:49]
+    datetime1 = dt.now().strftime('_%Y_%m_%d_%H_%M_%S_')
+    logfile = config['log_dir'] + 'EGS_process_' + product + datetime1 + '.log'
+    log_handler = logging.FileHandler(logfile)
+    log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root_logger = logging.getLogger('')
+    root_logger.addHandler(log_handler)
+    start = time.time()
+    try:
+        status = process_product(config, in_file, bounds)
+    except Exception:
+        logging.exception('   Processing failed: ' + in_file)
+        status = 1
+    finally:
+        root_logger.removeHandler(log_handler)
+        log_handler.close()
+    return {'product' : in_file, 'status' : status, 'log' : logfile,
+            'seconds' : time.time() - start}
+
+
+def process_product(config, in_file, bounds=None):
+    """
+    Process a product: import, orthorectify, filter, scale, threshold and
+    create the flooded vegetation product, as configured
+
+    Parameters:
+        config  -- Dictionary of processing parameters, see run, with the seed
+                   files joined to input_anc_dir and fused (see process)
+        in_file -- product.xml file
+        bounds  -- Scene bounds from the scene catalog, for the DEM tile; the
+                   whole DEM file is used otherwise
+
+    Return value:
+        0 when successful.
+
+    """
+    work_dir        =   config['work_dir']
+    output_dir      =   config['output_dir']
+    land_cover      =   config['land_cover']
+    DEM_file        =   config['DEM_file']
+    import_image    =   config['import_image']
+    ortho_image     =   config['ortho_image']
+    filter_image    =   config['filter_image']
+    scale_image     =   config['scale_image']
+    thres_image     =   config['thres_image']
+    import_veg      =   config['import_veg']
+    cal_thres       =   config['cal_thres']
+    image_pro       =   config['image_pro']
+    image_pixspac_x =   config['image_pixspac_x']
+    image_pixspac_y =   config['image_pixspac_y']
+    veg_thres       =   config.get('veg_thres', None)
+    openwater_thres =   config.get('openwater_thres', None)
+    openwater_seed  =   config.get('openwater_seed', None)
+    floodveg_seed   =   config.get('floodveg_seed', None)
+    nfloodveg_seed  =   config.get('nfloodveg_seed', None)
+    engine          =   config.get('engine', 'PCI')
+    compact         =   int(config.get('compact', 0))
+    refr_file       =   config.get('refr_file', '')
+    refp_file       =   config.get('refp_file', '')
+    refp2_file      =   config.get('refp2_file', '')
+    test            =   config.get('test', 0)
+    fused           =   config.get('fused', False)
+
+    # Working files of the product
+    product = os.path.basename(os.path.dirname(os.path.abspath(in_file)))[30:49]
+    out_file = work_dir + product + '.pix'
+    out_file_ortho = work_dir + product + '_ortho.pix'
+    if fused:
+        # Calibrated and orthorectified from product.xml (see sar_ortho)
+        out_file_ortho = work_dir + product + '_ortho.tif'
+    out_file_vegflood = output_dir + product + '_vegflood.tif'
+    report_file = work_dir + product + '_report.txt'
+
+    # Assign processing variables
+    veg_process = veg_flood_process.VegFloodProcess()
+    ortho_m = ortho_mosaic.OrthoMosaic()
+    if DEM_file not in dem_caches:
+        dem_caches[DEM_file] = dem_cache.DemCache(DEM_file)
+    dem_c = dem_caches[DEM_file]
+    if engine == 'NUMPY' and land_cover not in landcover_caches:
+        landcover_caches[land_cover] = landcover_cache.LandcoverCache(land_cover)
+    # Intermediates of the NUMPY engine are kept out of the ortho file, in
+    # arrays removed once exported
+    store = None
+    if fused:
+        store = work_store.WorkStore(work_dir + product + '_store')
+    # Stages completed by a previous run are skipped, see stage_manifest
+    manifest = stage_manifest.StageManifest(work_dir + product + '_manifest.json')
+    filter_channel = ''
+    scale_channel = ''
+    flood_seg= []
+    thres_key = None
+    export_params = {'fused' : fused, 'compact' : compact}
+
+    def exported():
+        """Export current, made from the current threshold and land cover stages"""
+        return (manifest.current('threshold', thres_key, False) and
+                manifest.current('vegcover', veg_key, False) and
+                manifest.current('export', manifest.key(params=export_params,
+                                                        upstream=['threshold', 'vegcover'])))
+
+    logging.info('')
+    logging.info('Processing')
+    logging.info('   input: ' + in_file)
+    logging.info('   PCIPIX output: '  + out_file)
+    logging.info('   ortho output: ' + out_file_ortho)
+    logging.info('   manifest: ' + manifest.manifest_file)
+    logging.info('')
+
+    # Import RADARSAT-2 Imagery
+    if import_image and fused:
+        logging.info('   Not importing, NUMPY engine reads product.xml: ' + in_file)
+    elif import_image:
+        if not os.path.isfile(in_file):
+            logging.info('   File must exist in order to import:' + in_file)
+        else:
+            import_key = manifest.key([in_file])
+            if manifest.current('import', import_key):
+                logging.info('   Not importing, file already imported: ' + out_file)
+            else:
+                if os.path.isfile(out_file):
+                    logging.info('   Removing incomplete or outdated import: ' + out_file)
+                    os.remove(out_file)
+                logging.info('   Importing: ' + in_file)
+                ortho_m.import_sar(in_file,out_file)
+                if os.path.isfile(out_file):
+                    manifest.record('import', import_key, [out_file])
+
+    # Orthorectify imagery
+    if ortho_image:
+        ortho_in_file = in_file if fused else out_file
+        if not os.path.isfile(ortho_in_file):
+            logging.info('   File must exist in order to ortho: ' + ortho_in_file)
+        else:
+            ortho_key = manifest.key([ortho_in_file, DEM_file], {'image_pro' : image_pro,
+                                     'image_pixspac_x' : image_pixspac_x,
+                                     'image_pixspac_y' : image_pixspac_y, 'fused' : fused})
+            if manifest.current('ortho', ortho_key):
+                logging.info('   No ortho applied, file already orthorectified: ' + out_file_ortho)
+            else:
+                if os.path.isfile(out_file_ortho):
+                    logging.info('   Removing incomplete or outdated ortho: ' + out_file_ortho)
+                    os.remove(out_file_ortho)
+                logging.info('   Orthorectify image in process for ' + out_file_ortho)
+                if ortho_slots is not None:
+                    ortho_slots.acquire()
+                try:
+                    dem_tile = None
+                    if bounds is not None:
+                        dem_tile = dem_c.clip(bounds, image_pro)
+                    if dem_tile is None:
+                        logging.info('   DEM does not cover scene, using: ' + DEM_file)
+                        dem_tile = DEM_file
+                    if fused:
+                        # Sigma nought calibrated as the windows are read, as saringest
+                        ortho_e = sar_ortho.SarOrtho(in_file, lut=sar_calibrate.SIGMA_LUT)
+                        ortho_e.orthorectify(out_file_ortho,dem_tile,image_pixspac_x,image_pixspac_y,image_pro)
                     else:
-                        logging.info('   Importing: ' + in_file)
-                        ortho_m.import_sar(in_file,out_file)
+                        ortho_m.orthorectify(out_file,out_file_ortho,dem_tile,image_pixspac_x,image_pixspac_y,image_pro)
+                finally:
+                    if ortho_slots is not None:
+                        ortho_slots.release()
+                if os.path.isfile(out_file_ortho):
+                    manifest.record('ortho', ortho_key, [out_file_ortho])
 
-            # Orthorectify imagery
-            if ortho_image:
-                if not os.path.isfile(out_file):
-                    logging.info('   File must exist in order to ortho: ' + out_file)
+    # Filter imagery
+    if filter_image and not fused:
+        if not os.path.isfile(out_file_ortho):
+            logging.info('   File must exist in order to apply filter:' + out_file_ortho)
+        else:
+            filter_key = manifest.key(params={'filter_size' : 5, 'num_looks' : 4.0}, upstream=['ortho'])
+            filter_channel = None
+            if manifest.current('filter', filter_key):
+                filter_channel = recorded_channel(out_file_ortho, manifest.values('filter'))
+                if filter_channel is None:
+                    logging.info('   Filtered channel not found, filtering again')
+                    manifest.invalidate('filter')
                 else:
-                    if os.path.isfile(out_file_ortho):
-                        logging.info('   No ortho applied, file already exists: ' + out_file_ortho)
-                    else:
-                        logging.info('   Orthorectify image in process for ' + out_file_ortho)
-                        ortho_m.orthorectify(out_file,out_file_ortho,DEM_file,image_pixspac_x,image_pixspac_y,image_pro)
+                    logging.info('   Not filtering, filter already applied: channel ' + filter_channel)
+            if filter_channel is None:
+                logging.info('   Filtering image in process for ' + out_file_ortho)
+                filter_channel = veg_process.filter_sar(out_file_ortho)
+                if filter_channel is not None:
+                    manifest.record('filter', filter_key, [out_file_ortho],
+                                    channel_values(out_file_ortho, filter_channel))
 
-            # Filter imagery
-            if filter_image:
-                if not os.path.isfile(out_file_ortho):
-                    logging.info('   File must exist in order to apply filter:' + out_file_ortho)
+    # Scale imagery
+    if scale_image and not fused:
+        if not filter_image:
+            filter_channel = "3"
+        if not os.path.isfile(out_file_ortho):
+            logging.info('   File must exist in order to apply scale: ' + out_file_ortho)
+        else:
+            # Filtered channel identified by the filter stage when filtered
+            scale_key = manifest.key(params={'filter_channel' : None if filter_image else filter_channel},
+                                     upstream=['ortho', 'filter'])
+            scale_channel = None
+            if manifest.current('scale', scale_key):
+                scale_channel = recorded_channel(out_file_ortho, manifest.values('scale'))
+                if scale_channel is None:
+                    logging.info('   Scaled channel not found, scaling again')
+                    manifest.invalidate('scale')
                 else:
-                    logging.info('   Filtering image in process for ' + out_file_ortho)
-                    filter_channel = veg_process.filter_sar(out_file_ortho)
-
-            # Scale imagery
-            if scale_image:
-                if not filter_image:
-                    filter_channel = "3"
-                if not os.path.isfile(out_file_ortho):
-                    logging.info('   File must exist in order to apply scale: ' + out_file_ortho)
+                    logging.info('   Not scaling, scale already applied: channel ' + scale_channel)
+            if scale_channel is None:
+                logging.info('   Scaling image in process for ' + out_file_ortho)
+                scale_channel = veg_process.scale_sar(out_file_ortho, filter_channel)
+                logging.info('       scale_channel: ' + scale_channel)
+                if scale_channel is not None:
+                    manifest.record('scale', scale_key, [out_file_ortho],
+                                    channel_values(out_file_ortho, scale_channel))
+
+    veg_key = manifest.key([land_cover], {'engine' : engine, 'fused' : fused}, ['ortho'])
+
+    # Threshold imagery: Low for open water, high for flooded vegetation
+    if thres_image:
+        if not scale_image:
+            scale_channel = "4"
+        # Scaled channel identified by the scale stage when scaled, its number
+        # changes as 8-bit channels are added
+        thres_channel = None if scale_image else scale_channel
+        logging.info('   Threshold imagery in process...  ')
+        if cal_thres:
+            cal_key = manifest.key([openwater_seed, nfloodveg_seed, floodveg_seed],
+                                   {'fused' : fused, 'scale_channel' : thres_channel,
+                                    'veg_thres' : veg_thres, 'openwater_thres' : openwater_thres},
+                                   ['ortho', 'filter', 'scale'])
+            if manifest.current('calibrate', cal_key):
+                veg_thres = manifest.values('calibrate')['veg_thres']
+                openwater_thres = manifest.values('calibrate')['openwater_thres']
+                logging.info('   Thresholds already calculated from seed files')
+                logging.info('       veg_thres: ' + str(veg_thres))
+                logging.info('       openwater_thres: ' + str(openwater_thres))
+            else:
+                logging.info('   Calculating thresholds from seed files...  ')
+
+                if fused:
+                    # Seeds rasterized into one label array over the seed window,
+                    # statistics of all seeds in one pass: no vector import or bitmaps
+                    seed_info = seed_stats.SeedStats().statistics(out_file_ortho, 1,
+                                    [openwater_seed, nfloodveg_seed, floodveg_seed])
+                    water_mean = seed_info[0]['mean']
+                    water_std_dev = seed_info[0]['std']
+                    veg_non_flood_mean = seed_info[1]['mean']
+                    veg_non_flood_std_dev = seed_info[1]['std']
+                    veg_flood_mean = seed_info[2]['mean']
+                    veg_flood_std_dev = seed_info[2]['std']
                 else:
-                    logging.info('   Scaling image in process for ' + out_file_ortho)
-                    scale_channel = veg_process.scale_sar(out_file_ortho, filter_channel)
-                    logging.info('       scale_channel: ' + scale_channel)
-
-            # Threshold imagery: Low for open water, high for flooded vegetation
-            if thres_image:
-                if not scale_image:
-                    scale_channel = "4"
-                logging.info('   Threshold imagery in process...  ')
-                if cal_thres:
-                    logging.info('   Calculating thresholds from seed files...  ')
-
-                    # Work around for determining new vector segments
-                    #   Add bitmap just to determine segment number
-                    #   The following 3 vector segments will be consecutive #s after this bitmap
+                    # Vector segment numbers from the allocation tracker of the file
                     #   PCI 2016 support Vector segment read, but not PCI2015
                     #   gdal can not determine the correct vector segment #
-                    #   Create and name newly created segment
-                    dataset = ds.open_dataset(out_file_ortho, ds.eAM_WRITE)
-                    #   Get the number of the newly created bitmap segment
-                    bitmap_seg = dataset.create_bitmap()
+                    tracker = EGS_utility.EGSUtility().allocation_tracker(out_file_ortho)
+                    water_vseg = tracker.reserve_segment()
                     veg_process.import_vector(openwater_seed,out_file_ortho)
+                    veg_non_flood_vseg = tracker.reserve_segment()
                     veg_process.import_vector(nfloodveg_seed,out_file_ortho)
+                    veg_flood_vseg = tracker.reserve_segment()
                     veg_process.import_vector(floodveg_seed,out_file_ortho)
-                    water_vseg = bitmap_seg + 1
-                    veg_non_flood_vseg = bitmap_seg + 2
-                    veg_flood_vseg = bitmap_seg + 3
 
                     water_bseg = veg_process.vegcover2bit(out_file_ortho, out_file_ortho,water_vseg)
                     veg_non_flood_bseg = veg_process.vegcover2bit(out_file_ortho, out_file_ortho,veg_non_flood_vseg)
@@ -505,88 +816,320 @@ for subdir, dirs, files in os.walk(input_dir):
                     veg_non_flood_std_dev = stat_info_veg_non_flood[3]
                     veg_flood_mean = stat_info_veg_flood[1]
                     veg_flood_std_dev = stat_info_veg_flood[3]
-                    water_max = water_mean + 2*water_std_dev
-                    non_flood_min = veg_non_flood_mean - 2*veg_non_flood_std_dev
-                    non_flood_max = veg_non_flood_mean + 2*veg_non_flood_std_dev
-                    flood_min = veg_flood_mean - 2*veg_flood_std_dev
-
-                    if ((water_max < non_flood_min)&(flood_min > non_flood_max)):
-                        veg_thres = flood_min
-                        openwater_thres = water_max
-                    else:
-                        logging.info('       SEED ERROR: ' )
-                        logging.info('            Seed polygons must be modified or threshold values must be manually calculated and ' )
-                        logging.info('           provided as input. ' )
-                        logging.info('            The following criteria must be met but was not, therefore process stopped: ' )
-                        logging.info('            (water_max < non_flood_min)&(flood_min > non_flood_max) ' )
-                        logging.info('            The following seed values were determined from the seed polygons:' )
-                        logging.info('              Water max value: ' + str(water_max))
-                        logging.info('              Non flood veg min value: ' + str(non_flood_min))
-                        logging.info('              Flood veg min value: ' + str(flood_min))
-                        logging.info('              Proceeding with default value of -3.5 and -12.5 for open water and flooded vegetation')
-
-                        print '       SEED ERROR: '
-                        print '            Seed polygons must be modified or threshold values must be manually calculated and '
-                        print '            provided as input. '
-                        print '            The following criteria must be met but was not, therefore process stopped: '
-                        print '            (water_max < non_flood_min)&(flood_min > non_flood_max) '
-                        print '            The following seed values were determined from the seed polygons:'
-                        print '              Water max value: ' + str(water_max)
-                        print '              Non flood veg min value: ' + str(non_flood_min)
-                        print '              Flood veg min value: ' + str(flood_min)
-                        print('              Proceeding with user values if provided or default values of -3.5 and -12.5 for ' \
-                                             'open water and flooded vegetation')
-##                        sys.exit(1)
-                    if openwater_thres is None:
-                        openwater_thres = float("-3.5")
-                    if veg_thres is None:
-                        veg_thres = float("-12.5")
-
-                    logging.info('       water_mean: ' + str(water_mean))
-                    logging.info('       water_std_dev: ' + str(water_std_dev))
-                    logging.info('       water_max: ' + str(water_max))
-                    logging.info('       veg_non_flood_mean: ' + str(veg_non_flood_mean))
-                    logging.info('       veg_non_flood_std_dev: ' + str(veg_non_flood_std_dev))
-                    logging.info('       non_flood_min: ' + str(non_flood_min))
-                    logging.info('       non_flood_max: ' + str(non_flood_max))
-                    logging.info('       veg_flood_mean: ' + str(veg_flood_mean))
-                    logging.info('       veg_flood_std_dev: ' + str(veg_flood_std_dev))
-                    logging.info('       flood_min: ' + str(flood_min))
-                    logging.info('       veg_thres: ' + str(veg_thres))
-                    logging.info('       openwater_thres: ' + str(openwater_thres))
+                water_max = water_mean + 2*water_std_dev
+                non_flood_min = veg_non_flood_mean - 2*veg_non_flood_std_dev
+                non_flood_max = veg_non_flood_mean + 2*veg_non_flood_std_dev
+                flood_min = veg_flood_mean - 2*veg_flood_std_dev
+
+                if ((water_max < non_flood_min)&(flood_min > non_flood_max)):
+                    veg_thres = flood_min
+                    openwater_thres = water_max
+                else:
+                    logging.info('       SEED ERROR: ' )
+                    logging.info('            Seed polygons must be modified or threshold values must be manually calculated and ' )
+                    logging.info('           provided as input. ' )
+                    logging.info('            The following criteria must be met but was not, therefore process stopped: ' )
+                    logging.info('            (water_max < non_flood_min)&(flood_min > non_flood_max) ' )
+                    logging.info('            The following seed values were determined from the seed polygons:' )
+                    logging.info('              Water max value: ' + str(water_max))
+                    logging.info('              Non flood veg min value: ' + str(non_flood_min))
+                    logging.info('              Flood veg min value: ' + str(flood_min))
+                    logging.info('              Proceeding with default value of -3.5 and -12.5 for open water and flooded vegetation')
 
+                    print '       SEED ERROR: '
+                    print '            Seed polygons must be modified or threshold values must be manually calculated and '
+                    print '            provided as input. '
+                    print '            The following criteria must be met but was not, therefore process stopped: '
+                    print '            (water_max < non_flood_min)&(flood_min > non_flood_max) '
+                    print '            The following seed values were determined from the seed polygons:'
+                    print '              Water max value: ' + str(water_max)
+                    print '              Non flood veg min value: ' + str(non_flood_min)
+                    print '              Flood veg min value: ' + str(flood_min)
+                    print('              Proceeding with user values if provided or default values of -3.5 and -12.5 for ' \
+                                         'open water and flooded vegetation')
+        ##                        return 1
                 if openwater_thres is None:
                     openwater_thres = float("-3.5")
                 if veg_thres is None:
                     veg_thres = float("-12.5")
+
+                logging.info('       water_mean: ' + str(water_mean))
+                logging.info('       water_std_dev: ' + str(water_std_dev))
+                logging.info('       water_max: ' + str(water_max))
+                logging.info('       veg_non_flood_mean: ' + str(veg_non_flood_mean))
+                logging.info('       veg_non_flood_std_dev: ' + str(veg_non_flood_std_dev))
+                logging.info('       non_flood_min: ' + str(non_flood_min))
+                logging.info('       non_flood_max: ' + str(non_flood_max))
+                logging.info('       veg_flood_mean: ' + str(veg_flood_mean))
+                logging.info('       veg_flood_std_dev: ' + str(veg_flood_std_dev))
+                logging.info('       flood_min: ' + str(flood_min))
+                logging.info('       veg_thres: ' + str(veg_thres))
+                logging.info('       openwater_thres: ' + str(openwater_thres))
+                manifest.record('calibrate', cal_key,
+                                values={'veg_thres' : float(veg_thres),
+                                        'openwater_thres' : float(openwater_thres)})
+
+        if openwater_thres is None:
+            openwater_thres = float("-3.5")
+        if veg_thres is None:
+            veg_thres = float("-12.5")
+        thres_key = manifest.key(params={'fused' : fused, 'scale_channel' : thres_channel,
+                                         'veg_thres' : veg_thres, 'openwater_thres' : openwater_thres},
+                                 upstream=['ortho', 'filter', 'scale', 'calibrate'])
+        # Not needed, even with the class array released, when the export is current
+        if manifest.current('threshold', thres_key) or (import_veg and exported()):
+            flood_seg = manifest.values('threshold')['segments']
+            veg_process.class_chan = manifest.values('threshold')['class_chan']
+            logging.info('   Not thresholding, threshold already applied')
+        else:
+            if fused:
+                logging.info('   Filter, scale and threshold in one pass for ' + out_file_ortho)
+                flood_seg = veg_process.threshold_fused(out_file_ortho, store, 1, veg_thres, openwater_thres)
+            else:
                 flood_seg = veg_process.threshold_sar(out_file_ortho, int(scale_channel), veg_thres, openwater_thres)
-                logging.info('       Veg segment: ' + str(flood_seg[0]))
-                logging.info('       Water segment: ' + str(flood_seg[1]))
-                #stat_info = EGS_utility.EGSUtility().raster_his(out_file_ortho,int(scale_channel),veg_bitmap,report_file)
-
-            # Import Vegetation Land Cover shapefile, combine with derived flood veg layer and
-            # Export result as a Geotiff
-            if import_veg:
-                if not thres_image:
-                    flood_seg = [2,3]
-                # Work around for determining new vector segments
+            if flood_seg is not None:
+                manifest.record('threshold', thres_key, stage_files(out_file_ortho, store, flood_seg[0]),
+                                {'segments' : flood_seg, 'class_chan' : veg_process.class_chan})
+        logging.info('       Veg segment: ' + str(flood_seg[0]))
+        logging.info('       Water segment: ' + str(flood_seg[1]))
+        #stat_info = EGS_utility.EGSUtility().raster_his(out_file_ortho,int(scale_channel),veg_bitmap,report_file)
+
+    # Import Vegetation Land Cover shapefile, combine with derived flood veg layer and
+    # Export result as a Geotiff
+    if import_veg:
+        if not thres_image:
+            flood_seg = [2,3]
+        # Not needed, even with the land cover array released, when the export is current
+        if manifest.current('vegcover', veg_key) or exported():
+            veg_cover_seg = manifest.values('vegcover')['segment']
+            veg_process.veg_cover_chan = manifest.values('vegcover')['veg_cover_chan']
+            logging.info('   Not transferring land cover, already transferred')
+        else:
+            if engine == 'NUMPY':
+                # Land cover rasterized once per grid block, shared by scenes on the same grid
+                veg_cover_seg = veg_process.vegcover_cached(out_file_ortho, landcover_caches[land_cover],
+                                                            store=store)
+            else:
+                # Transfer only the land cover polygons of the scene
+                in_file_veg = veg_process.subset_vegcover(out_file_ortho, land_cover,
+                                  os.path.splitext(out_file_ortho)[0] + '_vegcover.shp')
+                # Vector segment number from the allocation tracker of the file
                 #   PCI 2016 support Vector segment read, but not PCI2015
-                #   Add bitmap just to determine segment number
-                dataset = ds.open_dataset(out_file_ortho, ds.eAM_WRITE)
-                #   Get the number of the newly created bitmap segment
-                bitmap_seg = dataset.create_bitmap()
-                veg_channel = bitmap_seg + 1
+                veg_channel = EGS_utility.EGSUtility().allocation_tracker(out_file_ortho).reserve_segment()
                 veg_process.import_vegcover(in_file_veg,out_file_ortho)
                 veg_cover_seg = veg_process.vegcover2bit(out_file_ortho, out_file_ortho,veg_channel)
-                logging.info('       veg_cover_seg: ' + str(veg_cover_seg))
+            if veg_cover_seg is not None:
+                manifest.record('vegcover', veg_key, stage_files(out_file_ortho, store, veg_cover_seg),
+                                {'segment' : veg_cover_seg, 'veg_cover_chan' : veg_process.veg_cover_chan})
+        logging.info('       veg_cover_seg: ' + str(veg_cover_seg))
 
+        # Only made from thresholds and land cover recorded in the manifest
+        export_key = manifest.key(params=export_params, upstream=['threshold', 'vegcover'])
+        if thres_image and manifest.current('export', export_key):
+            logging.info('   Not exporting, file already exported: ' + out_file_vegflood)
+        else:
+            if fused:
+                # Masks combined on bit-packed blocks and written directly
+                veg_process.export_vegflood_masks(out_file_vegflood, veg_process.class_chan,
+                                                  veg_process.veg_cover_chan, store,
+                                                  nbits=1 if compact else 8, sparse=bool(compact))
+            else:
                 vegflood_channel = veg_process.combine_veglayers(out_file_ortho,flood_seg[0],flood_seg[1],veg_cover_seg)
-                veg_process.export_vegflood(out_file_ortho,out_file_vegflood,vegflood_channel)
-
-            # Perform test, compare results to reference
-            if test > 1:
-                EGS_utility.EGSUtility().test_raster(refp_file,out_file,report_file)
-                EGS_utility.EGSUtility().test_raster(refp2_file,out_file_ortho,report_file)
-            if test > 0:
-                EGS_utility.EGSUtility().test_raster(refr_file,out_file_vegflood,report_file)
-logging.info('Completed EGS_Process')
+                veg_process.export_vegflood(out_file_ortho,out_file_vegflood,vegflood_channel,bool(compact))
+            if thres_image and os.path.isfile(out_file_vegflood):
+                manifest.record('export', export_key, [out_file_vegflood])
+
+    # Perform test, compare results to reference
+    if test > 1:
+        EGS_utility.EGSUtility().test_raster(refp_file,out_file,report_file)
+        EGS_utility.EGSUtility().test_raster(refp2_file,out_file_ortho,report_file)
+    if test > 0:
+        EGS_utility.EGSUtility().test_raster(refr_file,out_file_vegflood,report_file)
+    return 0
+
+
+def stage_files(out_file_ortho, store, output):
+    """
+    Files holding the output of a stage, for the manifest
+
+    Parameters:
+        out_file_ortho -- Ortho file receiving channels and segments
+        store          -- work_store.WorkStore of the NUMPY engine, or None
+        output         -- Segment number, or array name with a working store
+
+    Return value:
+        List of the ortho file, or of the directory of the store array.
+
+    """
+    if store is not None:
+        return [os.path.join(store.root_dir, output)]
+    return [out_file_ortho]
+
+
+def channel_values(out_file_ortho, channel):
+    """
+    Reference of a channel added by a stage, for the manifest
+
+    Channel numbers change as channels of another type are added before them
+    (e.g. the 8-bit channel of export_vegflood before the 32-bit filtered and
+    scaled channels), so the type and index of the channel among the
+    channels of its type are recorded instead.
+
+    Parameters:
+        out_file_ortho -- Ortho file of the channel
+        channel        -- Channel number
+
+    Return value:
+        Dictionary of output values, empty when the channels of the file are
+        not tracked (see EGS_utility.AllocationTracker).
+
+    """
+    channel_ref = EGS_utility.EGSUtility().allocation_tracker(out_file_ortho).channel_ref(int(channel))
+    if channel_ref is None:
+        return {}
+    return {'channel_ref' : list(channel_ref)}
+
+
+def recorded_channel(out_file_ortho, values):
+    """
+    Channel number of a channel recorded by channel_values
+
+    Parameters:
+        out_file_ortho -- Ortho file of the channel
+        values         -- Output values of the stage
+
+    Return value:
+        Channel number (string), None when it cannot be resolved.
+
+    """
+    if 'channel_ref' not in values:
+        return None
+    chan_type, index = values['channel_ref']
+    channel = EGS_utility.EGSUtility().allocation_tracker(out_file_ortho).channel_number(str(chan_type), index)
+    if channel is None:
+        return None
+    return str(channel)
+
+
+def main():
+    """Allows EGS_process to be run from the command line, see Usage above"""
+    if len(sys.argv) == 1:
+        if os.path.exists(defaultConfigFileName):
+            args = argparse.Namespace(conf_file=defaultConfigFileName)
+        else:
+            parser.print_help();
+            sys.exit(1)
+    else:
+        args = parser.parse_args()
+
+    # Check if config file exists
+    if os.path.exists(args.conf_file) and len(sys.argv) <= 4:
+        config = read_config(args.conf_file)
+    else:
+        config = {}
+        if args.indir is None or args.inadir is None or args.wdir is None or args.outdir is None \
+        or args.logdir is None or args.lc_file is None or args.DEM_file is None or args.imp_im is None \
+        or args.or_im is None or args.fl_im is None or args.sc_im is None or args.th_im is None \
+        or args.im_veg is None or args.im_pro is None or args.im_pix_x is None or args.im_pix_y is None \
+        or args.th_cal is None or args.m is None:
+            print "Missing parameter, see EGS_process.py usage for required argument"
+            parser.print_help();
+            sys.exit(1)
+        elif args.ow_seed is None and args.fv_seed is None and args.nfv_seed is None \
+             and args.v_th is None and args.ow_th is None:
+            print "  \n" \
+                  "                  !!!!!  WARNING  !!!!!                \n" \
+                  "  \n" \
+                  "Missing thresholds parameters, Using default values of -3.5 and -12.5" \
+                  " for open water and flooded vegetation respectively" \
+                  "  \n"
+
+    ##        sys.exit(1)
+        if args.indir is not None:
+            config['input_dir'] = args.indir
+        if args.inadir is not None:
+            config['input_anc_dir'] = args.inadir
+        if args.wdir is not None:
+            config['work_dir'] = args.wdir
+        if args.outdir is not None:
+            config['output_dir'] = args.outdir
+        if args.logdir is not None:
+            config['log_dir'] = args.logdir
+
+        if args.lc_file is not None:
+            config['land_cover'] = args.lc_file
+        if args.DEM_file is not None:
+            config['DEM_file'] = args.DEM_file
+
+        if args.imp_im is not None:
+            config['import_image'] = int(args.imp_im)
+        if args.or_im is not None:
+            config['ortho_image'] = int(args.or_im)
+        if args.fl_im is not None:
+            config['filter_image'] = int(args.fl_im)
+        if args.sc_im is not None:
+            config['scale_image'] = int(args.sc_im)
+        if args.th_im is not None:
+            config['thres_image'] = int(args.th_im)
+        if args.im_veg is not None:
+            config['import_veg'] = int(args.im_veg)
+
+        if args.im_pro is not None:
+            config['image_pro'] = args.im_pro
+        if args.im_pix_x is not None:
+            config['image_pixspac_x'] = float(args.im_pix_x)
+        if args.im_pix_y is not None:
+            config['image_pixspac_y'] = float(args.im_pix_y)
+        if args.v_th is not None:
+            config['veg_thres'] = float(args.v_th)
+        else:
+            config['veg_thres'] = None
+        if args.ow_th is not None:
+            config['openwater_thres'] = float(args.ow_th)
+        else:
+            config['openwater_thres'] = None
+        if args.th_cal is not None:
+            config['cal_thres'] = float(args.th_cal)
+        if args.ow_seed is not None:
+            config['openwater_seed'] = str(args.ow_seed)
+        else:
+            config['openwater_seed'] = None
+        if args.fv_seed is not None:
+            config['floodveg_seed'] = str(args.fv_seed)
+        else:
+            config['floodveg_seed'] = None
+        if args.nfv_seed is not None:
+            config['nfloodveg_seed'] = str(args.nfv_seed)
+        else:
+            config['nfloodveg_seed'] = None
+        if args.engine is not None:
+            config['engine'] = args.engine
+        if args.workers is not None:
+            config['workers'] = args.workers
+        if args.ortho_workers is not None:
+            config['ortho_workers'] = args.ortho_workers
+        if args.compact is not None:
+            config['compact'] = args.compact
+        if args.m is not None:
+            config['mode'] = args.m
+        if args.refr_file is not None:
+            config['refr_file'] = args.refr_file
+        if args.refp_file is not None:
+            config['refp_file'] = args.refp_file
+        if args.refp2_file is not None:
+            config['refp2_file'] = args.refp2_file
+
+    if len(sys.argv) > 1 and args.verbose:
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+        console.setFormatter(formatter)
+        logging.getLogger('').addHandler(console)
+    if len(sys.argv) > 1 and args.test:
+        config['test'] = args.test
+
+    sys.exit(run(config))
+
+
+if __name__ == '__main__':
+    main()
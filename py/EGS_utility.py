@@ -10,7 +10,14 @@
         -- Compares two lists of channels and determines the difference
         -- Add 8 bit channel to PCIPIX file.
         -- Add 32 bit channel to PCIPIX file.
+        -- Track the channel and segment numbers of a PCIPIX file
         -- Get geotransform within file.
+        -- Convert PCI projection string to GDAL spatial reference
+        -- Geographic spatial reference
+        -- Geographic outline of a vector or raster file
+        -- Projected output bounds of a geographic outline
+        -- Identify, publish and evict the files of on-disk caches
+        -- Read GDAL datasets and process image tiles from worker threads
         -- Logs differences in vector files
         -- Logs differences in raster files
         -- Logs histogram
@@ -25,9 +32,11 @@ __revision__ = "--REVISION-- : $Id: EGS_utility.py 255 2016-07-14 13:00:00Z jben
 # Import public modules
 import os
 import sys
-
+import glob
 import logging
+import threading
 import ConfigParser
+from multiprocessing.pool import ThreadPool
 
 
 #import arcpy
@@ -44,6 +53,17 @@ import ConfigParser
 ##from gdalconst import *
 ##import numpy
 
+# PCIDSK channel types in file order, pcimod ADD values in the same order
+CHANNEL_TYPES = ('8U', '16S', '16U', '32R')
+# PCIDSK channel types of the GDAL data types
+GDAL_CHANNEL_TYPES = {'Byte' : '8U', 'Int16' : '16S', 'UInt16' : '16U', 'Float32' : '32R'}
+
+# Largest fraction of a pixel by which grids sharing a pixel size may be shifted
+GRID_TOLERANCE = 0.01
+
+# Allocation trackers of the PCIPIX files of this process, by file
+_trackers = {}
+_trackers_lock = threading.Lock()
 
 
 class EGSUtility:
@@ -56,7 +76,20 @@ class EGSUtility:
     -- Compares two lists of channels and determines the difference
     -- Add 8 bit channel to PCIPIX file.
     -- Add 32 bit channel to PCIPIX file.
+    -- Allocation tracker of a PCIPIX file (allocation_tracker)
     -- Get geotransform within file.
+    -- Convert PCI projection string to GDAL spatial reference
+    -- Geographic spatial reference
+    -- Geographic outline of a vector or raster file
+    -- Projected output bounds of a geographic outline
+    -- Pixel offset between grids (grid_offset)
+    -- Compare projections (same_projection)
+    -- Identity of a cached file's source (file_stamp)
+    -- Publish a file written under a temporary name (publish_file)
+    -- Evict least recently used cache files (evict_lru)
+    -- Thread-safe window reader of a GDAL dataset (window_reader)
+    -- Tiles of an image (image_tiles)
+    -- Process tiles in worker threads (tile_map)
     -- Logs differences in vector files
     -- Logs differences in raster files
     -- Logs histogram
@@ -280,6 +313,9 @@ class EGSUtility:
 
         try:
             logging.info('          Executing: EGSUtility.add_8_channel')
+            channel =       self.allocation_tracker(in_file).add_channel('8U')
+            if channel is not None:
+                return [str(channel)]
             file    =       in_file
             pciop   =       'ADD'
             pcival  =       [1,0,0,0]
@@ -323,6 +359,9 @@ class EGSUtility:
 
         try:
             logging.info('          Executing: EGSUtility.add_32_channel')
+            channel =       self.allocation_tracker(in_file).add_channel('32R')
+            if channel is not None:
+                return [str(channel)]
             file    =       in_file
             pciop   =       'ADD'
             pcival  =       [0,0,0,1]
@@ -338,6 +377,36 @@ class EGSUtility:
             self.error('add_32_channel(): {:s}'.format(e))
 
 
+    def allocation_tracker(self, in_file):
+        """
+        Allocation tracker of a PCIPIX file
+
+        The tracker is created at the first call for a file and kept for the
+        process; a file deleted and created again gets a new tracker.
+
+        Parameters:
+            in_file -- Input file
+
+        Return value:
+            AllocationTracker of the file.  Segments are always tracked;
+            channels are not when the channel layout of the file is not
+            supported (see AllocationTracker).
+
+        Limits and constraints:
+            Channels and segments of the file must only be added through the
+            tracker once it is created (add_8_channel, add_32_channel and the
+            AllocationTracker methods).
+        """
+        path = os.path.normcase(os.path.abspath(in_file))
+        identity = _file_identity(path)
+        with _trackers_lock:
+            tracker = _trackers.get(path)
+            if tracker is None or tracker.identity != identity:
+                tracker = AllocationTracker(path)
+                _trackers[path] = tracker
+            return tracker
+
+
     def numpy_stat(self, in_file, band_num):
         """
         Get Statistics on band within file
@@ -581,6 +650,380 @@ class EGSUtility:
         except ValueError as e:
             self.error('raster_his(): {:s}'.format(e))
 
+    def pci_srs(self, proj):
+        """
+        Convert a PCI Geomatica projection string to a GDAL spatial reference
+
+        Handles the projection strings offered by the Flood Tools
+        (e.g. 'UTM 18 D122', 'CanLCC      E008') directly and defers to
+        GDAL's PCI projection support for anything else.
+
+        Parameters:
+            proj -- PCI projection string
+
+        Return value:
+            osr.SpatialReference, error statement otherwise.
+
+        Limits and constraints:
+            UTM zones are assumed to be in the northern hemisphere.
+        """
+        from osgeo import osr
+        import re
+
+        try:
+            logging.info('          Executing: EGSUtility.pci_srs')
+            srs = osr.SpatialReference()
+            parts = proj.split()
+            utm = re.match(r'^UTM\s+(\d+)\s*[A-Z]?\s+([DE]\d{3})$', proj.strip())
+            if utm:
+                zone  = int(utm.group(1))
+                datum = utm.group(2)
+                if datum == 'D000':
+                    srs.ImportFromEPSG(32600 + zone)     # WGS84 / UTM
+                else:
+                    srs.ImportFromEPSG(26900 + zone)     # NAD83 / UTM
+            elif parts and parts[0] == 'CanLCC':
+                # Canada Lambert Conformal Conic on the GRS80 ellipsoid (E008)
+                srs.ImportFromProj4('+proj=lcc +lat_1=49 +lat_2=77 +lat_0=49 '
+                                    '+lon_0=-95 +x_0=0 +y_0=0 +ellps=GRS80 '
+                                    '+towgs84=0,0,0,0,0,0,0 +units=m +no_defs')
+            elif srs.ImportFromPCI(proj) != 0:
+                raise ValueError('unsupported projection ' + proj)
+            # GDAL 3 honours the authority axis order unless told otherwise
+            if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+                srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            return srs
+
+        except ValueError as e:
+            self.error('pci_srs(): {:s}'.format(e))
+
+
+    def geographic_srs(self):
+        """
+        Geographic WGS84 spatial reference
+
+        Return value:
+            osr.SpatialReference, axes in longitude, latitude order.
+
+        Limits and constraints:
+
+        """
+        from osgeo import osr
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        return srs
+
+
+    def geographic_geometry(self, in_file):
+        """
+        Geographic outline of a vector or raster file
+
+        Vector files yield the union of their features, raster files the
+        outline of their extent.  A bounding box may be given in place of a
+        file.
+
+        Parameters:
+            in_file -- Vector (e.g. shapefile) or raster file, or bounding box
+                       'min lon,min lat,max lon,max lat'
+
+        Return value:
+            ogr.Geometry in geographic WGS84 coordinates (longitude, latitude),
+            error statement otherwise.
+
+        Limits and constraints:
+            Features without a spatial reference are assumed geographic.
+        """
+        from osgeo import gdal, ogr, osr
+
+        try:
+            logging.info('          Executing: EGSUtility.geographic_geometry')
+            geographic = self.geographic_srs()
+            outline    = ogr.Geometry(ogr.wkbMultiPolygon)
+            box        = in_file.split(',')
+            vector_ds  = None
+            if len(box) != 4 or os.path.exists(in_file):
+                vector_ds = ogr.Open(in_file)
+            if vector_ds is None and len(box) == 4 and not os.path.exists(in_file):
+                min_x, min_y, max_x, max_y = [float(value) for value in box]
+                if min_x >= max_x or min_y >= max_y:
+                    raise ValueError('empty bounding box ' + in_file)
+                outline = ogr.CreateGeometryFromWkt(
+                    'POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(
+                    min_x, min_y, max_x, max_y))
+            elif vector_ds is not None:
+                for layer in vector_ds:
+                    transform = None
+                    if layer.GetSpatialRef() is not None:
+                        layer_srs = layer.GetSpatialRef().Clone()
+                        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+                            layer_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                        transform = osr.CoordinateTransformation(layer_srs, geographic)
+                    for feature in layer:
+                        geometry = feature.GetGeometryRef()
+                        if geometry is None:
+                            continue
+                        geometry = geometry.Clone()
+                        if transform is not None:
+                            geometry.Transform(transform)
+                        outline = outline.Union(geometry)
+            else:
+                raster_ds = gdal.Open(in_file)
+                if raster_ds is None or not raster_ds.GetProjection():
+                    raise ValueError('cannot read ' + in_file)
+                ulx, px, rx, uly, ry, py = raster_ds.GetGeoTransform()
+                ring = ogr.Geometry(ogr.wkbLinearRing)
+                for col, row in ((0, 0), (1, 0), (1, 1), (0, 1), (0, 0)):
+                    col *= raster_ds.RasterXSize
+                    row *= raster_ds.RasterYSize
+                    ring.AddPoint_2D(ulx + px * col + rx * row, uly + ry * col + py * row)
+                outline = ogr.Geometry(ogr.wkbPolygon)
+                outline.AddGeometry(ring)
+                # Densify the edges so they follow the projection's curvature
+                outline.Segmentize(max(abs(px) * raster_ds.RasterXSize,
+                                       abs(py) * raster_ds.RasterYSize) / 20.0)
+                raster_srs = osr.SpatialReference()
+                raster_srs.ImportFromWkt(raster_ds.GetProjection())
+                if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+                    raster_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                outline.Transform(osr.CoordinateTransformation(raster_srs, geographic))
+            if outline.IsEmpty():
+                raise ValueError('no geometry in ' + in_file)
+            return outline
+
+        except (RuntimeError, ValueError) as e:
+            self.error('geographic_geometry(): {:s}'.format(e))
+
+
+    def projected_bounds(self, geometry, proj, pixelSpacing_x, pixelSpacing_y):
+        """
+        Projected output bounds of a geographic outline
+
+        The outline is densified, projected and its extent snapped outwards
+        to multiples of the pixel spacing, so that outputs clipped to the
+        same area share one pixel grid.
+
+        Parameters:
+            geometry       -- ogr.Geometry in geographic WGS84 coordinates
+            proj           -- PCI projection string
+            pixelSpacing_x -- x pixel spacing
+            pixelSpacing_y -- y pixel spacing
+
+        Return value:
+            (ulx, uly, lrx, lry), None if the outline is empty, error
+            statement otherwise.
+
+        Limits and constraints:
+
+        """
+        from osgeo import osr
+        import math
+
+        try:
+            logging.info('          Executing: EGSUtility.projected_bounds')
+            if geometry is None or geometry.IsEmpty():
+                return None
+            srs = self.pci_srs(proj)
+            if srs is None:
+                raise ValueError('unsupported projection ' + proj)
+            projected = geometry.Clone()
+            projected.Segmentize(0.01)
+            projected.Transform(osr.CoordinateTransformation(self.geographic_srs(), srs))
+            min_x, max_x, min_y, max_y = projected.GetEnvelope()
+            px = float(pixelSpacing_x)
+            py = float(pixelSpacing_y)
+            return (math.floor(min_x / px) * px, math.ceil(max_y / py) * py,
+                    math.ceil(max_x / px) * px, math.floor(min_y / py) * py)
+
+        except (RuntimeError, ValueError) as e:
+            self.error('projected_bounds(): {:s}'.format(e))
+
+
+    def grid_offset(self, origin, coordinate, pixel_size):
+        """
+        Pixel offset between grids
+
+        Parameters:
+            origin     -- Origin coordinate of the reference grid (e.g. mosaic)
+            coordinate -- Origin coordinate of the other grid (e.g. segment)
+            pixel_size -- Signed pixel size of both grids
+
+        Return value:
+            Offset in whole pixels, raises ValueError when the grids are
+            shifted by more than GRID_TOLERANCE of a pixel.
+
+        """
+        offset = (coordinate - origin) / pixel_size
+        pixels = int(round(offset))
+        if abs(offset - pixels) > GRID_TOLERANCE:
+            raise ValueError('grids shifted by {0:.3f} pixel'.format(offset - pixels))
+        return pixels
+
+
+    def same_projection(self, wkt_a, wkt_b):
+        """
+        Compare projections
+
+        Parameters:
+            wkt_a -- Projection WKT
+            wkt_b -- Projection WKT
+
+        Return value:
+            True when both describe the same projection (or are both empty).
+
+        """
+        from osgeo import osr
+
+        if wkt_a == wkt_b:
+            return True
+        if not wkt_a or not wkt_b:
+            return False
+        srs_a = osr.SpatialReference()
+        srs_a.ImportFromWkt(wkt_a)
+        srs_b = osr.SpatialReference()
+        srs_b.ImportFromWkt(wkt_b)
+        return bool(srs_a.IsSame(srs_b))
+
+
+    def file_stamp(self, path):
+        """
+        Identity of a cached file's source
+
+        Parameters:
+            path -- Source file
+
+        Return value:
+            (path, size, modification time), changing when the file changes.
+
+        """
+        return (path, os.path.getsize(path), int(os.path.getmtime(path)))
+
+
+    def publish_file(self, temp_file, out_file):
+        """
+        Publish a file written under a temporary name
+
+        Parameters:
+            temp_file -- File written under a name of this process
+            out_file  -- Name of the file in the cache
+
+        Return value:
+            out_file.  When another process published it meanwhile, its file
+            is kept and temp_file is removed (os.rename does not replace a
+            file on Windows).
+
+        """
+        try:
+            os.rename(temp_file, out_file)
+        except OSError:
+            if not os.path.isfile(out_file):
+                raise
+            os.remove(temp_file)
+        return out_file
+
+
+    def evict_lru(self, pattern, max_size):
+        """
+        Evict least recently used cache files
+
+        Cache files are touched (os.utime) when reused, the files modified
+        last are kept.
+
+        Parameters:
+            pattern  -- glob pattern of the cache files
+            max_size -- Size limit of the files (bytes)
+
+        Return value:
+            Number of files removed.
+
+        """
+        files   = [(os.path.getmtime(path), os.path.getsize(path), path)
+                   for path in glob.glob(pattern)]
+        total   = sum(size for mtime, size, path in files)
+        removed = 0
+        for mtime, size, path in sorted(files):
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+                total   -= size
+                removed += 1
+            except OSError:
+                pass    # In use by another process
+        return removed
+
+
+    def window_reader(self, dataset, band=None):
+        """
+        Thread-safe window reader of a GDAL dataset
+
+        A GDAL dataset cannot be read from several threads at a time: reads
+        are serialized by a lock, available as the lock attribute of the
+        reader to serialize writes to the same dataset as well.
+
+        Parameters:
+            dataset -- GDAL dataset
+            band    -- Band always read, the band requested otherwise
+
+        Return value:
+            Function (band, xoff, yoff, xsize, ysize) returning the window as
+            an array.
+
+        """
+        lock = threading.Lock()
+
+        def read_window(in_band, xoff, yoff, xsize, ysize):
+            with lock:
+                return dataset.GetRasterBand(band or in_band).ReadAsArray(xoff, yoff, xsize, ysize)
+
+        read_window.lock = lock
+        return read_window
+
+
+    def image_tiles(self, pixels, lines, tile_size):
+        """
+        Tiles of an image
+
+        Parameters:
+            pixels    -- Number of pixels of the image
+            lines     -- Number of lines of the image
+            tile_size -- Tile size, smaller on the last column and row
+
+        Return value:
+            List of (xoff, yoff, xsize, ysize) tiles, line by line.
+
+        """
+        return [(col, row, min(tile_size, pixels - col), min(tile_size, lines - row))
+                for row in range(0, lines, tile_size)
+                for col in range(0, pixels, tile_size)]
+
+
+    def tile_map(self, task, tiles, num_threads):
+        """
+        Process tiles in worker threads
+
+        Parameters:
+            task        -- Function of a tile, called from the worker threads
+            tiles       -- Tiles (e.g. image_tiles)
+            num_threads -- Number of worker threads
+
+        Return value:
+            Iterator of the results of task, yielded as they complete, not
+            in tile order.  The threads are stopped once the iterator is
+            exhausted or closed.
+
+        """
+        pool = ThreadPool(num_threads)
+        try:
+            for result in pool.imap_unordered(task, tiles):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+
     def setup_logger(self, in_file, verbose):
         """
         Setup logging information
@@ -636,4 +1079,215 @@ class EGSUtility:
 
         # Case 3: via exception (use a dedicated exception class?)
         #raise ValueError(msg)
-        logging.debug('      ' + msg)
\ No newline at end of file
+
+        # Case 4: logged as an error, shown by the handlers of the calling
+        #    tool (e.g. the messages of an ArcGIS tool) whatever their level
+        logging.error('      ' + msg)
+
+
+class AllocationTracker:
+    """
+    Class used to hand out the channel and segment numbers of a PCIPIX file.
+
+    The channel layout is read once, then kept up to date as channels and
+    segments are added, instead of listing the channels before and after
+    every pcimod and creating bitmaps to find segment numbers.
+    -- pcimod ADD inserts a channel after the last channel of its type,
+       PCIDSK keeping channels in CHANNEL_TYPES order: the new channel
+       number is the number of channels of that type or before it, plus 1.
+    -- Channels are not tracked when the file cannot be read with GDAL or
+       has channel types other than CHANNEL_TYPES or out of their order:
+       add_channel then leaves the channel to the caller (channel lists).
+    -- New segments take the next segment number, segments are never
+       deleted by the EGS processing.  The next number is known from the
+       first bitmap segment created through the tracker; when a function
+       creating its own segment (iia, poly2bit) comes first, one bitmap is
+       created to find it and kept for the next bitmap request.
+    The following functionality is performed by this class.
+    -- Add a channel (add_channel)
+    -- Create a bitmap segment (bitmap)
+    -- Reserve the number of a segment created by a PCI function (reserve_segment)
+    -- Record a segment created by a PCI function (record_segment)
+    -- Type and index of a channel among the channels of its type (channel_ref)
+    -- Number of a channel from its type and index (channel_number)
+
+    """
+
+
+    def __init__(self, in_file):
+        """Initialisation of AllocationTracker class
+
+        Parameters:
+            in_file -- PCIPIX file
+
+        """
+        from osgeo import gdal
+
+        self.in_file  = in_file
+        self.identity = _file_identity(in_file)
+        self.counts = [0] * len(CHANNEL_TYPES)     # Number of channels of each type, None when not tracked
+        dataset = gdal.Open(in_file)
+        if dataset is None:
+            self._untrack('cannot open ' + in_file)
+        else:
+            for band in range(1, dataset.RasterCount + 1):
+                type_name = gdal.GetDataTypeName(dataset.GetRasterBand(band).DataType)
+                if type_name not in GDAL_CHANNEL_TYPES:
+                    self._untrack('{0} channel in {1}'.format(type_name, in_file))
+                    break
+                rank = CHANNEL_TYPES.index(GDAL_CHANNEL_TYPES[type_name])
+                if any(self.counts[rank + 1:]):
+                    self._untrack('channels not in type order in ' + in_file)
+                    break
+                self.counts[rank] += 1
+        dataset = None
+        self.next_segment = None    # Next segment number, unknown until a segment is created
+        self.spare_bitmaps = []     # Bitmaps created to find the next segment number
+        self.lock = threading.Lock()
+
+
+    def add_channel(self, chan_type):
+        """
+        Add a channel
+
+        Parameters:
+            chan_type -- Channel type, one of CHANNEL_TYPES
+
+        Return value:
+            Number of the new channel, None when channels are not tracked
+            (no channel added).
+
+        """
+        from pci.pcimod import pcimod
+
+        rank = CHANNEL_TYPES.index(chan_type)
+        with self.lock:
+            if self.counts is None:
+                return None
+            pcival = [0] * len(CHANNEL_TYPES)
+            pcival[rank] = 1
+            pcimod(self.in_file, 'ADD', pcival)
+            self.counts[rank] += 1
+            channel = sum(self.counts[:rank + 1])
+        logging.info('          New {0} channel: {1}'.format(chan_type, channel))
+        return channel
+
+
+    def bitmap(self):
+        """
+        Create a bitmap segment
+
+        Return value:
+            Number of the new bitmap segment.
+
+        """
+        with self.lock:
+            if self.spare_bitmaps:
+                return self.spare_bitmaps.pop(0)
+            return self._create_bitmap()
+
+
+    def reserve_segment(self):
+        """
+        Reserve the number of a segment created by a PCI function
+
+        Called just before the function (e.g. iia, poly2bit) creates the
+        segment.
+
+        Return value:
+            Number of the segment.
+
+        """
+        with self.lock:
+            if self.next_segment is None:
+                self.spare_bitmaps.append(self._create_bitmap())
+            segment = self.next_segment
+            self.next_segment += 1
+            return segment
+
+
+    def record_segment(self, segment):
+        """
+        Record a segment created by a PCI function returning its number (lasc)
+
+        Parameters:
+            segment -- Number of the segment
+
+        """
+        with self.lock:
+            self.next_segment = max(self.next_segment or 0, int(segment) + 1)
+
+
+    def channel_ref(self, channel):
+        """
+        Type and index of a channel among the channels of its type
+
+        Unlike the channel number, the reference does not change when
+        channels of another type are added before it (e.g. an 8U channel
+        before the 32R channels).
+
+        Parameters:
+            channel -- Channel number
+
+        Return value:
+            (channel type, index from 1) of the channel, None when channels
+            are not tracked.
+
+        """
+        with self.lock:
+            if self.counts is None:
+                return None
+            first = 0
+            for rank, count in enumerate(self.counts):
+                if channel <= first + count:
+                    return CHANNEL_TYPES[rank], channel - first
+                first += count
+        raise ValueError('no channel {0} in {1}'.format(channel, self.in_file))
+
+
+    def channel_number(self, chan_type, index):
+        """
+        Number of a channel from its type and index
+
+        Parameters:
+            chan_type -- Channel type, one of CHANNEL_TYPES
+            index     -- Index from 1 among the channels of that type
+
+        Return value:
+            Channel number, None when the file has no such channel or
+            channels are not tracked.
+
+        """
+        rank = CHANNEL_TYPES.index(chan_type)
+        with self.lock:
+            if self.counts is None or not 1 <= index <= self.counts[rank]:
+                return None
+            return sum(self.counts[:rank]) + index
+
+
+    def _untrack(self, reason):
+        """Stop tracking the channels of the file, segments are still tracked"""
+        logging.info('          Channels not tracked, listing channels: ' + reason)
+        self.counts = None
+
+
+    def _create_bitmap(self):
+        """Create a bitmap segment with the PCI API, lock held"""
+        from pci.api import datasource as ds
+
+        dataset = ds.open_dataset(self.in_file, ds.eAM_WRITE)
+        segment = dataset.create_bitmap()
+        dataset = None
+        self.next_segment = max(self.next_segment or 0, segment + 1)
+        return segment
+
+
+def _file_identity(path):
+    """Identity of a file, changing when the file is deleted and created again"""
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    if os.name == 'nt':
+        return status.st_ctime     # Creation time on Windows
+    return status.st_dev, status.st_ino
@@ -838,6 +838,14 @@ class FT0_FloodMaster(object):
             ft1Params[1].value = str(parameters[1].value) # DEM Filename
             ft1Params[2].value = parameters[2].value      # Ortho Projection
             ft1Params[3].value = parameters[3].value      # Ortho Pixel Spacing
+            if parameters[9].value:                       # Processing Mask [Optional]
+                ft1Params[6].value = str(parameters[9].value) # -> Area Of Interest
+            # Only the polarizations of the selected 16-Bit SAR Images
+            # (<pass>_<POL>.tif) are orthorectified and mosaicked
+            if parameters[4].values:
+                ft1Params[7].values = sorted(set(
+                    os.path.splitext(str(sarFile))[0].rsplit("_", 1)[-1]
+                    for sarFile in parameters[4].values))
 
             # Submit job and return exit status to OS (can be checked with echo
             # %ERRORLEVEL% in Windows).  All arcpy.AddMessage, arcpy.AddWarning
@@ -861,8 +869,14 @@ class FT0_FloodMaster(object):
             ft2Obj    = FT2_Scale16to8BitSet()
             ft2Params = ft2Obj.getParameterInfo()
 
+            # Passes outside the Processing Mask have not been mosaicked
             ft2Params[0].value  = str(parameters[0].value) # Workspace
-            ft2Params[1].values = parameters[4].values     # 16-Bit SAR Images
+            ft2Params[1].values = FT0_FloodMaster.existingFiles(
+                                      parameters[4].values) # 16-Bit SAR Images
+            if not ft2Params[1].values:
+                arcpy.AddError("ERROR:  No 16-Bit SAR Image produced inside the " \
+                               "Processing Mask.  Aborting 'FT0_FloodTools'.")
+                return 1
             ft2Params[2].value  = parameters[5].value      # Contrast Stretch
 
             # Submit job and return exit status to OS (can be checked with echo
@@ -888,7 +902,8 @@ class FT0_FloodMaster(object):
             ft3Params = ft3Obj.getParameterInfo()
 
             ft3Params[0].value  = str(parameters[0].value) # Workspace
-            ft3Params[1].values = parameters[6].values     # 8-Bit SAR Images
+            ft3Params[1].values = FT0_FloodMaster.existingFiles(
+                                      parameters[6].values) # 8-Bit SAR Images
             ft3Params[2].values = parameters[7].values     # Water Thresholds
             ft3Params[3].value  = parameters[8].value      # Minimum Polygon Size
             if parameters[9].value:                        # Processing Mask [Optional]
@@ -1038,8 +1053,9 @@ class FT0_FloodMaster(object):
         Limit(s) and Constraint(s) During Use:
             None.
         """
-        # Get name of LAST Zip file.  The name of the directory in which its
-        # scene files will be unpacked will be used to establish which file
+        # Group the Zip files into passes as "FT1_R2ReadOrthoMosaic" does.  The
+        # name of the directory in which the scene files of the first Zip file
+        # of each pass will be unpacked will be used to establish which file
         # names will be created by "FT1_R2ReadOrthoMosaic" and used as input to
         # "FT2_Scale16to8BitSet".  The general format of the file names to be
         # created will be:
@@ -1071,46 +1087,26 @@ class FT0_FloodMaster(object):
         workspace = str(parameters[0].value)
         zipFiles  = FT1_R2ReadOrthoMosaic.validateWorkspace(workspace)
         if zipFiles != None:
-            lastZipFile     = zipFiles[-1]
-            sceneDir        = os.path.splitext(os.path.basename(lastZipFile))[0]
-            pathParts       = sceneDir.split('_')
-            productDate     = pathParts[5]
-            productTime     = pathParts[6]
             projParts       = str(parameters[2].value).split()
             projCode        = ''.join(projParts[:-1])
-            mosFileTemplate = os.path.join(workspace, "Mosaic", "%s_%s_%s_mos_%s.tif" %
-                                                                (productDate,productTime,projCode,"%s"))
             mosFiles        = []
-
-            # Create 1 to 4 files, depending on how many polarizations are
-            # present, and identify the file to serve as the default selection.
-            if len(pathParts) == 9:     # single pole
-                mosFiles.append(mosFileTemplate % pathParts[7])
-                selectedFile = 0
-            elif len(pathParts) == 10:  # dual pole
-                mosFiles.append(mosFileTemplate % pathParts[7])
-                mosFiles.append(mosFileTemplate % pathParts[8])
-                if pathParts[8] == "HH":
-                    selectedFile = 1
-                else:
-                    selectedFile = 0
-            elif len(pathParts) == 12:  # quad pole
-                mosFiles.append(mosFileTemplate % pathParts[7])
-                mosFiles.append(mosFileTemplate % pathParts[8])
-                mosFiles.append(mosFileTemplate % pathParts[9])
-                mosFiles.append(mosFileTemplate % pathParts[10])
-                if pathParts[8] == "HH":
-                    selectedFile = 1
-                elif pathParts[9] == "HH":
-                    selectedFile = 2
-                elif pathParts[10] == "HH":
-                    selectedFile = 3
-                else:
-                    selectedFile = 0
+            selectedFile    = 0
+
+            # Create 1 to 4 files per pass, depending on how many polarizations
+            # are present, and identify the file to serve as the default
+            # selection (the "HH" file of the first pass, if present).
+            for groupIndex, sceneGroup in enumerate(FT1_R2ReadOrthoMosaic.groupScenes(zipFiles)):
+                mosFileTemplate = os.path.join(workspace, "Mosaic", "%s_%s_%s_mos_%s.tif" %
+                                               (sceneGroup[0]['date'], sceneGroup[0]['time'], projCode, "%s"))
+                for productPol in sceneGroup[0]['pols']:
+                    if groupIndex == 0 and productPol == "HH":
+                        selectedFile = len(mosFiles)
+                    mosFiles.append(mosFileTemplate % productPol)
 
             # Load the 16-Bit Image list field and set the default selection
             parameters[4].filter.list = mosFiles
-            parameters[4].values      = [parameters[4].filter.list[selectedFile]]
+            if mosFiles:
+                parameters[4].values  = [parameters[4].filter.list[selectedFile]]
 
         return
 
@@ -1163,6 +1159,32 @@ class FT0_FloodMaster(object):
     # ============= #
     # Class Methods #
     # ============= #
+    @staticmethod
+    def existingFiles(fileNames):
+        """
+        Keeps the files that exist, issuing a warning for the others.  Images
+        of passes outside the Processing Mask are predicted from the ZIP file
+        names but are not produced by "FT1_R2ReadOrthoMosaic".
+
+        Parameters:
+            TYPE        NAME            DESCRIPTION
+            String[]    fileNames       Selected image files.
+
+        Return Values:
+            String[]
+            - Selected image files that exist, in the same order.
+
+        Limit(s) and Constraint(s) During Use:
+            None.
+        """
+        existing = []
+        for fileName in fileNames or []:
+            if os.path.exists(str(fileName)):
+                existing.append(str(fileName))
+            else:
+                arcpy.AddWarning("- Not produced (outside Processing Mask?): '%s'" % (fileName))
+        return existing
+
 
 
 def main():
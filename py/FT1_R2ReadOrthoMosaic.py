@@ -16,12 +16,15 @@ __revision__ = "--REVISION-- : $Id: FT1_R2ReadOrthoMosaic.py 796 2017-03-06 16:3
 # =========
 import arcpy
 import argparse
+import datetime
 import glob
 import os
 import shutil
 import sys
 import traceback
 import zipfile
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 
 # ======= #
@@ -71,6 +74,30 @@ class FT1_R2ReadOrthoMosaic(object):
                           supported and compatible with PCI Geomatica whose
                           "ortho2" tool will be used to reproject the SAR image.
 
+        ORTHO_ENGINES   : Orthorectification engines that can be selected.  PCI
+                          Geomatica's "ortho2" is the default, the NumPy/GDAL
+                          engine (sar_ortho) allows the tool to run where PCI
+                          Geomatica is not available.
+
+        MOSAIC_MODES    : Mosaicking modes that can be selected.  "AUTOMOS"
+                          mosaics into a PIX file with PCI Geomatica's "automos"
+                          and exports each polarization to a TIF file, "VRT"
+                          writes GDAL virtual rasters over the ortho segments
+                          (mosaic and one view per polarization) without copying
+                          pixels.  "INCREMENTAL" keeps the Raw and Ortho
+                          directories of earlier runs, orthorectifies new
+                          segments only and merges them block by block into a
+                          GeoTIFF mosaic per pass, with one VRT view per
+                          polarization.
+
+        POLARIZATIONS   : Polarization channels that can be selected.  Only
+                          the selected channels are orthorectified, mosaicked
+                          and exported; all captured channels otherwise.
+
+        PASS_GAP_SECONDS: Segments of one pass are acquired seconds apart.
+                          Segments of the same satellite, beam and polarizations
+                          further apart than this are mosaicked separately.
+
         idxChangeField  : An essential custom class attribute, is used to keep
                           track of the last parameter that was changed when
                           running the tool in GUI mode through ArcCatalog or
@@ -102,6 +129,14 @@ class FT1_R2ReadOrthoMosaic(object):
                               "UTM 20 D122",
                               "UTM 21 D122",
                               "UTM 22 D122"]
+    ORTHO_ENGINES          = ["PCI ORTHO2",
+                              "NUMPY/GDAL"]
+    PASS_GAP_SECONDS       = 600
+    MOSAIC_MODES           = ["AUTOMOS",
+                              "VRT",
+                              "INCREMENTAL"]
+    POLARIZATIONS          = ["HH", "HV", "VV", "VH"]
+    SATELLITE_CODES        = {"RADARSAT-2" : "RS2"}
     idxChangeField         = None
 
 
@@ -173,7 +208,7 @@ class FT1_R2ReadOrthoMosaic(object):
             getParameterInfo Method
             http://resources.arcgis.com/en/help/main/10.2/index.html#//001500000028000000
         """
-        params = [None]*4
+        params = [None]*9
 
         params[0] = arcpy.Parameter(
                      displayName   = "Workspace",
@@ -187,7 +222,7 @@ class FT1_R2ReadOrthoMosaic(object):
         params[1] = arcpy.Parameter(
                      displayName   = "DEM Filename",
                      name          = "demFilename",
-                     datatype      = ["DEFile","DERasterDataset"],
+                     datatype      = ["DEFile","DERasterDataset","DEFolder"],
                      parameterType = "Required",
                      direction     = "Input"
                      )
@@ -215,6 +250,56 @@ class FT1_R2ReadOrthoMosaic(object):
                      )
         params[3].value = "12.5,12.5"
 
+        params[4] = arcpy.Parameter(
+                        displayName   = "Ortho Engine",
+                        name          = "orthoEngine",
+                        datatype      = "GPString",
+                        parameterType = "Optional",
+                        direction     = "Input"
+                     )
+        params[4].filter.type = "ValueList"
+        params[4].filter.list = FT1_R2ReadOrthoMosaic.ORTHO_ENGINES
+        params[4].value       = FT1_R2ReadOrthoMosaic.ORTHO_ENGINES[0]
+
+        params[5] = arcpy.Parameter(
+                        displayName   = "Mosaic Mode",
+                        name          = "mosaicMode",
+                        datatype      = "GPString",
+                        parameterType = "Optional",
+                        direction     = "Input"
+                     )
+        params[5].filter.type = "ValueList"
+        params[5].filter.list = FT1_R2ReadOrthoMosaic.MOSAIC_MODES
+        params[5].value       = FT1_R2ReadOrthoMosaic.MOSAIC_MODES[0]
+
+        params[6] = arcpy.Parameter(
+                        displayName   = "Area Of Interest",
+                        name          = "areaOfInterest",
+                        datatype      = ["DEFeatureClass","DEFeatureDataset","DERasterDataset","GPString"],
+                        parameterType = "Optional",
+                        direction     = "Input"
+                     )
+
+        params[7] = arcpy.Parameter(
+                        displayName   = "Polarizations",
+                        name          = "polarizations",
+                        datatype      = "GPString",
+                        parameterType = "Optional",
+                        direction     = "Input",
+                        multiValue    = True
+                     )
+        params[7].filter.type = "ValueList"
+        params[7].filter.list = FT1_R2ReadOrthoMosaic.POLARIZATIONS
+
+        params[8] = arcpy.Parameter(
+                        displayName   = "Materialize VRT Views",
+                        name          = "materialize",
+                        datatype      = "GPBoolean",
+                        parameterType = "Optional",
+                        direction     = "Input"
+                     )
+        params[8].value       = False
+
         return params
 
 
@@ -408,18 +493,31 @@ class FT1_R2ReadOrthoMosaic(object):
         - validates all incoming parameters
             - verifies that workspace directory exists, is accessible, and
               contains ZIP files
-            - verifies that DEM file exists and is accessible
+            - verifies that DEM file (or directory of DEM tiles) exists and is
+              accessible
             - verifies that Projection has been passed
             - verifies that Pixel Spacing has been passed and consists of
               comma-delimited pair of numbers
+            - verifies that Ortho Engine, if passed, is a known engine
+            - verifies that Mosaic Mode, if passed, is a known mode
+            - verifies that Area Of Interest, if passed, exists or is a
+              bounding box
+            - verifies that Polarizations, if passed, are known polarizations
         - creates "Raw" directory if it doesn't exist, moves ZIP files to that
-          directory and unpacks them
+          directory, verifies them in parallel and unpacks the sound ones
+        - if an Area Of Interest is passed, selects the scenes whose footprint
+          intersects it through the scene catalog's footprint index
         - creates "Ortho" directory if it doesn't exist, and uses DEM to
-          generate orthorectified versions of raw SAR images and reprojects
-        - creates "Mosaic" directory if it doesn't exist, and mosaics individual
-          orthorectified images together
+          generate orthorectified versions of raw SAR images and reprojects,
+          either with PCI Geomatica's "ortho2" or the NumPy/GDAL engine
+        - creates "Mosaic" directory if it doesn't exist, groups the scenes
+          into passes and mosaics the orthorectified images of each pass
+          together (see "mosaicGroup")
         - separates mosaicked images into separate HH and HV polarization
           channel images
+        - or, in "VRT" mosaic mode, writes a VRT mosaic and one VRT view per
+          polarization in place of the two steps above, copying the views to
+          TIF files only when Materialize VRT Views is passed
 
 
         Parameters:
@@ -485,8 +583,6 @@ class FT1_R2ReadOrthoMosaic(object):
         #
         #    from pci.automos import automos
         #
-        from pci.automos import automos
-        from pci.fexport import fexport
         from pci.fimport import fimport
         from pci.ortho2  import ortho2
 
@@ -512,6 +608,19 @@ class FT1_R2ReadOrthoMosaic(object):
             demFilename       = str(parameters[1].value)
             orthoProjection   = parameters[2].value
             orthoPixelSpacing = str(parameters[3].value)
+            orthoEngine       = FT1_R2ReadOrthoMosaic.ORTHO_ENGINES[0]
+            if len(parameters) > 4 and parameters[4].value:
+                orthoEngine   = str(parameters[4].value)
+            mosaicMode        = FT1_R2ReadOrthoMosaic.MOSAIC_MODES[0]
+            if len(parameters) > 5 and parameters[5].value:
+                mosaicMode    = str(parameters[5].value)
+            aoiFilename       = None
+            if len(parameters) > 6 and parameters[6].value:
+                aoiFilename   = str(parameters[6].value)
+            polarizations     = None
+            if len(parameters) > 7 and parameters[7].values:
+                polarizations = [str(pol) for pol in parameters[7].values]
+            materialize       = len(parameters) > 8 and bool(parameters[8].value)
 
             # Validate Workspace Directory
             arcpy.SetProgressorLabel("Validate Workspace Directory...")
@@ -532,7 +641,8 @@ class FT1_R2ReadOrthoMosaic(object):
             arcpy.SetProgressorLabel("Validate DEM File...")
             arcpy.AddMessage("- Validate DEM File")
             if parameters[1].value != None:
-                if not os.path.isfile(demFilename) or not os.access(demFilename, os.R_OK):
+                if not (os.path.isfile(demFilename) or os.path.isdir(demFilename)) or \
+                   not os.access(demFilename, os.R_OK):
                     msgText = "ERROR:  DEM File path does not exist or do not " \
                               "have read access:\n        %s" %                 \
                               (demFilename)
@@ -561,6 +671,31 @@ class FT1_R2ReadOrthoMosaic(object):
                 arcpy.AddError( "ERROR:  Ortho Pixel Spacing is missing." )
                 return 1
 
+            # Validate Orthorectification Engine
+            if orthoEngine not in FT1_R2ReadOrthoMosaic.ORTHO_ENGINES:
+                arcpy.AddError( "ERROR:  Invalid Ortho Engine '%s'.  Must be one " \
+                                "of: %s." % (orthoEngine, ", ".join(FT1_R2ReadOrthoMosaic.ORTHO_ENGINES)) )
+                return 1
+
+            # Validate Mosaic Mode
+            if mosaicMode not in FT1_R2ReadOrthoMosaic.MOSAIC_MODES:
+                arcpy.AddError( "ERROR:  Invalid Mosaic Mode '%s'.  Must be one " \
+                                "of: %s." % (mosaicMode, ", ".join(FT1_R2ReadOrthoMosaic.MOSAIC_MODES)) )
+                return 1
+
+            # Validate Optional Polarizations
+            for pol in polarizations or []:
+                if pol not in FT1_R2ReadOrthoMosaic.POLARIZATIONS:
+                    arcpy.AddError( "ERROR:  Invalid Polarization '%s'.  Must be one " \
+                                    "of: %s." % (pol, ", ".join(FT1_R2ReadOrthoMosaic.POLARIZATIONS)) )
+                    return 1
+
+            # Validate Optional Area Of Interest
+            if aoiFilename:
+                msgText = FT1_R2ReadOrthoMosaic.validateAreaOfInterest(aoiFilename)
+                if msgText:
+                    arcpy.AddError( msgText )
+                    return 1
 
             # Echo Final Parameters To Log
             # ----------------------------
@@ -574,12 +709,22 @@ class FT1_R2ReadOrthoMosaic(object):
                               "%s"                             \
                               "- Ortho Projection    : %s\n"   \
                               "- DEM File Name       : %s\n"   \
-                              "- Ortho Pixel Spacing : %s\n" % \
+                              "- Ortho Pixel Spacing : %s\n"   \
+                              "- Ortho Engine        : %s\n"   \
+                              "- Mosaic Mode         : %s\n"   \
+                              "- Area Of Interest    : %s\n"   \
+                              "- Polarizations       : %s\n"   \
+                              "- Materialize Views   : %s\n" % \
                              (workspace,
                               zipFileList,
                               orthoProjection,
                               demFilename,
-                              orthoPixelSpacing) )
+                              orthoPixelSpacing,
+                              orthoEngine,
+                              mosaicMode,
+                              aoiFilename,
+                              ",".join(polarizations or ["ALL"]),
+                              materialize) )
 
             #-------------------------------------------------------------------
             #          Copy and Unzip RS2 Data Segments to RAW folder
@@ -587,14 +732,18 @@ class FT1_R2ReadOrthoMosaic(object):
             # Create "Raw" subdirectory if it does not already exist, remove and
             # recreate it otherwise (if not done, cannot rerun this tool since
             # will trigger an error when trying to re-UNZIP the ZIP file).  Then
-            # move ZIP files to that directory, and unpack.
+            # move ZIP files to that directory, and unpack.  In "INCREMENTAL"
+            # mosaic mode the scenes of earlier runs are kept, already unpacked
+            # scenes are skipped below.
             arcpy.SetProgressorLabel("Process ZIP Files...")
             arcpy.AddMessage("Process ZIP Files")
             rawDir = os.path.join(workspace, 'Raw')
             arcpy.AddMessage("- Target Folder: '%s'" % (rawDir))
-            if os.path.exists(rawDir):
+            isIncremental = mosaicMode == FT1_R2ReadOrthoMosaic.MOSAIC_MODES[2]
+            if os.path.exists(rawDir) and not isIncremental:
                 shutil.rmtree(rawDir)
-            os.mkdir(rawDir)
+            if not os.path.exists(rawDir):
+                os.mkdir(rawDir)
 
             for zippedFile in zipFiles:
                 zipBaseName = os.path.basename(zippedFile)
@@ -602,11 +751,22 @@ class FT1_R2ReadOrthoMosaic(object):
                 zipFileNew = os.path.join(rawDir, zipBaseName)
                 shutil.move(zippedFile, zipFileNew)
 
+            # Packages to unpack are verified (central directory and CRCs) in
+            # parallel first, so a truncated download is rejected before any
+            # scene is processed; sound packages are then read from the cache
+            import package_check
             zipFilesRawDir = glob.glob(os.path.join(rawDir, '*.zip'))
+            zipFilesToUnzip = [ f for f in zipFilesRawDir if not os.path.exists(
+                                os.path.join(rawDir, os.path.splitext(os.path.basename(f))[0])) ]
+            arcpy.AddMessage("  - Verify %d ZIP File(s)" % (len(zipFilesToUnzip)))
+            zipErrors = package_check.PackageCheck().check_all(zipFilesToUnzip)
             for zippedFile in zipFilesRawDir:
                 unzipSubdir = os.path.splitext(os.path.basename(zippedFile))[0]
                 if os.path.exists(os.path.join(rawDir, unzipSubdir)) == True:
                     arcpy.AddMessage("  - Unzip Subdirectory " + "'" + unzipSubdir + "'" + " already exists.")
+                elif zipErrors.get(zippedFile):
+                    arcpy.AddWarning("  - File " + "'" + os.path.basename(zippedFile) + "'" + \
+                                     " is corrupt (%s), not unzipped." % (zipErrors[zippedFile]))
                 else:
                     with zipfile.ZipFile(zippedFile, "r") as z:
                         z.extractall(rawDir)
@@ -614,15 +774,34 @@ class FT1_R2ReadOrthoMosaic(object):
 
             arcpy.AddMessage("  - All files unzipped.")
 
-            listDir     = os.listdir(rawDir)
-            sceneDirs   = [ d for d in listDir if os.path.isdir(os.path.join(rawDir,d))]
-            numSegments = len(sceneDirs)
+            # Unpacked products are registered in the workspace scene catalog,
+            # product.xml is only parsed for products new to the catalog
+            import scene_catalog
+            sceneCatalogObj = scene_catalog.SceneCatalog(os.path.join(workspace,
+                                                                      scene_catalog.CATALOG_NAME))
+            scenes      = sceneCatalogObj.scan(rawDir)
+            numSegments = len(scenes)
             arcpy.AddMessage("  - Number Of Scenes To Process = %d\n" % (numSegments))
 
             if numSegments == 0:
                 arcpy.AddMessage('No scenes to process.  Terminating...')
                 return 0
 
+            # Scenes whose footprint misses the area of interest are neither
+            # orthorectified nor mosaicked, the others are orthorectified over
+            # the part of their footprint inside it only
+            aoiScenes   = None
+            aoiGeometry = None
+            if aoiFilename:
+                import EGS_utility
+                aoiGeometry = EGS_utility.EGSUtility().geographic_geometry(aoiFilename)
+                if aoiGeometry is None:
+                    arcpy.AddError("ERROR:  Cannot read Area Of Interest '%s'." % (aoiFilename))
+                    return 1
+                aoiScenes = set(scene['name'] for scene in
+                                sceneCatalogObj.intersecting(aoiGeometry, rawDir))
+                arcpy.AddMessage("  - Number Of Scenes In Area Of Interest = %d\n" % (len(aoiScenes)))
+
             #-------------------------------------------------------------------
             #                 IMPORT and ORTHO Each RS2 Segment
             #-------------------------------------------------------------------
@@ -633,17 +812,96 @@ class FT1_R2ReadOrthoMosaic(object):
             if not os.path.exists(orthoDir):
                 os.mkdir(orthoDir)
 
-            for i, sceneDir in enumerate(sceneDirs):
-                file01      =  os.path.join(rawDir, sceneDir, 'product.xml')
+            # DEM is clipped to each scene footprint through the DEM tile
+            # cache, so overlapping segments share the same DEM tile
+            import dem_cache
+            demCacheObj      = dem_cache.DemCache(demFilename)
+            orthoProducts    = {}
+            newOrthoProducts = set()
+
+            for i, scene in enumerate(scenes):
+                sceneDir    = scene['name']
+                file01      = scene['product_xml']
                 arcpy.AddMessage("  - Scene [%d]  :\n" \
                                  "    - Product  : '%s'" % (i, file01))
-                dirParts     = sceneDir.rsplit('_')
-                productSat   = dirParts[0]
-                productBeam  = dirParts[4]
-                productDate  = dirParts[5]
-                productTime  = dirParts[6]
-                fileBaseName = "%s_%s_%s_%s.pix" % (productSat, productBeam, productDate, productTime)
+                sceneParts  = FT1_R2ReadOrthoMosaic.catalogScene(scene)
+                if sceneParts is None:
+                    arcpy.AddWarning("    - No acquisition time in product.xml, skipped.")
+                    continue
+                if aoiScenes is not None and sceneDir not in aoiScenes:
+                    arcpy.AddMessage("    - Outside area of interest, skipped.\n")
+                    continue
+                # Channels of the selected polarizations (1 = first captured)
+                sceneChannels = [channel + 1 for channel, pol in enumerate(scene['polarizations'])
+                                 if not polarizations or pol in polarizations]
+                if not sceneChannels:
+                    arcpy.AddWarning("    - None of the selected polarizations captured, skipped.")
+                    continue
+                fileBaseName = "%s_%s_%s_%s.pix" % (sceneParts['satellite'], sceneParts['beam'],
+                                                    sceneParts['date'], sceneParts['time'])
                 file02       = os.path.join(rawDir, fileBaseName)
+
+                # Segments orthorectified by an earlier incremental run are
+                # already part of their mosaic
+                if isIncremental:
+                    sceneBaseName  = "o" + os.path.splitext(fileBaseName)[0]
+                    earlierProducts = [ f for f in (os.path.join(orthoDir, sceneBaseName + ".pix"),
+                                                    os.path.join(orthoDir, sceneBaseName + ".tif"))
+                                        if os.path.isfile(f) ]
+                    if earlierProducts:
+                        arcpy.AddMessage("    - Already orthorectified: '%s'\n" % (earlierProducts[0]))
+                        orthoProducts[sceneDir] = earlierProducts[0]
+                        continue
+
+                # Output bounds (ulx, uly, lrx, lry) of the footprint, or of its
+                # part in the area of interest, snapped to the ortho pixel grid
+                # so that all segments of the mosaic share one grid
+                import EGS_utility
+                from osgeo import ogr
+                ORTHO_PXSZ   = orthoPixelSpacing.split(",")
+                demBounds    = scene['bounds']
+                sceneArea    = ogr.CreateGeometryFromWkt(scene['footprint'])
+                if aoiGeometry is not None:
+                    sceneArea = sceneArea.Intersection(aoiGeometry)
+                    minLon, maxLon, minLat, maxLat = sceneArea.GetEnvelope()
+                    demBounds = (minLon, minLat, maxLon, maxLat)
+                orthoBounds  = EGS_utility.EGSUtility().projected_bounds(sceneArea, orthoProjection,
+                                                                         ORTHO_PXSZ[0], ORTHO_PXSZ[1])
+                if orthoBounds is None:
+                    arcpy.AddError("ERROR:  Cannot compute ortho bounds of '%s'." % (file01))
+                    return 1
+                arcpy.AddMessage("    - Bounds   : %.3f %.3f %.3f %.3f" % orthoBounds)
+
+                # Full DEM file when the scene cannot be clipped from it, as
+                # EGS_process; a directory of DEM tiles not covering the scene
+                # leaves the scene out
+                sceneDem     = demCacheObj.clip(demBounds, orthoProjection)
+                if sceneDem is None and os.path.isfile(demFilename):
+                    arcpy.AddWarning("    - DEM not clipped to scene, using full DEM file.")
+                    sceneDem = demFilename
+                if sceneDem is None:
+                    arcpy.AddWarning("    - DEM does not cover scene, skipped.\n")
+                    continue
+                arcpy.AddMessage("    - DEM Tile : '%s'" % (sceneDem))
+
+                # NumPy/GDAL engine reads product.xml directly, no FIMPORT
+                if orthoEngine == FT1_R2ReadOrthoMosaic.ORTHO_ENGINES[1]:
+                    import rs2_product
+                    import sar_ortho
+                    orthoProduct = os.path.join(orthoDir, "o" + os.path.splitext(fileBaseName)[0] + ".tif")
+                    arcpy.AddMessage("- Ortho Product: '%s'" % (orthoProduct))
+                    orthoEngineObj = sar_ortho.SarOrtho(rs2_product.RS2Product(file01),
+                                                        polarizations=polarizations)
+                    if orthoEngineObj.orthorectify(orthoProduct, sceneDem, ORTHO_PXSZ[0],
+                                                   ORTHO_PXSZ[1], orthoProjection,
+                                                   bounds=orthoBounds) is None:
+                        arcpy.AddError("ERROR:  NumPy/GDAL orthorectification failed for '%s'." % (file01))
+                        return 1
+                    arcpy.AddMessage('- Completed NUMPY/GDAL ortho process\n')
+                    orthoProducts[sceneDir] = orthoProduct
+                    newOrthoProducts.add(orthoProduct)
+                    continue
+
                 arcpy.AddMessage("    - Pix File : '%s'" % (fileBaseName))
 
                 dbiw         = []           # Use all image
@@ -658,15 +916,9 @@ class FT1_R2ReadOrthoMosaic(object):
 
                 mfile        = file02       # Input image file name
                 # identify polarization channel(s) and last math segment elements
-                if len(dirParts) == 9:      # single pole
-                    dbic     = [1]
-                    mmseg    = [2]
-                elif len(dirParts) == 10:   # dual pole
-                    dbic     = [1,2]
-                    mmseg    = [3]
-                elif len(dirParts) == 12:   # quad pole
-                    dbic     = [1,2,3,4]
-                    mmseg    = [5]
+                # (one channel per polarization, e.g. [1,2] and [3] dual pole)
+                dbic         = sceneChannels
+                mmseg        = [len(scene['polarizations']) + 1]
                 srcbgd       = "ALL,0"      # srcbgd       = "NONE" ? "ALL,0"
                                             # Assign all incoming pixels with 0
                                             # value to background/NoData to
@@ -678,17 +930,14 @@ class FT1_R2ReadOrthoMosaic(object):
                                             # Specifies the background (NoData)
                                             # value to use for ortho pixels that
                                             # are not populated.
-                ulx          = ''
-                uly          = ''
-                lrx          = ''
-                lry          = ''
+                # Scene extent, or area of interest bounds, on the pixel grid
+                ulx, uly, lrx, lry = ["%.3f" % (bound) for bound in orthoBounds]
                 edgeclip     = [0]          # clip image by 0 percent (>0 only valid when image is not on slant)
                 tipostrn     = ""
                 mapunits     = orthoProjection
-                ORTHO_PXSZ   = orthoPixelSpacing.split(",")
                 bxpxsz       = ORTHO_PXSZ[0]
                 bypxsz       = ORTHO_PXSZ[1]
-                filedem      = demFilename  # input DEM file
+                filedem      = sceneDem     # input DEM file (scene tile)
                 dbec         = [1]          # use 1st DEM channel
                 backelev     = []
                 elevref      = "MSL"        # Elevation values referenced to mean sea level (Geoid)
@@ -705,13 +954,18 @@ class FT1_R2ReadOrthoMosaic(object):
                        proc,    sampling, resample)
 
                 arcpy.AddMessage('- Completed ORTHO2 process\n')
+                orthoProducts[sceneDir] = orthoProduct
+                newOrthoProducts.add(orthoProduct)
 
             #-------------------------------------------------------------------
-            #          MOSAIC Orthorectified Segments If More Than One
+            #          MOSAIC Orthorectified Segments Of Each Pass
             #-------------------------------------------------------------------
-            # Use directory of last scene processed above as target directory
-            # for mosaicked product.  Example scene directories derived from
-            # unpacking a SAR ZIP file might be:
+            # Segments are grouped by satellite, beam and polarizations, and
+            # split into passes where acquisitions are further apart than
+            # PASS_GAP_SECONDS.  Each pass is mosaicked once, over the ortho
+            # segments of this run only, and is named after its first segment.
+            # Example scene directories derived from unpacking a SAR ZIP file
+            # might be:
             #
             #    RS2_OK20576_PK214403_DK199768_F6F_20110507_225921_HH_HV_SGF
             #    0   1       2        3        4   5        6      7  8  9
@@ -728,105 +982,52 @@ class FT1_R2ReadOrthoMosaic(object):
             #    0           1
             arcpy.SetProgressorLabel("MOSAIC Orthorectified Segments...")
             arcpy.AddMessage("MOSAIC Orthorectified Segments")
-           	# add dummy '_' to offset polarizations to index values 1,2
-            if len(dirParts) == 9:     # single pole
-                productPol = ['_', dirParts[7]]
-            elif len(dirParts) == 10:  # dual pole
-                productPol = ['_', dirParts[7], dirParts[8]]
-            elif len(dirParts) == 12:  # quad pole
-                productPol = ['_', dirParts[7], dirParts[8], dirParts[9], dirParts[10]]
             # pack spaces within string, then assign leftmost-1 to projCode
             projParts      = orthoProjection.split()
             projCode       = ''.join(projParts[:-1])
             mosaicDir      = os.path.join(workspace, 'Mosaic')
-            mosaicFile     = "%s_%s_%s_mos.pix" % (productDate, productTime, projCode)
-            mosaicProduct  = os.path.join(mosaicDir, mosaicFile)
             if not os.path.exists(mosaicDir):
                 os.mkdir(mosaicDir)
             arcpy.AddMessage("- Mosaic Folder: '%s'" % (mosaicDir))
-            arcpy.AddMessage("- Mosaic File  : '%s'" % (mosaicProduct))
-
-            # NO mosaic, copy single segment ortho to mosaic directory
-            if numSegments == 1:
-                FILI     = orthoProduct
-                FILO     = mosaicProduct
-                DBIW     = []
-                if len(productPol) == 2:    # single pole
-                    DBIC = [1]
-                elif len(productPol) == 3:  # dual pole
-                    DBIC = [1,2]
-                elif len(productPol) == 5:  # quad pole
-                    DBIC = [1,2,3,4]
-                DBIB     = []
-                DBVS     = []
-                DBLUT    = []
-                DBPCT    = []
-                FTYPE    = "PIX"
-                FOPTIONS = ""
-                fexport(FILI, FILO, DBIW, DBIC, DBIB, DBVS, DBLUT, DBPCT, FTYPE, FOPTIONS)
-                arcpy.AddMessage("- EXPORTed single ortho segment to mosaic directory\n")
-
-            # Mosaic muliple segments in ortho directory and assemble in mosaic directory
-            elif numSegments >= 1:
-                MFILE    = orthoDir
-                if len(productPol) == 2:    # single pole
-                    DBICLIST = "1"
-                elif len(productPol) == 3:  # dual pole
-                    DBICLIST = "1,2"
-                elif len(productPol) == 5:  # quad pole
-                    DBICLIST = "1,2,3,4"
-                MOSTYPE  = "FULL"
-                FILO     = mosaicProduct
-                FTYPE    = "PIX"
-                FOPTIONS = "BAND"
-                CLRMOS   = "YES"
-                STARTIMG = ""
-                RADIOCOR = "NONE"
-                BALMTHD  = "NONE"
-                BALOPT   = [0]
-                FILI_REF = ""
-                LOCLMASK = "NONE"
-                GLOBFILE = ""
-                GLOBMASK = []
-                CUTMTHD  = "ENTIRE"
-            #    CUTMTHD="MINDIFF"  EASI setting
-                FILVIN   = ""
-                DBIV     = [0]
-                FILVOUT  = ""
-                DBOV     = [0]
-                DBLUTO   = ""
-            #    BLEND    =[2]    # EASI setting
-                BLEND    = [0]
-                BACKVAL  = [0.0]
-                TEMPDIR  = ""
-                automos(MFILE,    DBICLIST, MOSTYPE,  FILO,    FTYPE,   FOPTIONS,
-                        CLRMOS,   STARTIMG, RADIOCOR, BALMTHD, BALOPT,  FILI_REF,
-                        LOCLMASK, GLOBFILE, GLOBMASK, CUTMTHD, FILVIN,  DBIV,
-                        FILVOUT,  DBOV,     DBLUTO,   BLEND,   BACKVAL, TEMPDIR)
-
-                arcpy.AddMessage('- AUTOMOSed multiple ortho segments to mosaic directory\n')
 
-            #-------------------------------------------------------------------
-            #       EXPORT Each Mosaic Polarization To Separate TIF File
-            #-------------------------------------------------------------------
-            arcpy.SetProgressorLabel("EXPORT Each Mosaic Polarization To Separate TIF File...")
-            arcpy.AddMessage("EXPORT Each Mosaic Polarization To Separate TIF File")
-            for channel in range(1,len(productPol)):
-                mosaicProductTIF = os.path.join(mosaicDir, "%s_%s_%s_mos_%s.tif" % (productDate, productTime, projCode, productPol[channel]))
-                arcpy.AddMessage("- Writing channel [%d] to '%s'" % (channel, mosaicProductTIF))
-                ftype    = '"' + 'TIF'
-                foption  = '"' + 'WORLD'
-                FILI     = mosaicProduct
-                FILO     = mosaicProductTIF
-                DBIW     = []
-                DBIC     = [channel]
-                DBIB     = []
-                DBVS     = []
-                DBLUT    = []
-                DBPCT    = []
-                FTYPE    = "TIF"
-                FOPTIONS = "WORLD"
-                fexport(FILI, FILO, DBIW, DBIC, DBIB, DBVS, DBLUT, DBPCT, FTYPE, FOPTIONS)
+            # Passes are formed over all scenes, so a pass keeps the name of
+            # its first segment when that segment is outside the area of
+            # interest; passes with no segment inside it are not mosaicked.
+            sceneGroups = FT1_R2ReadOrthoMosaic.groupScenes(scenes)
+            mosaicJobs  = [(sceneGroup, [orthoProducts[scene['name']] for scene in sceneGroup
+                                         if scene['name'] in orthoProducts])
+                           for sceneGroup in sceneGroups]
+            mosaicJobs  = [job for job in mosaicJobs if job[1]]
+            arcpy.AddMessage("- Number Of Passes To Mosaic = %d\n" % (len(mosaicJobs)))
+
+            def mosaicJob(job):
+                messages = []
+                result   = self.mosaicGroup(job[0], job[1], mosaicDir, projCode, mosaicMode,
+                                            newOrthoProducts, polarizations, materialize, messages)
+                return result, messages
+
+            # VRT passes are independent and are written in parallel.  PCI
+            # Geomatica algorithms are run one pass at a time.  Messages of
+            # the worker threads are issued from this thread, pass by pass.
+            if mosaicMode == FT1_R2ReadOrthoMosaic.MOSAIC_MODES[1] and len(mosaicJobs) > 1:
+                pool = ThreadPool(min(len(mosaicJobs), cpu_count()))
+                try:
+                    mosaicOutputs = pool.map(mosaicJob, mosaicJobs)
+                finally:
+                    pool.close()
+                    pool.join()
+                mosaicResults = []
+                for result, messages in mosaicOutputs:
+                    for function, msgText in messages:
+                        getattr(arcpy, function)(msgText)
+                    mosaicResults.append(result)
+            else:
+                mosaicResults = [self.mosaicGroup(job[0], job[1], mosaicDir, projCode, mosaicMode,
+                                                  newOrthoProducts, polarizations, materialize)
+                                 for job in mosaicJobs]
+
+            if None in mosaicResults:
+                return 1
 
             #-------------------------------------------------------------------
             #                               DONE
@@ -855,6 +1056,213 @@ class FT1_R2ReadOrthoMosaic(object):
     # ================ #
     # Instance Methods #
     # ================ #
+    def mosaicGroup(self, sceneGroup, groupOrthoProducts, mosaicDir, projCode, mosaicMode,
+                    newOrthoProducts=None, polarizations=None, materialize=False,
+                    messages=None):
+        """
+        Mosaics the orthorectified segments of one pass and separates the
+        mosaic into one image per polarization channel.
+
+        Parameters:
+            TYPE        NAME            DESCRIPTION
+            Dict[]      sceneGroup      Scenes of the pass, as returned by
+                                        "groupScenes".
+            String[]    groupOrthoProducts
+                                        Orthorectified segments of the pass,
+                                        in the same order as sceneGroup.
+                                        Scenes outside the area of interest
+                                        have no segment.
+            String      mosaicDir       Directory in which the mosaic and
+                                        polarization images are written.
+            String      projCode        Projection code used in file names
+                                        (eg. "UTM14").
+            String      mosaicMode      One of MOSAIC_MODES.
+            Set         newOrthoProducts
+                                        Segments orthorectified by this run,
+                                        only these are merged in "INCREMENTAL"
+                                        mosaic mode.
+            String[]    polarizations   Polarizations the segments were
+                                        orthorectified for, all captured
+                                        polarizations if None.
+            Boolean     materialize     Copy the VRT polarization views to
+                                        "<mosaic>_<POL>.tif" files, replacing
+                                        the views ("VRT" mosaic mode only).
+            List        messages        Receives the (arcpy function name,
+                                        text) of the messages instead of
+                                        arcpy when run in a worker thread,
+                                        arcpy not being thread-safe.
+
+        Return Values:
+            String[]
+            - !None  Paths and names of the polarization images.
+            -  None  Error encountered, message has been issued.
+
+        Limit(s) and Constraint(s) During Use:
+            Must be submitted through 64-bit Python in "AUTOMOS" mode.
+        """
+        def addMessage(msgText):
+            if messages is None:
+                arcpy.AddMessage(msgText)
+            else:
+                messages.append(('AddMessage', msgText))
+
+        def addError(msgText):
+            if messages is None:
+                arcpy.AddError(msgText)
+            else:
+                messages.append(('AddError', msgText))
+
+        productDate    = sceneGroup[0]['date']
+        productTime    = sceneGroup[0]['time']
+        # add dummy '_' to offset polarizations to index values 1,2
+        productPol     = ['_'] + [pol for pol in sceneGroup[0]['pols']
+                                  if not polarizations or pol in polarizations]
+        mosaicBaseName = "%s_%s_%s_mos" % (productDate, productTime, projCode)
+        mosaicProduct  = os.path.join(mosaicDir, mosaicBaseName + ".pix")
+        addMessage("- Pass '%s' : %d segment(s)" % (mosaicBaseName, len(groupOrthoProducts)))
+
+        # VRT mosaic and polarization views over the pass's ortho segments,
+        # replaces both AUTOMOS and the per-polarization EXPORT below
+        if mosaicMode == FT1_R2ReadOrthoMosaic.MOSAIC_MODES[1]:
+            import vrt_mosaic
+            mosaicProduct = os.path.join(mosaicDir, mosaicBaseName + ".vrt")
+            mosaicViews   = os.path.join(mosaicDir, mosaicBaseName + "_%s.vrt")
+            vrtMosaicObj  = vrt_mosaic.VrtMosaic(groupOrthoProducts)
+            if vrtMosaicObj.build_mosaic(mosaicProduct, productPol[1:]) is None:
+                addError("ERROR:  Could not write VRT mosaic '%s'." % (mosaicProduct))
+                return None
+            viewFiles = vrtMosaicObj.build_band_views(mosaicViews, productPol[1:])
+            if viewFiles is None:
+                addError("ERROR:  Could not write VRT polarization views.")
+                return None
+            for channel, viewFile in enumerate(viewFiles):
+                addMessage("  - Wrote channel [%d] view '%s'" % (channel + 1, viewFile))
+            if not materialize:
+                return viewFiles
+            # Views copied to the same TIF files as AUTOMOS mode, the views
+            # are removed so that FT2 does not list each polarization twice
+            tifFiles = []
+            for pol, viewFile in zip(productPol[1:], viewFiles):
+                tifFile = os.path.join(mosaicDir, "%s_%s.tif" % (mosaicBaseName, pol))
+                if vrtMosaicObj.materialize(viewFile, tifFile) is None:
+                    addError("ERROR:  Could not materialize view '%s'." % (viewFile))
+                    return None
+                os.remove(viewFile)
+                addMessage("  - Materialized view to '%s'" % (tifFile))
+                tifFiles.append(tifFile)
+            return tifFiles
+
+        # Merge this run's segments into the pass's GeoTIFF mosaic, rewriting
+        # only the blocks they overlap, then view each polarization as a VRT
+        if mosaicMode == FT1_R2ReadOrthoMosaic.MOSAIC_MODES[2]:
+            import mosaic_blocks
+            import vrt_mosaic
+            mosaicProduct = os.path.join(mosaicDir, mosaicBaseName + ".tif")
+            # The pass may have been named after a later segment by an earlier
+            # run, before its first segment had arrived
+            for scene in sceneGroup[1:]:
+                earlierBaseName = "%s_%s_%s_mos" % (scene['date'], scene['time'], projCode)
+                earlierProduct  = os.path.join(mosaicDir, earlierBaseName + ".tif")
+                if os.path.isfile(earlierProduct) and not os.path.isfile(mosaicProduct):
+                    addMessage("  - Rename mosaic '%s'" % (earlierProduct))
+                    os.rename(earlierProduct, mosaicProduct)
+                    for pol in productPol[1:]:
+                        earlierView = os.path.join(mosaicDir, "%s_%s.vrt" % (earlierBaseName, pol))
+                        if os.path.isfile(earlierView):
+                            os.remove(earlierView)
+            mosaicBlocksObj = mosaic_blocks.MosaicBlocks()
+            for orthoProduct in groupOrthoProducts:
+                if newOrthoProducts is not None and orthoProduct not in newOrthoProducts:
+                    continue
+                addMessage("  - Merge segment '%s'" % (orthoProduct))
+                if mosaicBlocksObj.merge_segment(mosaicProduct, orthoProduct) is None:
+                    addError("ERROR:  Could not merge '%s' into mosaic '%s'." % (orthoProduct, mosaicProduct))
+                    return None
+            mosaicViews = os.path.join(mosaicDir, mosaicBaseName + "_%s.vrt")
+            viewFiles   = vrt_mosaic.VrtMosaic([mosaicProduct]).build_band_views(mosaicViews, productPol[1:])
+            if viewFiles is None:
+                addError("ERROR:  Could not write VRT polarization views.")
+                return None
+            return viewFiles
+
+        from pci.automos import automos
+        from pci.fexport import fexport
+
+        addMessage("  - Mosaic File  : '%s'" % (mosaicProduct))
+        # NO mosaic, copy single segment ortho to mosaic directory
+        if len(groupOrthoProducts) == 1:
+            FILI     = groupOrthoProducts[0]
+            FILO     = mosaicProduct
+            DBIW     = []
+            DBIC     = range(1, len(productPol))
+            DBIB     = []
+            DBVS     = []
+            DBLUT    = []
+            DBPCT    = []
+            FTYPE    = "PIX"
+            FOPTIONS = ""
+            fexport(FILI, FILO, DBIW, DBIC, DBIB, DBVS, DBLUT, DBPCT, FTYPE, FOPTIONS)
+            addMessage("  - EXPORTed single ortho segment to mosaic directory")
+
+        # Mosaic muliple segments of the pass, listed in a text file, and
+        # assemble in mosaic directory
+        else:
+            MFILE    = os.path.join(mosaicDir, mosaicBaseName + "_segments.txt")
+            with open(MFILE, "w") as segmentList:
+                segmentList.write("\n".join(groupOrthoProducts) + "\n")
+            DBICLIST = ",".join([str(channel) for channel in range(1, len(productPol))])
+            MOSTYPE  = "FULL"
+            FILO     = mosaicProduct
+            FTYPE    = "PIX"
+            FOPTIONS = "BAND"
+            CLRMOS   = "YES"
+            STARTIMG = ""
+            RADIOCOR = "NONE"
+            BALMTHD  = "NONE"
+            BALOPT   = [0]
+            FILI_REF = ""
+            LOCLMASK = "NONE"
+            GLOBFILE = ""
+            GLOBMASK = []
+            CUTMTHD  = "ENTIRE"
+        #    CUTMTHD="MINDIFF"  EASI setting
+            FILVIN   = ""
+            DBIV     = [0]
+            FILVOUT  = ""
+            DBOV     = [0]
+            DBLUTO   = ""
+        #    BLEND    =[2]    # EASI setting
+            BLEND    = [0]
+            BACKVAL  = [0.0]
+            TEMPDIR  = ""
+            automos(MFILE,    DBICLIST, MOSTYPE,  FILO,    FTYPE,   FOPTIONS,
+                    CLRMOS,   STARTIMG, RADIOCOR, BALMTHD, BALOPT,  FILI_REF,
+                    LOCLMASK, GLOBFILE, GLOBMASK, CUTMTHD, FILVIN,  DBIV,
+                    FILVOUT,  DBOV,     DBLUTO,   BLEND,   BACKVAL, TEMPDIR)
+
+            addMessage('  - AUTOMOSed multiple ortho segments to mosaic directory')
+
+        #-----------------------------------------------------------------------
+        #       EXPORT Each Mosaic Polarization To Separate TIF File
+        #-----------------------------------------------------------------------
+        # All polarizations are written in a single pass over the mosaic
+        # (tiled, DEFLATE with horizontal predictor, plus world file) rather
+        # than one "fexport" pass per channel.
+        import mosaic_blocks
+        arcpy.SetProgressorLabel("EXPORT Each Mosaic Polarization To Separate TIF File...")
+        addMessage("  - EXPORT Each Mosaic Polarization To Separate TIF File")
+        mosaicProductTIFs = []
+        for channel in range(1,len(productPol)):
+            mosaicProductTIF = os.path.join(mosaicDir, "%s_%s.tif" % (mosaicBaseName, productPol[channel]))
+            addMessage("    - Writing channel [%d] to '%s'" % (channel, mosaicProductTIF))
+            mosaicProductTIFs.append(mosaicProductTIF)
+        if mosaic_blocks.MosaicBlocks().split_bands(mosaicProduct, mosaicProductTIFs) is None:
+            addError("ERROR:  Could not split mosaic '%s' into polarizations." % (mosaicProduct))
+            return None
+        addMessage("")
+        return mosaicProductTIFs
+
+
     def trace(self):
         """
         Provides additional details about the line of code that has triggered
@@ -887,6 +1295,173 @@ class FT1_R2ReadOrthoMosaic(object):
     # NOTE: These have been created as Class rather than Instance methods to
     #       accomodate integration of this modules into the FT0_FloodTools
     #       wrapper.
+    @staticmethod
+    def groupScenes(sceneNames):
+        """
+        Groups scenes into passes, one mosaic being produced per pass.
+
+        Scenes are grouped by satellite, beam mode and polarizations, and a
+        new pass is started whenever consecutive acquisitions are more than
+        PASS_GAP_SECONDS apart.
+
+        Parameters:
+            TYPE        NAME            DESCRIPTION
+            Object[]    sceneNames      Scene directory or ZIP file names, or
+                                        scenes of the scene catalog.
+
+        Return Values:
+            Dict[][]
+            - List of passes in acquisition order, each a list of the scenes
+              (as returned by "parseSceneName" or "catalogScene") of the pass
+              in acquisition order.  Names that cannot be parsed are ignored.
+
+        Limit(s) and Constraint(s) During Use:
+            Names are only parsed to predict the passes of ZIP files not
+            extracted yet (FT0); extracted scenes are grouped by the
+            attributes read from their product.xml.
+        """
+        scenes = [FT1_R2ReadOrthoMosaic.catalogScene(sceneName) if isinstance(sceneName, dict)
+                  else FT1_R2ReadOrthoMosaic.parseSceneName(sceneName)
+                  for sceneName in sceneNames]
+        scenes = sorted([scene for scene in scenes if scene],
+                        key=lambda scene: (scene['satellite'], scene['beam'],
+                                           scene['pols'], scene['acquired']))
+        sceneGroups = []
+        for scene in scenes:
+            if sceneGroups:
+                last = sceneGroups[-1][-1]
+                gap  = scene['acquired'] - last['acquired']
+                if (scene['satellite'], scene['beam'], scene['pols']) == \
+                   (last['satellite'], last['beam'], last['pols'])       and \
+                   gap.days * 86400 + gap.seconds <= FT1_R2ReadOrthoMosaic.PASS_GAP_SECONDS:
+                    sceneGroups[-1].append(scene)
+                    continue
+            sceneGroups.append([scene])
+        return sorted(sceneGroups, key=lambda sceneGroup: sceneGroup[0]['acquired'])
+
+
+    @staticmethod
+    def catalogScene(scene):
+        """
+        Scene parts of a scene of the scene catalog, read from its product.xml
+        rather than from its directory name, for selection and grouping.
+
+        Parameters:
+            TYPE        NAME            DESCRIPTION
+            Dict        scene           Scene of the scene catalog.
+
+        Return Values:
+            Dict
+            - !None  Scene parts, as returned by "parseSceneName": the
+                     satellite is abbreviated (e.g. RS2) as in scene names
+                     and 'acquired' is the raw data start time.  The date
+                     and time, naming the output files, are those of the
+                     scene name, as predicted by FT0 from the ZIP names, or
+                     of the raw data start time when the name is not a
+                     RADARSAT-2 scene name.
+            -  None  No valid acquisition time.
+
+        Limit(s) and Constraint(s) During Use:
+            None.
+        """
+        try:
+            acquired = datetime.datetime.strptime(str(scene['acquired'])[:19], '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            return None
+        satellite = str(scene['satellite'])
+        nameParts = FT1_R2ReadOrthoMosaic.parseSceneName(scene['name']) or \
+                    {'date' : acquired.strftime('%Y%m%d'), 'time' : acquired.strftime('%H%M%S')}
+        return {'name'      : scene['name'],
+                'satellite' : FT1_R2ReadOrthoMosaic.SATELLITE_CODES.get(satellite,
+                                                                        satellite.replace('-', '')),
+                'beam'      : str(scene['beam']),
+                'date'      : nameParts['date'],
+                'time'      : nameParts['time'],
+                'pols'      : [str(pol) for pol in scene['polarizations']],
+                'product'   : None,
+                'acquired'  : acquired}
+
+
+    @staticmethod
+    def parseSceneName(sceneName):
+        """
+        Splits a RADARSAT-2 scene directory or ZIP file name into its parts.
+        For example:
+
+            RS2_OK20576_PK214403_DK199768_F6F_20110507_225921_HH_HV_SGF
+            0   1       2        3        4   5        6      7  8  9
+
+        Parameters:
+            TYPE        NAME            DESCRIPTION
+            String      sceneName       Scene directory or ZIP file name, with
+                                        or without path.
+
+        Return Values:
+            Dict
+            - !None  Scene parts: 'name' (scene directory name), 'satellite',
+                     'beam', 'date', 'time', 'pols' (list of polarizations),
+                     'product' (product type) and 'acquired' (datetime).
+            -  None  Name is not a RADARSAT-2 scene name.
+
+        Limit(s) and Constraint(s) During Use:
+            None.
+        """
+        name  = os.path.basename(sceneName)
+        if name.lower().endswith('.zip'):
+            name = name[:-4]
+        parts = name.split('_')
+        if len(parts) not in (9, 10, 12):
+            return None
+        try:
+            acquired = datetime.datetime.strptime(parts[5] + parts[6], '%Y%m%d%H%M%S')
+        except ValueError:
+            return None
+        return {'name'      : name,
+                'satellite' : parts[0],
+                'beam'      : parts[4],
+                'date'      : parts[5],
+                'time'      : parts[6],
+                'pols'      : parts[7:-1],
+                'product'   : parts[-1],
+                'acquired'  : acquired}
+
+
+    @staticmethod
+    def validateAreaOfInterest(areaOfInterest):
+        """
+        Verifies that the area of interest is an existing file or a bounding
+        box, returning an error message if not.
+
+        Parameters:
+            TYPE        NAME            DESCRIPTION
+            String      areaOfInterest  Shapefile or raster, or comma-delimited
+                                        bounding box "min lon,min lat,max lon,
+                                        max lat" in decimal degrees.  For
+                                        example, "-73.4,45.0,-73.0,45.6".
+
+        Return Values:
+            String
+            -  None  Area of interest is valid.
+            - !None  Area of interest is invalid.  Value returned will be an
+                     error message that can be displayed to the user or
+                     recorded in the Results window or log file.
+
+        Limit(s) and Constraint(s) During Use:
+            None.
+        """
+        if os.path.exists(areaOfInterest):
+            return None
+        bounds = areaOfInterest.split(",")
+        try:
+            minLon, minLat, maxLon, maxLat = [float(bound) for bound in bounds]
+            if -180 <= minLon < maxLon <= 180 and -90 <= minLat < maxLat <= 90:
+                return None
+        except ValueError:
+            pass
+        return "ERROR:  Area Of Interest '%s' does not exist and is not a " \
+               "bounding box \"min lon,min lat,max lon,max lat\"." % (areaOfInterest)
+
+
     @staticmethod
     def validatePixelSpacing(pixelSpacing):
         """
@@ -982,6 +1557,10 @@ def main():
         Usage:
             FT1_R2ReadOrthoMosaic.py [-h] -dem DEMFILE [-pix PIXELSPACE]
                                      [-proj PROJECTION] -ws WORKSPACE
+                                     [-engine {PCI ORTHO2,NUMPY/GDAL}]
+                                     [-mosmode {AUTOMOS,VRT,INCREMENTAL}]
+                                     [-aoi AREAOFINTEREST]
+                                     [-pols POLARIZATIONS] [-materialize]
 
 
         Parameters:
@@ -992,6 +1571,20 @@ def main():
             --help
                                         Show this help message and exit.
 
+            -aoi AREAOFINTEREST,        Optional
+            --areaofinterest AREAOFINTEREST
+                                        Area Of Interest.  Shapefile or raster
+                                        (e.g. the processing mask), or bounding
+                                        box "min lon,min lat,max lon,max lat".
+                                        Scenes outside of it are neither
+                                        orthorectified nor mosaicked, the
+                                        others are orthorectified over the
+                                        area of interest only.  If not passed,
+                                        all scenes are processed in full.
+                                        Examples:
+                                        D:\Floods\BaseData\QC\ProcessingMask\QC_Richelieu_Mask_7p5km.shp
+                                        "-73.4,45.0,-73.0,45.6"
+
             -dem DEMFILE,               Mandatory
             --demfile DEMFILE
                                         Digital Elevation Model (DEM) File.
@@ -1001,9 +1594,43 @@ def main():
                                         layover, foreshortening and so on.
                                         Areal coverage must be larger than
                                         images to which it will be applied.
+                                        May also be a directory of DEM tiles.
                                         Example:
                                         D:\Floods\BaseData\QC\DEM\QC_Richelieu_UTM18_DEM_30.img
 
+            -engine ENGINE,             Optional
+            --orthoengine ENGINE
+                                        Ortho Engine.  Orthorectification
+                                        engine, either PCI Geomatica's ortho2
+                                        ("PCI ORTHO2") or the NumPy/GDAL engine
+                                        ("NUMPY/GDAL") that does not require
+                                        PCI Geomatica.  If not passed, will use
+                                        "PCI ORTHO2".
+                                        Example:
+                                        "NUMPY/GDAL"
+
+            -mosmode MODE,              Optional
+            --mosaicmode MODE
+                                        Mosaic Mode.  "AUTOMOS" mosaics with
+                                        PCI Geomatica's automos and exports
+                                        each polarization to a TIF file, "VRT"
+                                        writes a GDAL VRT mosaic and one VRT
+                                        view per polarization without copying
+                                        pixels, "INCREMENTAL" merges segments
+                                        that are new since the last run into
+                                        the GeoTIFF mosaic of their pass.  If
+                                        not passed, will use "AUTOMOS".
+                                        Example:
+                                        "VRT"
+
+            -materialize,               Optional
+            --materialize
+                                        Materialize VRT Views.  In "VRT" mosaic
+                                        mode, copies each polarization view to
+                                        a tiled, compressed TIF file (as
+                                        "AUTOMOS" mode names them) and removes
+                                        the view.  Ignored in the other modes.
+
             -pix PIXELSPACE,            Optional
             --pixelspace PIXELSPACE
                                         Pixel Spacing.  Comma-delimited pair of
@@ -1017,6 +1644,16 @@ def main():
                                         Example:
                                         "30,30"
 
+            -pols POLARIZATIONS,        Optional
+            --polarizations POLARIZATIONS
+                                        Polarizations.  Comma-delimited list of
+                                        the polarization channels to
+                                        orthorectify, mosaic and export.  If
+                                        not passed, all captured channels are
+                                        processed.
+                                        Example:
+                                        "HH,HV"
+
             -proj PROJECTION,           Mandatory
             --projection PROJECTION
                                         Projection.  Used to reproject the
@@ -1116,15 +1753,53 @@ def main():
                             "  C:\\Python27\\ArcGISx6410.3\\python.exe FT1_R2ReadOrthoMosaic.py ^\n"     +
                             "  -ws \"D:\\Floods\\QC_Richelieu\\20110507_225926_F6F\" ^\n"          +
                             "  -dem \"D:\\Floods\\BaseData\\QC\DEM\\QC_Richelieu_CanLCC_DEM_30.img\"\n\n")
+        parser.add_argument('-aoi', '--areaofinterest',
+                            required=False, action='store', dest='areaOfInterest',
+                            help="Area Of Interest.  Shapefile or raster (e.g. the\n"      +
+                                 "processing mask), or bounding box \"min lon,min lat,\n"  +
+                                 "max lon,max lat\".  Scenes outside of it are neither\n" +
+                                 "orthorectified nor mosaicked, the others are\n"        +
+                                 "orthorectified over the area of interest only.  If\n"  +
+                                 "not passed, all scenes are processed in full.\n"       +
+                                 "Examples:\n"                                            +
+                                 "D:\\Floods\\BaseData\\QC\\ProcessingMask\\QC_Richelieu_Mask_7p5km.shp\n" +
+                                 "\"-73.4,45.0,-73.0,45.6\"\n")
         parser.add_argument('-dem', '--demfile',
                             required=True, action='store', dest='demFile',
                             help="Digital Elevation Model (DEM) File.  Used during\n"      +
                                  "orthorectification to correct pixel distortion in SAR\n" +
                                  "images caused by layover, foreshortening and so on.\n"   +
                                  "Areal coverage must be larger than images to which it\n" +
-                                 "will be applied.\n"                                      +
+                                 "will be applied.  May also be a directory of DEM tiles.\n" +
                                  "Example:\n"                                              +
                                  "D:\\Floods\\BaseData\\QC\DEM\\QC_Richelieu_UTM18_DEM_30.img\n")
+        parser.add_argument('-engine', '--orthoengine',
+                            required=False, action='store', dest='orthoEngine',
+                            choices=FT1_R2ReadOrthoMosaic.ORTHO_ENGINES,
+                            help="Ortho Engine.  Orthorectification engine, either PCI\n"   +
+                                 "Geomatica's ortho2 (\"PCI ORTHO2\") or the NumPy/GDAL\n"   +
+                                 "engine (\"NUMPY/GDAL\") that does not require PCI\n"      +
+                                 "Geomatica.  If not passed, will use \"PCI ORTHO2\".\n"   +
+                                 "Example:\n"                                               +
+                                 "\"NUMPY/GDAL\"\n")
+        parser.add_argument('-mosmode', '--mosaicmode',
+                            required=False, action='store', dest='mosaicMode',
+                            choices=FT1_R2ReadOrthoMosaic.MOSAIC_MODES,
+                            help="Mosaic Mode.  \"AUTOMOS\" mosaics with PCI Geomatica's\n" +
+                                 "automos and exports each polarization to a TIF file,\n"   +
+                                 "\"VRT\" writes a GDAL VRT mosaic and one VRT view per\n"  +
+                                 "polarization without copying pixels, \"INCREMENTAL\"\n"   +
+                                 "merges segments that are new since the last run into\n"  +
+                                 "the GeoTIFF mosaic of their pass.  If not passed, will\n" +
+                                 "use \"AUTOMOS\".\n"                                       +
+                                 "Example:\n"                                               +
+                                 "\"VRT\"\n")
+        parser.add_argument('-materialize', '--materialize',
+                            required=False, action='store_true', dest='materialize',
+                            help="Materialize VRT Views.  In \"VRT\" mosaic mode,\n"     +
+                                 "copies each polarization view to a tiled, compressed\n" +
+                                 "TIF file (as \"AUTOMOS\" mode names them) and removes\n" +
+                                 "the view.  Ignored in the other modes.\n")
         parser.add_argument('-pix', '--pixelspace',
                             required=False, action='store', dest='pixelSpace',
                             help="Pixel Spacing.  Comma-delimited pair of numbers that\n"    +
@@ -1135,6 +1810,14 @@ def main():
                                  "use a default value of \"12.5,12.5\".\n"                   +
                                  "Example:\n"                                                +
                                  "\"30,30\"\n")
+        parser.add_argument('-pols', '--polarizations',
+                            required=False, action='store', dest='polarizations',
+                            help="Polarizations.  Comma-delimited list of the\n"        +
+                                 "polarization channels to orthorectify, mosaic and\n" +
+                                 "export.  If not passed, all captured channels are\n"  +
+                                 "processed.\n"                                          +
+                                 "Example:\n"                                            +
+                                 "\"HH,HV\"\n")
         parser.add_argument('-proj', '--projection',
                             required=False, action='store', dest='projection',
                             help="Projection.  Used to reproject the incoming SAR images\n"  +
@@ -1179,6 +1862,24 @@ def main():
         else:
             params[3].value = "12.5,12.5"
 
+        if cmdLineFlags.orthoEngine:
+            params[4].value = cmdLineFlags.orthoEngine
+
+        if cmdLineFlags.mosaicMode:
+            params[5].value = cmdLineFlags.mosaicMode
+
+        if cmdLineFlags.areaOfInterest:
+            if os.path.exists(cmdLineFlags.areaOfInterest):
+                params[6].value = os.path.abspath(cmdLineFlags.areaOfInterest)
+            else:
+                params[6].value = cmdLineFlags.areaOfInterest  # Bounding box
+
+        if cmdLineFlags.polarizations:
+            params[7].values = [pol.strip().upper() for pol in cmdLineFlags.polarizations.split(",")]
+
+        if cmdLineFlags.materialize:
+            params[8].value = True
+
         if DEBUG:
             print "- Parameters To Be Passed To \"execute\" Method:"
             for param in params:
@@ -883,14 +883,14 @@ class FT2_Scale16to8BitSet(object):
         """
         if parameters[0].value != None:
             parameters[1].filter.list \
-            = glob.glob(os.path.join(str(parameters[0].value),'Mosaic','*.tif'))
+            = FT2_Scale16to8BitSet.listSarImages(os.path.join(str(parameters[0].value),'Mosaic'))
             if len(parameters[1].filter.list) == 1:
                 parameters[1].values = parameters[1].filter.list
             elif len(parameters[1].filter.list) > 1:
                 selectedFile = 0
                 for i in range(len(parameters[1].filter.list)):
                     fileName = os.path.basename(parameters[1].filter.list[i])
-                    if "_HH.tif" in fileName:
+                    if os.path.splitext(fileName)[0].endswith("_HH"):
                         selectedFile = i
                         break
                 parameters[1].values = [parameters[1].filter.list[selectedFile]]
@@ -929,6 +929,34 @@ class FT2_Scale16to8BitSet(object):
     # NOTE: These have been created as Class rather than Instance methods to
     #       accomodate integration of this modules into the FT0_FloodTools
     #       wrapper.
+    @staticmethod
+    def listSarImages(mosaicDir):
+        """
+        Lists the polarized SAR images found in the Mosaic directory, either
+        TIF files exported by the "AUTOMOS" mosaic mode of FT1, or the
+        single-band VRT polarization views written by its "VRT" mosaic mode.
+        The multi-band mosaics themselves ("*_mos.vrt", and "*_mos.tif" of the
+        "INCREMENTAL" mosaic mode) are not listed.
+
+        Parameters:
+            TYPE        NAME            DESCRIPTION
+            String      mosaicDir       The path and name of the Mosaic
+                                        directory.
+
+        Return Values:
+            String[]    Sorted list of polarized SAR image paths and names,
+                        empty if none are found.
+
+        Limit(s) and Constraint(s) During Use:
+            None.
+        """
+        sarImageList  = [ f for f in glob.glob(os.path.join(mosaicDir, "*.tif"))
+                          if not f.lower().endswith("_mos.tif") ]
+        sarImageList += [ f for f in glob.glob(os.path.join(mosaicDir, "*.vrt"))
+                          if not f.lower().endswith("_mos.vrt") ]
+        return sorted(sarImageList)
+
+
     @staticmethod
     def validate16BitSARFiles(fileList):
         """
@@ -1039,10 +1067,10 @@ class FT2_Scale16to8BitSet(object):
                           "SAR images are to be found does not exist or is "  \
                           "not accessible." % (mosaicDir)
             else:
-                sarImageList = glob.glob(os.path.join(mosaicDir,"*.tif"))
+                sarImageList = FT2_Scale16to8BitSet.listSarImages(mosaicDir)
                 if sarImageList == None or len(sarImageList) == 0:
                     msgText = "ERROR:  Mosaic directory '%s' does not " \
-                              "contain 'tif' file SAR images." % (mosaicDir)
+                              "contain 'tif' or 'vrt' file SAR images." % (mosaicDir)
         return msgText
 
 
@@ -8,7 +8,7 @@ __revision__ = "--REVISION-- : $Id:  $"
 # =========
 import arcpy
 import argparse
-import subprocess
+import logging
 import sys
 import os
 import datetime
@@ -21,6 +21,23 @@ import zipfile
 # Globals #
 # ======= #
 
+class ArcpyLogHandler(logging.Handler):
+    """
+    Passes log records to the messages of the running tool, as they are
+    logged, so that the progress of EGS_process is shown while it runs.
+    """
+    def emit(self, record):
+        try:
+            msgText = self.format(record)
+            if record.levelno >= logging.ERROR:
+                arcpy.AddError(msgText)
+            elif record.levelno >= logging.WARNING:
+                arcpy.AddWarning(msgText)
+            else:
+                arcpy.AddMessage(msgText)
+        except Exception:
+            self.handleError(record)
+
 class FT4_FloodVegExtraction(object):
     """
     Performs fourth step in creating Flood Product.
@@ -589,39 +606,38 @@ class FT4_FloodVegExtraction(object):
             else:
                 os.makedirs(str(str(parameters[0].value) + "\\VEGFEP\\"))
 
-            #create the base command call
-            cmd =  'C:/Python27/ArcGISx6410.3/python.exe C:/EGS/applications/py/EGS_process.py '\
-                   '--indir %s '\
-                   '--wdir %s '\
-                   '--outdir %s '\
-                   '--logdir %s '\
-                   '--lc_file %s '\
-                   '--DEM_file %s '\
-                   '--imp_im 1 --or_im 1 --fl_im 1 --sc_im 1 --th_im 1 --im_veg 1 '\
-                   '--im_pro "%s" '\
-                   '--im_pix_x %s '\
-                   '--im_pix_y %s '\
-                   % (
-                                    #input dir
-                                    str(str(parameters[0].value) + "\\Raw\\"),
-                                    #working dir
-                                    str(str(parameters[0].value) + "\\Scratch\\"),
-                                    #output dir
-                                    str(str(parameters[0].value) + "\\VEGFEP\\"),
-                                    #log dir
-                                    str(str(parameters[0].value)+ "\\logs\\"),
-                                    #LandCover file (vegetation mask)
-                                    str(parameters[1].value),
-                                    # DEM file
-                                    str(parameters[2].value),
-                                    # projection code
-                                    str(parameters[3].value),
-                                    # x output scell resolution
-                                    str(parameters[4].value).split(',')[0],
-                                    # y output scell resolution
-                                    str(parameters[4].value).split(',')[1],
-                                    #vegetation threshold
-                                    )
+            # EGS_process is run in this interpreter, so that PCI Geomatica
+            # and the DEM tiles of earlier runs are not loaded again
+            import EGS_process
+
+            #create the base processing parameters
+            config = {
+                      #input dir
+                      'input_dir'       : str(str(parameters[0].value) + "\\Raw\\"),
+                      #working dir
+                      'work_dir'        : str(str(parameters[0].value) + "\\Scratch\\"),
+                      #output dir
+                      'output_dir'      : str(str(parameters[0].value) + "\\VEGFEP\\"),
+                      #log dir
+                      'log_dir'         : str(str(parameters[0].value)+ "\\logs\\"),
+                      #LandCover file (vegetation mask)
+                      'land_cover'      : str(parameters[1].value),
+                      # DEM file
+                      'DEM_file'        : str(parameters[2].value),
+                      'import_image'    : 1,
+                      'ortho_image'     : 1,
+                      'filter_image'    : 1,
+                      'scale_image'     : 1,
+                      'thres_image'     : 1,
+                      'import_veg'      : 1,
+                      # projection code
+                      'image_pro'       : str(parameters[3].value),
+                      # x output scell resolution
+                      'image_pixspac_x' : float(str(parameters[4].value).split(',')[0]),
+                      # y output scell resolution
+                      'image_pixspac_y' : float(str(parameters[4].value).split(',')[1]),
+                      'mode'            : 'test'
+                     }
 
             arcpy.AddMessage("Seeds directory "+str(parameters[7].value))
             arcpy.AddMessage("Open water threshold "+str(parameters[5].value))
@@ -633,35 +649,31 @@ class FT4_FloodVegExtraction(object):
                                                         str(parameters[6].value))
 
 
-            # Appending to the command call based on the results of thresholds check
+            # Completing the processing parameters based on the results of thresholds check
             if Thresholds[0] is not None:
-                cmd = cmd + '--inadir %s ' \
-                            '--th_cal 1 '\
-                            '--ow_seed water.shp ' \
-                            '--fv_seed veg_flood.shp ' \
-                            '--nfv_seed veg_non_flood.shp' \
-                             % (str(Thresholds[0]))
+                config['input_anc_dir']  = str(Thresholds[0])
+                config['cal_thres']      = 1
+                config['openwater_seed'] = 'water.shp'
+                config['floodveg_seed']  = 'veg_flood.shp'
+                config['nfloodveg_seed'] = 'veg_non_flood.shp'
                 arcpy.AddMessage("Seeds directory provided")
             else:
-                cmd = cmd + '--inadir %s ' \
-                            '--th_cal 0 '\
-                            '--v_th %s ' \
-                            '--ow_th %s ' \
-                             % (str(str(parameters[0].value) + "\\Scratch\\"),
-                             str(Thresholds[1]), str(Thresholds[2]))
-
-            # Appending the final arguments to cmd call
-            cmd = cmd + ' --m test -v'
-
-            #
-            arcpy.AddMessage(cmd)
-            proc = subprocess.Popen(cmd, shell =True,
-                                             stdout=subprocess.PIPE,
-                                             stderr=subprocess.STDOUT)
-            out, err = proc.communicate()
-            result = out.split('/n')
-            for lin in result:
-                arcpy.AddMessage(lin)
+                config['input_anc_dir']   = str(str(parameters[0].value) + "\\Scratch\\")
+                config['cal_thres']       = 0
+                config['veg_thres']       = float(Thresholds[1])
+                config['openwater_thres'] = float(Thresholds[2])
+
+            # Log records of EGS_process are shown as tool messages while it runs
+            logHandler = ArcpyLogHandler()
+            logHandler.setLevel(logging.INFO)
+            logging.getLogger('').addHandler(logHandler)
+            try:
+                status = EGS_process.run(config)
+            finally:
+                logging.getLogger('').removeHandler(logHandler)
+            if status != 0:
+                arcpy.AddError("EGS_process failed, see the log in " + config['log_dir'])
+                return 1
 
             # Cleaning up scratch space
             try:
@@ -853,7 +865,7 @@ class FT4_FloodVegExtraction(object):
         """
         Checking if Seeds directory  exists,
         if it finds it and the correct shape files it return True
-        thre script will then modify the cmd call in order to use them
+        thre script will then modify the EGS_process parameters in order to use them
         instead of the default tresholds values
         If not it creates an empty Seeds folder and returns False
         Function then checks if thresholds values have been provided in parameters
@@ -0,0 +1,268 @@
+################################################################################
+# Name : dem_cache.py
+"""
+    Module used to provide scene sized DEM tiles for orthorectification
+
+    Usage:
+        -- Clip and reproject the DEM to a scene footprint plus a margin
+        -- Keep the clipped tiles in an on-disk LRU cache
+        -- Read DEMs split over a directory of tiles through an index
+
+    Limits and constraints:
+        Tiles are written as Float32 GeoTIFF with nodata -32767.
+        Extents are snapped outwards to a geographic grid so that repeated
+        and neighbouring requests share the same cached tile.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import json
+import hashlib
+import math
+import logging
+import tempfile
+
+from osgeo import gdal, osr
+
+# Import private modules
+import EGS_utility
+
+# Extensions of the files read from a directory of DEM tiles
+DEM_EXTENSIONS = ('.tif', '.tiff', '.img', '.dem', '.hgt', '.dt0', '.dt1', '.dt2', '.vrt')
+
+# Nodata value of the cached tiles
+DEM_NODATA = -32767.0
+
+
+class DemCache:
+    """
+    Class used to provide scene sized DEM tiles for orthorectification.
+
+    The DEM source is either a single raster file or a directory of DEM
+    tiles.  Clipped and reprojected tiles are written to the cache directory
+    under a name derived from the source, extent, projection and pixel size,
+    so a tile is computed once and reused by every later request for the
+    same area.  The least recently used tiles are removed once the cache
+    exceeds its size limit.
+    The following functionality is performed by this class.
+    -- Clip the DEM to a footprint (clip)
+    -- Select the DEM tiles intersecting a footprint (sources)
+    -- Maintain the index of a directory of DEM tiles (index)
+    -- Evict least recently used tiles (evict)
+
+    """
+
+
+    def __init__(self, dem_source, cache_dir=None, max_size_mb=2048, margin=0.05, snap=0.1):
+        """Initialisation of DemCache class
+
+        Parameters:
+            dem_source  -- DEM file, or directory of DEM tiles
+            cache_dir   -- Cache directory, EGS_DemCache in the temporary
+                           directory otherwise
+            max_size_mb -- Cache size limit (MB)
+            margin      -- Margin added around footprints (degrees)
+            snap        -- Grid to which extents are snapped (degrees)
+
+        """
+        self.dem_source  = os.path.abspath(dem_source)
+        self.cache_dir   = cache_dir or os.path.join(tempfile.gettempdir(), 'EGS_DemCache')
+        self.max_size    = max_size_mb * 1024 * 1024
+        self.margin      = margin
+        self.snap        = snap
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+
+    def clip(self, bounds, proj, pixel_spacing=None):
+        """
+        DEM tile covering a footprint
+
+        Parameters:
+            bounds        -- (min longitude, min latitude, max longitude,
+                             max latitude) of the footprint
+            proj          -- Projection of the tile, PCI projection string
+                             or osr.SpatialReference
+            pixel_spacing -- Pixel spacing of the tile, DEM resolution
+                             otherwise
+
+        Return value:
+            Cached DEM tile file, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: DemCache.clip')
+            extent = self._snap_extent(bounds)
+            if isinstance(proj, basestring):
+                srs = EGS_utility.EGSUtility().pci_srs(proj)
+            else:
+                srs = proj
+            sources = self.sources(extent)
+            if not sources:
+                raise ValueError('DEM does not cover {0}'.format(extent))
+
+            identity = [EGS_utility.EGSUtility().file_stamp(path) for path in sources]
+            key = hashlib.sha1(repr((identity, extent, srs.ExportToProj4(),
+                                     pixel_spacing))).hexdigest()[:20]
+            tile = os.path.join(self.cache_dir, 'dem_' + key + '.tif')
+            if os.path.isfile(tile):
+                os.utime(tile, None)
+                logging.info('          DEM tile found in cache: ' + tile)
+                return tile
+
+            temp = os.path.join(self.cache_dir, 'tmp_{0}_{1}'.format(os.getpid(), key))
+            source = sources[0]
+            if len(sources) > 1:
+                source = gdal.BuildVRT(temp + '.vrt', sources)
+                if source is None:
+                    raise ValueError('cannot build DEM mosaic of {0} tiles'.format(len(sources)))
+
+            out_bounds = self._project_extent(extent, srs)
+            options = {'format'          : 'GTiff',
+                       'outputBounds'    : out_bounds,
+                       'dstSRS'          : srs.ExportToWkt(),
+                       'resampleAlg'     : 'bilinear',
+                       'outputType'      : gdal.GDT_Float32,
+                       'dstNodata'       : DEM_NODATA,
+                       'multithread'     : True,
+                       'creationOptions' : ['TILED=YES', 'COMPRESS=DEFLATE']}
+            if pixel_spacing:
+                options['xRes'] = options['yRes'] = float(pixel_spacing)
+            out_ds = gdal.Warp(temp + '.tif', source, **options)
+            if out_ds is None:
+                raise ValueError('cannot clip DEM to {0}'.format(extent))
+            out_ds = None
+            source = None
+            # A tile clipped meanwhile by another process is used
+            EGS_utility.EGSUtility().publish_file(temp + '.tif', tile)
+            if os.path.isfile(temp + '.vrt'):
+                os.remove(temp + '.vrt')
+            logging.info('          Successfully completed DemCache.clip: ' + tile)
+
+            self.evict()
+            return tile
+
+        except (OSError, RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('clip(): {:s}'.format(e))
+
+
+    def sources(self, extent):
+        """
+        DEM files intersecting an extent
+
+        Parameters:
+            extent -- (min longitude, min latitude, max longitude, max latitude)
+
+        Return value:
+            List of DEM files.
+
+        """
+        if os.path.isfile(self.dem_source):
+            return [self.dem_source]
+        min_x, min_y, max_x, max_y = extent
+        return sorted(path for path, entry in self.index().items()
+                      if entry[2] < max_x and entry[4] > min_x and
+                         entry[3] < max_y and entry[5] > min_y)
+
+
+    def index(self):
+        """
+        Index of a directory of DEM tiles
+
+        The geographic extent of every tile is kept in a JSON file in the
+        cache directory.  Tiles are only reopened when they are new or their
+        size or modification time changed.
+
+        Return value:
+            Dictionary {file: [size, mtime, min lon, min lat, max lon, max lat]}
+
+        """
+        index_file = os.path.join(self.cache_dir, 'index_' +
+                                  hashlib.sha1(self.dem_source).hexdigest()[:20] + '.json')
+        old = {}
+        if os.path.isfile(index_file):
+            with open(index_file) as index_in:
+                old = json.load(index_in)
+
+        index   = {}
+        changed = False
+        for root, dirs, files in os.walk(self.dem_source):
+            for name in files:
+                if os.path.splitext(name)[1].lower() not in DEM_EXTENSIONS:
+                    continue
+                path  = os.path.join(root, name)
+                stamp = [os.path.getsize(path), int(os.path.getmtime(path))]
+                entry = old.get(path)
+                if entry is None or entry[:2] != stamp:
+                    extent = self._raster_extent(path)
+                    if extent is None:
+                        continue
+                    entry   = stamp + list(extent)
+                    changed = True
+                index[path] = entry
+        if changed or len(index) != len(old):
+            with open(index_file, 'w') as index_out:
+                json.dump(index, index_out)
+            logging.info('          DEM tile index updated: {0} tiles'.format(len(index)))
+        return index
+
+
+    def evict(self):
+        """
+        Remove least recently used tiles until the cache fits its size limit
+
+        Return value:
+            Number of tiles removed.
+
+        """
+        removed = EGS_utility.EGSUtility().evict_lru(os.path.join(self.cache_dir, 'dem_*.tif'),
+                                                     self.max_size)
+        if removed:
+            logging.info('          {0} DEM tiles evicted from cache'.format(removed))
+        return removed
+
+
+    def _snap_extent(self, bounds):
+        """Footprint plus margin, snapped outwards to the snap grid"""
+        min_x, min_y, max_x, max_y = [float(value) for value in bounds]
+        return (round(math.floor((min_x - self.margin) / self.snap) * self.snap, 6),
+                round(math.floor((min_y - self.margin) / self.snap) * self.snap, 6),
+                round(math.ceil((max_x + self.margin) / self.snap) * self.snap, 6),
+                round(math.ceil((max_y + self.margin) / self.snap) * self.snap, 6))
+
+
+    def _project_extent(self, extent, srs):
+        """Bounding box of a geographic extent in srs, edges densified"""
+        transform = osr.CoordinateTransformation(EGS_utility.EGSUtility().geographic_srs(), srs)
+        min_x, min_y, max_x, max_y = extent
+        steps  = 20
+        points = []
+        for i in range(steps + 1):
+            x = min_x + (max_x - min_x) * i / float(steps)
+            y = min_y + (max_y - min_y) * i / float(steps)
+            points.extend([(x, min_y), (x, max_y), (min_x, y), (max_x, y)])
+        projected = transform.TransformPoints(points)
+        xs = [point[0] for point in projected]
+        ys = [point[1] for point in projected]
+        return (min(xs), min(ys), max(xs), max(ys))
+
+
+    def _raster_extent(self, path):
+        """Geographic extent of a raster, None if it cannot be read"""
+        dataset = gdal.Open(path)
+        if dataset is None or not dataset.GetProjection():
+            return None
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(dataset.GetProjection())
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        ulx, px, rx, uly, ry, py = dataset.GetGeoTransform()
+        corners = [(ulx + px * col + rx * row, uly + ry * col + py * row)
+                   for col in (0, dataset.RasterXSize) for row in (0, dataset.RasterYSize)]
+        projected = osr.CoordinateTransformation(srs, EGS_utility.EGSUtility().geographic_srs()).TransformPoints(corners)
+        xs = [point[0] for point in projected]
+        ys = [point[1] for point in projected]
+        return (min(xs), min(ys), max(xs), max(ys))
@@ -0,0 +1,217 @@
+################################################################################
+# Name : flood_threshold.py
+"""
+    Module used to classify open water and flooded vegetation in one pass
+
+    Usage:
+        -- Filter speckle, scale to DB and apply both thresholds per block
+        -- Write the classes to an array of the working store
+        -- Write the classes to a compact GeoTIFF
+
+    Limits and constraints:
+        The input is intensity (power), e.g. the calibrated and orthorectified
+        GeoTIFF of sar_ortho.  Background pixels (value 0) are left unclassified.
+        Filtered, DB and threshold values only exist block by block in memory.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import logging
+from multiprocessing import cpu_count
+
+import numpy
+from osgeo import gdal
+
+# Import private modules
+import EGS_utility
+import speckle_filter
+
+# Classes; thresholds may overlap, a pixel being both open water and flooded
+# vegetation, each mask is then a contiguous range of classes:
+#   open water = [OPEN_WATER, BOTH], flooded vegetation = [BOTH, VEG_FLOOD]
+UNCLASSIFIED = 0
+OPEN_WATER   = 1
+BOTH         = 2
+VEG_FLOOD    = 3
+
+
+class FloodThreshold:
+    """
+    Class used to classify open water and flooded vegetation in one pass.
+
+    Each block of intensities is read with the halo of the speckle filter,
+    filtered, scaled to DB (10*log10) and compared to the open water
+    (<= openwater_thres) and flooded vegetation (>= veg_thres) thresholds,
+    in worker threads.  Only the classes are written, one byte per pixel
+    holding both masks, instead of a filtered and a scaled 32-bit channel.
+    The following functionality is performed by this class.
+    -- Classify a block of filtered intensities (classify)
+    -- Classify an image tile by tile (class_blocks)
+    -- Write the classes to a band-like array (write_band)
+    -- Write the classes to a GeoTIFF (write)
+
+    """
+
+
+    def __init__(self, veg_thres=-3.5, openwater_thres=-12.5, speckle=None, tile_size=512,
+                 num_threads=None):
+        """Initialisation of FloodThreshold class
+
+        Parameters:
+            veg_thres       -- Minimum DB of flooded vegetation
+            openwater_thres -- Maximum DB of open water
+            speckle         -- speckle_filter.SpeckleFilter, Gamma-MAP 5x5
+                               with 4 looks (as fgamma) otherwise
+            tile_size       -- Tile size (pixels)
+            num_threads     -- Number of worker threads, defaults to CPU count
+
+        """
+        self.veg_thres       = float(veg_thres)
+        self.openwater_thres = float(openwater_thres)
+        self.speckle         = speckle or speckle_filter.SpeckleFilter()
+        self.tile_size       = int(tile_size)
+        self.num_threads     = num_threads or cpu_count()
+
+
+    def classify(self, values):
+        """
+        Classify a block of filtered intensities
+
+        Parameters:
+            values -- 2-D array of filtered intensities
+
+        Return value:
+            uint8 array of classes (UNCLASSIFIED, OPEN_WATER, BOTH, VEG_FLOOD).
+
+        """
+        valid = values > 0
+        db    = numpy.full(values.shape, numpy.nan, dtype=numpy.float32)
+        numpy.log10(values, out=db, where=valid)
+        db   *= 10.0
+        with numpy.errstate(invalid='ignore'):
+            water = valid & (db <= self.openwater_thres)
+            veg   = valid & (db >= self.veg_thres)
+        classes = numpy.zeros(values.shape, dtype=numpy.uint8)
+        classes[water] = OPEN_WATER
+        classes[veg]   = VEG_FLOOD
+        classes[water & veg] = BOTH
+        return classes
+
+
+    def class_blocks(self, read_window, pixels, lines, band=0):
+        """
+        Classify an image tile by tile
+
+        Tiles are filtered and classified in worker threads and yielded as
+        they complete, not in image order.
+
+        Parameters:
+            read_window -- Function (band, xoff, yoff, xsize, ysize) returning
+                           a window of intensities, called from worker threads
+            pixels      -- Number of pixels of the image
+            lines       -- Number of lines of the image
+            band        -- Band passed to read_window
+
+        Return value:
+            Iterator of (xoff, yoff, uint8 array of classes) tiles.
+
+        """
+        filtered_window = self.speckle.filtered(read_window, pixels, lines)
+        util = EGS_utility.EGSUtility()
+
+        def tile_task(tile):
+            xoff, yoff, xsize, ysize = tile
+            return xoff, yoff, self.classify(filtered_window(band, xoff, yoff, xsize, ysize))
+
+        return util.tile_map(tile_task, util.image_tiles(pixels, lines, self.tile_size),
+                             self.num_threads)
+
+
+    def write_band(self, in_file, in_chan, out_band):
+        """
+        Write the classes to a band-like array
+
+        Parameters:
+            in_file  -- Input raster (intensity)
+            in_chan  -- Channel of intensities
+            out_band -- uint8 band of the input size, e.g. a
+                        work_store.StoreArray (WriteArray)
+
+        Return value:
+            Output band when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: FloodThreshold.write_band')
+            in_ds = gdal.Open(in_file)
+            if in_ds is None:
+                raise ValueError('cannot open ' + in_file)
+            counts = self._write_classes(in_ds, in_chan, out_band)
+            out_band.FlushCache()
+            in_ds = None
+            self._log_counts(counts)
+            logging.info('          Successfully completed FloodThreshold.write_band')
+            return out_band
+
+        except (OSError, RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('write_band(): {:s}'.format(e))
+
+
+    def write(self, in_file, out_file, in_band=1):
+        """
+        Write the classes to a GeoTIFF
+
+        Parameters:
+            in_file  -- Input raster (intensity)
+            out_file -- Output GeoTIFF, 2 bits per pixel, compressed
+            in_band  -- Input band
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: FloodThreshold.write')
+            in_ds = gdal.Open(in_file)
+            if in_ds is None:
+                raise ValueError('cannot open ' + in_file)
+            options = ['TILED=YES', 'COMPRESS=DEFLATE', 'NBITS=2',
+                       'BLOCKXSIZE=256', 'BLOCKYSIZE=256']
+            out_ds = gdal.GetDriverByName('GTiff').Create(out_file, in_ds.RasterXSize,
+                         in_ds.RasterYSize, 1, gdal.GDT_Byte, options)
+            if out_ds is None:
+                raise ValueError('cannot create ' + out_file)
+            out_ds.SetGeoTransform(in_ds.GetGeoTransform())
+            out_ds.SetProjection(in_ds.GetProjection())
+            counts = self._write_classes(in_ds, in_band, out_ds.GetRasterBand(1))
+            out_ds.FlushCache()
+            out_ds = None
+            in_ds  = None
+            self._log_counts(counts)
+            logging.info('          Successfully completed FloodThreshold.write: ' + out_file)
+            return out_file
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('write(): {:s}'.format(e))
+
+
+    def _write_classes(self, in_ds, in_band, out_band):
+        """Classify in_band of in_ds into out_band, return the class counts"""
+        read_window = EGS_utility.EGSUtility().window_reader(in_ds, in_band)
+        counts = numpy.zeros(VEG_FLOOD + 1, dtype=numpy.int64)
+        for xoff, yoff, classes in self.class_blocks(read_window, in_ds.RasterXSize,
+                                                     in_ds.RasterYSize):
+            with read_window.lock:
+                out_band.WriteArray(classes, xoff, yoff)
+            counts += numpy.bincount(classes.ravel(), minlength=VEG_FLOOD + 1)
+        return counts
+
+
+    def _log_counts(self, counts):
+        """Log the number of pixels of each mask"""
+        logging.info('          Open water pixels: ' + str(counts[OPEN_WATER] + counts[BOTH]))
+        logging.info('          Flooded vegetation pixels: ' + str(counts[VEG_FLOOD] + counts[BOTH]))
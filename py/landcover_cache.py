@@ -0,0 +1,218 @@
+################################################################################
+# Name : landcover_cache.py
+"""
+    Module used to provide rasterized vegetation land cover for image grids
+
+    Usage:
+        -- Rasterize the land cover in fixed blocks of the output grid
+        -- Keep the rasterized blocks in an on-disk LRU cache
+        -- Read the vegetation mask of an image from the cached blocks
+
+    Limits and constraints:
+        Blocks are written as 1-bit DEFLATE GeoTIFF (1 = vegetation).
+        Images must be north up.  All polygons of the first layer of the
+        land cover file are burnt, as vegcover2bit does; only those
+        intersecting a block are read, through the spatial index of the land
+        cover (see vector_subset).
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import glob
+import hashlib
+import logging
+import tempfile
+from multiprocessing import cpu_count
+
+import numpy
+from osgeo import gdal, osr
+
+# Import private modules
+import EGS_utility
+import vector_subset
+
+
+class LandcoverCache:
+    """
+    Class used to provide rasterized vegetation land cover for image grids.
+
+    An image grid is identified by its projection, pixel size and grid
+    origin (the offset of its pixel edges within one pixel).  The grid is
+    divided in square blocks of block_size pixels; each block is rasterized
+    once, under a name derived from the land cover file identity and the
+    grid, and read by every later scene on the same grid.  The least
+    recently used blocks are removed once the cache exceeds its size limit.
+    The following functionality is performed by this class.
+    -- Vegetation mask of an image grid (mask)
+    -- Write the vegetation mask to a channel of an image (write_channel)
+    -- Rasterize a block of the grid (block)
+    -- Evict least recently used blocks (evict)
+
+    """
+
+
+    def __init__(self, land_cover, cache_dir=None, max_size_mb=1024, block_size=4096,
+                 num_threads=None):
+        """Initialisation of LandcoverCache class
+
+        Parameters:
+            land_cover  -- Vegetation land cover vector file (e.g. shapefile)
+            cache_dir   -- Cache directory, EGS_LandcoverCache in the
+                           temporary directory otherwise
+            max_size_mb -- Cache size limit (MB)
+            block_size  -- Block size (pixels)
+            num_threads -- Number of blocks rasterized at a time, defaults
+                           to CPU count
+
+        """
+        self.land_cover  = os.path.abspath(land_cover)
+        self.cache_dir   = cache_dir or os.path.join(tempfile.gettempdir(), 'EGS_LandcoverCache')
+        self.max_size    = max_size_mb * 1024 * 1024
+        self.block_size  = int(block_size)
+        self.num_threads = num_threads or cpu_count()
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Index built once, before blocks are rasterized in worker threads
+        vector_subset.VectorSubset(self.land_cover, self.cache_dir).index()
+
+
+    def mask(self, dataset):
+        """
+        Vegetation mask of an image grid
+
+        Parameters:
+            dataset -- GDAL dataset of the image (north up)
+
+        Return value:
+            uint8 array (1 = vegetation) of the image size.
+
+        """
+        logging.info('       Executing: LandcoverCache.mask')
+        ulx, px, rx, uly, ry, py = dataset.GetGeoTransform()
+        if rx or ry:
+            raise ValueError('rotated image grids are not supported')
+        projection = dataset.GetProjection()
+        origin_x   = round(ulx % abs(px), 6) % abs(px)
+        origin_y   = round(uly % abs(py), 6) % abs(py)
+        grid       = (projection, px, py, origin_x, origin_y)
+        col0       = int(round((ulx - origin_x) / px))
+        row0       = int(round((uly - origin_y) / py))
+        cols, rows = dataset.RasterXSize, dataset.RasterYSize
+
+        size   = self.block_size
+        blocks = [(bx, by)
+                  for by in range(row0 // size, (row0 + rows - 1) // size + 1)
+                  for bx in range(col0 // size, (col0 + cols - 1) // size + 1)]
+        block_files = EGS_utility.EGSUtility().tile_map(
+                          lambda block: (block, self.block(grid, block[0], block[1])),
+                          blocks, min(self.num_threads, len(blocks)))
+
+        mask = numpy.zeros((rows, cols), dtype=numpy.uint8)
+        for (bx, by), block_file in block_files:
+            # Overlap of the block and the image, in grid columns and rows
+            c0, c1 = max(bx * size, col0), min((bx + 1) * size, col0 + cols)
+            r0, r1 = max(by * size, row0), min((by + 1) * size, row0 + rows)
+            block_ds = gdal.Open(block_file)
+            mask[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = block_ds.GetRasterBand(1).ReadAsArray(
+                c0 - bx * size, r0 - by * size, c1 - c0, r1 - r0)
+            block_ds = None
+        self.evict()
+        logging.info('          Successfully completed LandcoverCache.mask: {0} blocks'.format(len(blocks)))
+        return mask
+
+
+    def write_channel(self, in_file, out_chan):
+        """
+        Write the vegetation mask to a channel of an image
+
+        Parameters:
+            in_file  -- Image file (e.g. ortho PCIDSK file), opened for update
+            out_chan -- 8-bit channel receiving the mask
+
+        Return value:
+            Output channel when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: LandcoverCache.write_channel')
+            dataset = gdal.Open(in_file, gdal.GA_Update)
+            if dataset is None:
+                raise ValueError('cannot open ' + in_file)
+            dataset.GetRasterBand(out_chan).WriteArray(self.mask(dataset))
+            dataset.FlushCache()
+            dataset = None
+            logging.info('          Successfully completed LandcoverCache.write_channel: ' + str(out_chan))
+            return out_chan
+
+        except (OSError, RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('write_channel(): {:s}'.format(e))
+
+
+    def block(self, grid, bx, by):
+        """
+        Rasterize a block of the grid
+
+        Parameters:
+            grid -- (projection WKT, pixel size x, pixel size y, origin x,
+                    origin y) of the grid
+            bx   -- Block column
+            by   -- Block row
+
+        Return value:
+            Cached block file.
+
+        """
+        projection, px, py, origin_x, origin_y = grid
+        identity = [EGS_utility.EGSUtility().file_stamp(path)
+                    for path in [self.land_cover] + glob.glob(os.path.splitext(self.land_cover)[0] + '.dbf')]
+        key = hashlib.sha1(repr((identity, projection, px, py, origin_x, origin_y,
+                                 self.block_size))).hexdigest()[:20]
+        block_file = os.path.join(self.cache_dir, 'lc_{0}_{1}_{2}.tif'.format(key, bx, by))
+        if os.path.isfile(block_file):
+            os.utime(block_file, None)
+            return block_file
+
+        size = self.block_size
+        ulx  = origin_x + bx * size * px
+        uly  = origin_y + by * size * py
+        temp = os.path.join(self.cache_dir, 'tmp_{0}_{1}_{2}_{3}.tif'.format(os.getpid(), key, bx, by))
+        options = ['TILED=YES', 'COMPRESS=DEFLATE', 'NBITS=1']
+        block_ds = gdal.GetDriverByName('GTiff').Create(temp, size, size, 1, gdal.GDT_Byte, options)
+        if block_ds is None:
+            raise ValueError('cannot create ' + temp)
+        block_ds.SetGeoTransform((ulx, px, 0.0, uly, 0.0, py))
+        block_ds.SetProjection(projection)
+        block_srs = osr.SpatialReference()
+        block_srs.ImportFromWkt(projection)
+        subset = vector_subset.VectorSubset(self.land_cover, self.cache_dir)
+        subset.index()
+        layer  = subset.layer((min(ulx, ulx + size * px), min(uly, uly + size * py),
+                               max(ulx, ulx + size * px), max(uly, uly + size * py)), block_srs)
+        if gdal.RasterizeLayer(block_ds, [1], layer, burn_values=[1]) != 0:
+            raise ValueError('cannot rasterize ' + self.land_cover)
+        block_ds.FlushCache()
+        block_ds = None
+        layer    = None
+        subset   = None
+        # A block rasterized meanwhile by another process is used
+        EGS_utility.EGSUtility().publish_file(temp, block_file)
+        logging.info('          Land cover block rasterized: ' + block_file)
+        return block_file
+
+
+    def evict(self):
+        """
+        Remove least recently used blocks until the cache fits its size limit
+
+        Return value:
+            Number of blocks removed.
+
+        """
+        removed = EGS_utility.EGSUtility().evict_lru(os.path.join(self.cache_dir, 'lc_*.tif'),
+                                                     self.max_size)
+        if removed:
+            logging.info('          {0} land cover blocks evicted from cache'.format(removed))
+        return removed
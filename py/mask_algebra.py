@@ -0,0 +1,245 @@
+################################################################################
+# Name : mask_algebra.py
+"""
+    Module used to evaluate boolean expressions of masks on bit-packed blocks
+
+    Usage:
+        -- Define masks as value ranges of raster bands (as thr)
+        -- Evaluate expressions such as (flood_veg | open_water) & veg_cover
+           block by block, 8 pixels per byte
+        -- Count the pixels of an expression
+        -- Write an expression to a 1-bit or 8-bit GeoTIFF, optionally sparse
+           (tiles without true pixels not stored)
+
+    Limits and constraints:
+        Operators are | (or), & (and), ^ (exclusive or) and ~ (not), with
+        parentheses.  All bands must have the same size and grid.  Blocks are
+        whole lines of the image, packed along the lines.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import ast
+import logging
+from multiprocessing import cpu_count
+
+import numpy
+from osgeo import gdal
+
+# Import private modules
+import EGS_utility
+
+# Number of bits set in every byte value
+BIT_COUNT = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.int64)
+
+# Tile size of the GeoTIFF output (pixels)
+TILE_SIZE = 256
+
+# Expression syntax allowed
+_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BitOr, ast.BitAnd, ast.BitXor,
+          ast.Invert, ast.Name, ast.Load)
+
+
+class MaskAlgebra:
+    """
+    Class used to evaluate boolean expressions of masks on bit-packed blocks.
+
+    Each mask is a range of values of a raster band, e.g. the classes of the
+    flood_threshold channel or the land cover channel.  Blocks of lines are
+    read, compared to the ranges and packed with numpy.packbits, then the
+    expression is evaluated with the bitwise operators of NumPy on the packed
+    bytes, in worker threads.  This replaces blo on bitmap segments, and clr
+    and map on an 8-bit channel, for export.
+    The following functionality is performed by this class.
+    -- Compile an expression (compile)
+    -- Evaluate an expression block by block (mask_blocks)
+    -- Count the pixels of an expression (count)
+    -- Write an expression to a GeoTIFF (write)
+
+    """
+
+
+    def __init__(self, operands, block_lines=512, num_threads=None):
+        """Initialisation of MaskAlgebra class
+
+        Parameters:
+            operands    -- Dictionary of masks, name: (raster, band, minimum
+                           value, maximum value), the raster being a file or
+                           an open dataset (e.g. work_store.StoreArray)
+            block_lines -- Number of lines of a block
+            num_threads -- Number of worker threads, defaults to CPU count
+
+        """
+        self.operands    = dict(operands)
+        self.block_lines = int(block_lines)
+        self.num_threads = num_threads or cpu_count()
+
+
+    def compile(self, expression):
+        """
+        Compile an expression
+
+        Parameters:
+            expression -- Expression of operand names, e.g.
+                          '(flood_veg | open_water) & veg_cover'
+
+        Return value:
+            (code object, names of the operands used).
+
+        """
+        tree  = ast.parse(expression, mode='eval')
+        names = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, _NODES):
+                raise ValueError('unsupported mask expression: ' + expression)
+            if isinstance(node, ast.Name):
+                if node.id not in self.operands:
+                    raise ValueError('unknown mask {0} in {1}'.format(node.id, expression))
+                names.add(node.id)
+        return compile(tree, '<mask>', 'eval'), sorted(names)
+
+
+    def mask_blocks(self, expression):
+        """
+        Evaluate an expression block by block
+
+        Blocks are evaluated in worker threads and yielded as they complete,
+        not in image order.
+
+        Parameters:
+            expression -- Expression of operand names
+
+        Return value:
+            Iterator of (yoff, uint8 array of lines x ceil(pixels / 8) packed
+            bits) blocks, the spare bits of the last byte of a line are 0.
+
+        """
+        code, names = self.compile(expression)
+        datasets = {}
+        for name in names:
+            raster = self.operands[name][0]
+            if raster not in datasets:
+                datasets[raster] = self._open(raster)
+        sizes = set((dataset.RasterXSize, dataset.RasterYSize) for dataset in datasets.values())
+        if len(sizes) != 1:
+            raise ValueError('masks of different sizes: ' + expression)
+        pixels, lines = sizes.pop()
+
+        # Spare bits of the last byte of a line, set by ~
+        spare = (8 - pixels % 8) % 8
+        last  = numpy.uint8((0xFF << spare) & 0xFF)
+
+        util    = EGS_utility.EGSUtility()
+        readers = dict((raster, util.window_reader(dataset)) for raster, dataset in datasets.items())
+
+        def block_task(yoff):
+            rows   = min(self.block_lines, lines - yoff)
+            packed = {}
+            for name in names:
+                raster, band, low, high = self.operands[name]
+                values = readers[raster](band, 0, yoff, pixels, rows)
+                packed[name] = numpy.packbits((values >= low) & (values <= high), axis=1)
+            result = eval(code, {'__builtins__': {}}, packed)
+            result = numpy.array(result, dtype=numpy.uint8)
+            result[:, -1] &= last
+            return yoff, result
+
+        try:
+            for result in util.tile_map(block_task, range(0, lines, self.block_lines),
+                                        self.num_threads):
+                yield result
+        finally:
+            readers  = None
+            datasets = None
+
+
+    def count(self, expression):
+        """
+        Count the pixels of an expression
+
+        Parameters:
+            expression -- Expression of operand names
+
+        Return value:
+            Number of pixels where the expression is true.
+
+        """
+        return int(sum(BIT_COUNT[packed].sum() for yoff, packed in self.mask_blocks(expression)))
+
+
+    def write(self, expression, out_file, nbits=1, value=1, sparse=False):
+        """
+        Write an expression to a GeoTIFF
+
+        Parameters:
+            expression -- Expression of operand names
+            out_file   -- Output GeoTIFF, replaced if it exists
+            nbits      -- 1 (packed) or 8 bits per pixel
+            value      -- Value of true pixels (1 when nbits is 1), 0 elsewhere
+            sparse     -- Write only the tiles holding true pixels (SPARSE_OK),
+                          the others are not stored and read as 0
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+            Georeferencing is copied from the first operand of the expression.
+            Sparse output is smallest when block_lines is a multiple of
+            TILE_SIZE, so that no tile is written twice.
+        """
+        try:
+            logging.info('       Executing: MaskAlgebra.write: ' + expression)
+            if nbits not in (1, 8):
+                raise ValueError('nbits must be 1 or 8: {0}'.format(nbits))
+            if nbits == 1 and value != 1:
+                raise ValueError('value must be 1 for 1-bit output: {0}'.format(value))
+            code, names = self.compile(expression)
+            ref_ds = self._open(self.operands[names[0]][0])
+            pixels, lines = ref_ds.RasterXSize, ref_ds.RasterYSize
+            options = ['TILED=YES', 'COMPRESS=DEFLATE', 'BLOCKXSIZE={0}'.format(TILE_SIZE),
+                       'BLOCKYSIZE={0}'.format(TILE_SIZE)]
+            if nbits == 1:
+                options.append('NBITS=1')
+            if sparse:
+                options.append('SPARSE_OK=TRUE')
+            out_ds = gdal.GetDriverByName('GTiff').Create(out_file, pixels, lines, 1,
+                                                          gdal.GDT_Byte, options)
+            if out_ds is None:
+                raise ValueError('cannot create ' + out_file)
+            out_ds.SetGeoTransform(ref_ds.GetGeoTransform())
+            out_ds.SetProjection(ref_ds.GetProjection())
+            ref_ds   = None
+            out_band = out_ds.GetRasterBand(1)
+            total    = 0
+            for yoff, packed in self.mask_blocks(expression):
+                total += int(BIT_COUNT[packed].sum())
+                if sparse and not packed.any():
+                    continue
+                block  = numpy.unpackbits(packed, axis=1)[:, :pixels]
+                if value != 1:
+                    block *= numpy.uint8(value)
+                if not sparse:
+                    out_band.WriteArray(block, 0, yoff)
+                    continue
+                # Only the tiles holding true pixels are written
+                for xoff in range(0, pixels, TILE_SIZE):
+                    if packed[:, xoff // 8:(xoff + TILE_SIZE) // 8].any():
+                        out_band.WriteArray(block[:, xoff:xoff + TILE_SIZE], xoff, yoff)
+            out_ds.FlushCache()
+            out_ds = None
+            logging.info('          Pixels: ' + str(total))
+            logging.info('          Successfully completed MaskAlgebra.write: ' + out_file)
+            return out_file
+
+        except (RuntimeError, ValueError, SyntaxError) as e:
+            EGS_utility.EGSUtility().error('write(): {:s}'.format(e))
+
+
+    def _open(self, raster):
+        """Dataset of a raster file, or the raster itself when already open"""
+        if not isinstance(raster, basestring):
+            return raster
+        dataset = gdal.Open(raster)
+        if dataset is None:
+            raise ValueError('cannot open ' + raster)
+        return dataset
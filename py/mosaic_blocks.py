@@ -0,0 +1,404 @@
+################################################################################
+# Name : mosaic_blocks.py
+"""
+    Module used to update GeoTIFF mosaics block by block
+
+    Usage:
+        -- Merge a new orthorectified segment into an existing mosaic,
+           rewriting only the blocks it overlaps
+        -- Keep band statistics up to date for the rewritten blocks
+        -- Refresh the overviews over the rewritten blocks
+        -- Split a multi-band mosaic into single-band GeoTIFFs in one pass
+
+    Limits and constraints:
+        The segment must share the projection, pixel size and band layout of
+        the mosaic.  Overlaps are resolved last-wins (automos BLEND=[0]);
+        pixels with value 0 are background and never overwrite.
+        MINIMUM/MAXIMUM statistics are bounds: values overwritten by a later
+        segment are not removed from them.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import logging
+
+import numpy
+from osgeo import gdal
+
+# Import private modules
+import EGS_utility
+
+# Background value of the ortho segments and mosaics
+NODATA = 0
+
+# Overview levels built on new mosaics
+OVERVIEW_LEVELS = [2, 4, 8, 16]
+
+
+class MosaicBlocks:
+    """
+    Class used to update GeoTIFF mosaics block by block.
+
+    The mosaic is a tiled GeoTIFF; a new segment only touches the tiles it
+    overlaps, so the cost of an update is proportional to the size of the
+    segment rather than the size of the mosaic.  Running sums are kept in
+    the band metadata so that statistics can be updated from the rewritten
+    blocks alone.
+    The following functionality is performed by this class.
+    -- Merge a segment into a mosaic (merge_segment)
+    -- Create a mosaic from a first segment (create_mosaic)
+    -- Split a mosaic into one GeoTIFF per band (split_bands)
+
+    """
+
+
+    def __init__(self, block_size=256):
+        """Initialisation of MosaicBlocks class
+
+        Parameters:
+            block_size -- Tile size of newly created mosaics (pixels)
+
+        """
+        self.block_size = block_size
+
+
+    def merge_segment(self, mosaic_file, segment_file):
+        """
+        Merge an orthorectified segment into a mosaic
+
+        The mosaic is created from the segment if it does not exist yet, and
+        grown (one copy of the existing pixels) if the segment extends past
+        it.  Otherwise only the blocks overlapped by the segment are read,
+        merged and rewritten, along with their statistics and overviews.
+
+        Parameters:
+            mosaic_file  -- Mosaic GeoTIFF
+            segment_file -- Orthorectified segment (any GDAL raster)
+
+        Return value:
+            Mosaic file when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: MosaicBlocks.merge_segment')
+            segment = gdal.Open(segment_file)
+            if segment is None:
+                raise ValueError('cannot open ' + segment_file)
+            if not os.path.isfile(mosaic_file):
+                self.create_mosaic(mosaic_file, segment)
+                return mosaic_file
+
+            mosaic = gdal.Open(mosaic_file, gdal.GA_Update)
+            if mosaic is None:
+                raise ValueError('cannot update ' + mosaic_file)
+            window = self._window(mosaic, segment)
+            if window is None:
+                mosaic = None
+                self._grow(mosaic_file, segment)
+                mosaic = gdal.Open(mosaic_file, gdal.GA_Update)
+                window = self._window(mosaic, segment)
+
+            blocks = self._merge_blocks(mosaic, segment, window)
+            mosaic.FlushCache()
+            mosaic = None
+            logging.info('          Successfully completed MosaicBlocks.merge_segment: '
+                         '{0} blocks rewritten'.format(blocks))
+            return mosaic_file
+
+        except (OSError, RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('merge_segment(): {:s}'.format(e))
+
+
+    def create_mosaic(self, mosaic_file, segment, geotransform=None, cols=None, rows=None):
+        """
+        Create a mosaic from a first segment
+
+        Parameters:
+            mosaic_file  -- Mosaic GeoTIFF
+            segment      -- First segment, GDAL dataset
+            geotransform -- Geotransform of the mosaic, the segment's otherwise
+            cols         -- Number of columns of the mosaic
+            rows         -- Number of rows of the mosaic
+
+        Return value:
+            None
+
+        Limits and constraints:
+
+        """
+        band      = segment.GetRasterBand(1)
+        data_type = band.DataType
+        options   = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER',
+                     'BLOCKXSIZE={0}'.format(self.block_size),
+                     'BLOCKYSIZE={0}'.format(self.block_size)]
+        if data_type not in (gdal.GDT_Float32, gdal.GDT_Float64):
+            options.append('PREDICTOR=2')
+        mosaic = gdal.GetDriverByName('GTiff').Create(mosaic_file,
+                     cols or segment.RasterXSize, rows or segment.RasterYSize,
+                     segment.RasterCount, data_type, options)
+        if mosaic is None:
+            raise ValueError('cannot create ' + mosaic_file)
+        mosaic.SetGeoTransform(geotransform or segment.GetGeoTransform())
+        mosaic.SetProjection(segment.GetProjection())
+        for index in range(segment.RasterCount):
+            mosaic_band = mosaic.GetRasterBand(index + 1)
+            mosaic_band.SetNoDataValue(NODATA)
+            mosaic_band.SetDescription(segment.GetRasterBand(index + 1).GetDescription())
+        levels = [level for level in OVERVIEW_LEVELS
+                  if min(mosaic.RasterXSize, mosaic.RasterYSize) // level >= self.block_size]
+        if levels:
+            mosaic.BuildOverviews('AVERAGE', levels)
+        self._merge_blocks(mosaic, segment, self._window(mosaic, segment))
+        mosaic.FlushCache()
+        mosaic = None
+
+
+    def split_bands(self, mosaic_file, out_files):
+        """
+        Split a multi-band mosaic into one GeoTIFF per band
+
+        Every strip of the mosaic is read once, for all bands, and written
+        to all outputs.  Outputs are tiled and DEFLATE compressed, with the
+        horizontal predictor for integer (uint16 SAR) data, and come with a
+        world file as fexport FOPTIONS="WORLD" would write.
+
+        Parameters:
+            mosaic_file -- Multi-band mosaic (any GDAL raster, e.g. PCIDSK)
+            out_files   -- Output GeoTIFF per band, in band order
+
+        Return value:
+            List of output files when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: MosaicBlocks.split_bands')
+            mosaic = gdal.Open(mosaic_file)
+            if mosaic is None:
+                raise ValueError('cannot open ' + mosaic_file)
+            if len(out_files) > mosaic.RasterCount:
+                raise ValueError('{0} outputs for {1} bands'.format(len(out_files),
+                                                                    mosaic.RasterCount))
+            data_type = mosaic.GetRasterBand(1).DataType
+            options   = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER', 'TFW=YES',
+                         'BLOCKXSIZE={0}'.format(self.block_size),
+                         'BLOCKYSIZE={0}'.format(self.block_size)]
+            if data_type not in (gdal.GDT_Float32, gdal.GDT_Float64):
+                options.append('PREDICTOR=2')
+
+            outputs = []
+            for index, out_file in enumerate(out_files):
+                output = gdal.GetDriverByName('GTiff').Create(out_file, mosaic.RasterXSize,
+                             mosaic.RasterYSize, 1, data_type, options)
+                if output is None:
+                    raise ValueError('cannot create ' + out_file)
+                output.SetGeoTransform(mosaic.GetGeoTransform())
+                output.SetProjection(mosaic.GetProjection())
+                band   = output.GetRasterBand(1)
+                source = mosaic.GetRasterBand(index + 1)
+                band.SetNoDataValue(NODATA if source.GetNoDataValue() is None
+                                    else source.GetNoDataValue())
+                band.SetDescription(source.GetDescription())
+                outputs.append(output)
+
+            # One strip of output tiles at a time, all bands read together
+            band_list = range(1, len(out_files) + 1)
+            for row in range(0, mosaic.RasterYSize, self.block_size):
+                rows  = min(self.block_size, mosaic.RasterYSize - row)
+                strip = mosaic.ReadAsArray(0, row, mosaic.RasterXSize, rows, band_list=band_list)
+                if strip.ndim == 2:
+                    strip = strip[numpy.newaxis]
+                for index, output in enumerate(outputs):
+                    output.GetRasterBand(1).WriteArray(strip[index], 0, row)
+
+            for output in outputs:
+                output.FlushCache()
+            outputs = None
+            mosaic  = None
+            logging.info('          Successfully completed MosaicBlocks.split_bands')
+            return list(out_files)
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('split_bands(): {:s}'.format(e))
+
+
+    def _grow(self, mosaic_file, segment):
+        """
+        Grow a mosaic to cover a segment that extends past it
+
+        A new mosaic covering both is created and the existing mosaic is
+        merged into it block by block before it replaces the old file.
+
+        Parameters:
+            mosaic_file -- Mosaic GeoTIFF
+            segment     -- Segment, GDAL dataset
+
+        """
+        logging.info('          Growing mosaic to cover segment')
+        old = gdal.Open(mosaic_file)
+        ogt = old.GetGeoTransform()
+        sgt = segment.GetGeoTransform()
+        px, py = ogt[1], ogt[5]
+        ulx = min(ogt[0], sgt[0])
+        uly = max(ogt[3], sgt[3])
+        lrx = max(ogt[0] + old.RasterXSize * px, sgt[0] + segment.RasterXSize * sgt[1])
+        lry = min(ogt[3] + old.RasterYSize * py, sgt[3] + segment.RasterYSize * sgt[5])
+        cols = int(round((lrx - ulx) / px))
+        rows = int(round((lry - uly) / py))
+
+        grown_file = os.path.splitext(mosaic_file)[0] + '_grow.tif'
+        self.create_mosaic(grown_file, old, (ulx, px, 0.0, uly, 0.0, py), cols, rows)
+        old = None
+        os.remove(mosaic_file)
+        os.rename(grown_file, mosaic_file)
+
+
+    def _window(self, mosaic, segment):
+        """
+        Position of a segment within a mosaic
+
+        Return value:
+            (xoff, yoff, cols, rows) in mosaic pixels, None if the segment
+            extends past the mosaic.  Raises ValueError if the grids (pixel
+            size, alignment within EGS_utility.GRID_TOLERANCE) or the
+            projections differ.
+        """
+        mgt = mosaic.GetGeoTransform()
+        sgt = segment.GetGeoTransform()
+        if abs(mgt[1] - sgt[1]) > 1e-6 * abs(mgt[1]) or abs(mgt[5] - sgt[5]) > 1e-6 * abs(mgt[5]):
+            raise ValueError('segment pixel size differs from mosaic')
+        if mosaic.RasterCount != segment.RasterCount:
+            raise ValueError('segment bands differ from mosaic')
+        util = EGS_utility.EGSUtility()
+        if not util.same_projection(mosaic.GetProjection(), segment.GetProjection()):
+            raise ValueError('segment projection differs from mosaic')
+        try:
+            xoff = util.grid_offset(mgt[0], sgt[0], mgt[1])
+            yoff = util.grid_offset(mgt[3], sgt[3], mgt[5])
+        except ValueError as e:
+            raise ValueError('segment not on the mosaic grid: {0}'.format(e))
+        if xoff < 0 or yoff < 0 or xoff + segment.RasterXSize > mosaic.RasterXSize or \
+           yoff + segment.RasterYSize > mosaic.RasterYSize:
+            return None
+        return xoff, yoff, segment.RasterXSize, segment.RasterYSize
+
+
+    def _merge_blocks(self, mosaic, segment, window):
+        """
+        Merge a segment into the mosaic blocks it overlaps
+
+        Statistics are updated from the old and new values of every pixel
+        rewritten, and the overviews are refreshed over the same area.
+
+        Return value:
+            Number of blocks rewritten.
+        """
+        xoff, yoff, cols, rows = window
+        block_x, block_y = mosaic.GetRasterBand(1).GetBlockSize()
+        first_col, last_col = xoff // block_x, (xoff + cols - 1) // block_x
+        first_row, last_row = yoff // block_y, (yoff + rows - 1) // block_y
+        blocks = 0
+
+        for index in range(mosaic.RasterCount):
+            band  = mosaic.GetRasterBand(index + 1)
+            stats = _Statistics(band)
+            for block_row in range(first_row, last_row + 1):
+                for block_col in range(first_col, last_col + 1):
+                    # Block of the mosaic, clipped to the raster and segment
+                    x0 = max(block_col * block_x, xoff)
+                    y0 = max(block_row * block_y, yoff)
+                    x1 = min((block_col + 1) * block_x, xoff + cols, mosaic.RasterXSize)
+                    y1 = min((block_row + 1) * block_y, yoff + rows, mosaic.RasterYSize)
+                    new = segment.GetRasterBand(index + 1).ReadAsArray(
+                              x0 - xoff, y0 - yoff, x1 - x0, y1 - y0)
+                    valid = new != NODATA
+                    if not valid.any():
+                        continue
+                    old = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
+                    stats.remove(old[valid])
+                    stats.add(new[valid])
+                    old[valid] = new[valid]
+                    band.WriteArray(old, x0, y0)
+                    blocks += 1
+            stats.write()
+            _refresh_overviews(band, xoff, yoff, cols, rows)
+        return blocks
+
+
+class _Statistics:
+    """Running band statistics kept in the band metadata"""
+
+    def __init__(self, band):
+        self.band     = band
+        metadata      = band.GetMetadata()
+        self.count    = int(metadata.get('EGS_COUNT', 0))
+        self.total    = float(metadata.get('EGS_SUM', 0.0))
+        self.total_sq = float(metadata.get('EGS_SUMSQ', 0.0))
+        self.minimum  = float(metadata['STATISTICS_MINIMUM']) if self.count else None
+        self.maximum  = float(metadata['STATISTICS_MAXIMUM']) if self.count else None
+
+    def add(self, values):
+        """Add valid pixel values"""
+        if values.size:
+            values = values.astype(numpy.float64)
+            self.count    += values.size
+            self.total    += values.sum()
+            self.total_sq += numpy.square(values).sum()
+            low, high = values.min(), values.max()
+            self.minimum = low if self.minimum is None else min(self.minimum, low)
+            self.maximum = high if self.maximum is None else max(self.maximum, high)
+
+    def remove(self, values):
+        """Remove pixel values about to be overwritten (background ignored)"""
+        values = values[values != NODATA].astype(numpy.float64)
+        if values.size:
+            self.count    -= values.size
+            self.total    -= values.sum()
+            self.total_sq -= numpy.square(values).sum()
+
+    def write(self):
+        """Write the statistics to the band metadata"""
+        if not self.count:
+            return
+        mean     = self.total / self.count
+        variance = max(self.total_sq / self.count - mean * mean, 0.0)
+        metadata = self.band.GetMetadata()
+        metadata.update({'EGS_COUNT'          : str(self.count),
+                         'EGS_SUM'            : repr(self.total),
+                         'EGS_SUMSQ'          : repr(self.total_sq),
+                         'STATISTICS_MINIMUM' : repr(float(self.minimum)),
+                         'STATISTICS_MAXIMUM' : repr(float(self.maximum)),
+                         'STATISTICS_MEAN'    : repr(mean),
+                         'STATISTICS_STDDEV'  : repr(variance ** 0.5)})
+        self.band.SetMetadata(metadata)
+
+
+def _refresh_overviews(band, xoff, yoff, cols, rows):
+    """Recompute the overviews of band over a full resolution window"""
+    for level in range(band.GetOverviewCount()):
+        overview = band.GetOverview(level)
+        factor   = int(round(float(band.XSize) / overview.XSize))
+        ox0, oy0 = xoff // factor, yoff // factor
+        ox1 = min((xoff + cols + factor - 1) // factor, overview.XSize)
+        oy1 = min((yoff + rows + factor - 1) // factor, overview.YSize)
+        fx1 = min(ox1 * factor, band.XSize)
+        fy1 = min(oy1 * factor, band.YSize)
+        full = band.ReadAsArray(ox0 * factor, oy0 * factor,
+                                fx1 - ox0 * factor, fy1 - oy0 * factor).astype(numpy.float64)
+
+        # Pad to a multiple of the factor, then average the valid pixels
+        pad_y = (oy1 - oy0) * factor - full.shape[0]
+        pad_x = (ox1 - ox0) * factor - full.shape[1]
+        full  = numpy.pad(full, ((0, pad_y), (0, pad_x)), 'constant', constant_values=NODATA)
+        cells = full.reshape(oy1 - oy0, factor, ox1 - ox0, factor)
+        valid = (cells != NODATA).sum(axis=(1, 3))
+        total = cells.sum(axis=(1, 3))
+        mean  = numpy.where(valid > 0, total / numpy.maximum(valid, 1), NODATA)
+        dtype = band.ReadAsArray(0, 0, 1, 1).dtype
+        if dtype.kind in 'iu':
+            mean = numpy.rint(mean)
+        overview.WriteArray(mean.astype(dtype), ox0, oy0)
@@ -0,0 +1,105 @@
+################################################################################
+# Name : package_check.py
+"""
+    Module used to verify SAR ZIP packages before they are ingested
+
+    Usage:
+        -- Verify the central directory and CRCs of ZIP packages in parallel
+        -- Read package members ahead so that extraction hits the file cache
+
+    Limits and constraints:
+        Verifying a package reads and decompresses all of its members, which
+        also brings them into the operating system's file cache.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import logging
+import zipfile
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+
+class PackageCheck:
+    """
+    Class used to verify SAR ZIP packages before they are ingested.
+
+    A truncated or corrupt download is detected from its central directory
+    (missing or unreadable) or from a member whose CRC does not match, before
+    any scene of the delivery is processed.  Packages are verified in worker
+    threads; decompression and file reads release the interpreter lock.
+    Verification reads every member, so the extraction that follows reads
+    sound packages from the file cache rather than from disk.
+    The following functionality is performed by this class.
+    -- Verify one package (check)
+    -- Verify packages in parallel (check_all)
+
+    """
+
+
+    def __init__(self, num_threads=None):
+        """Initialisation of PackageCheck class
+
+        Parameters:
+            num_threads -- Number of worker threads, defaults to CPU count
+
+        """
+        self.num_threads = num_threads or cpu_count()
+
+
+    def check(self, zip_file):
+        """
+        Verify one package
+
+        Parameters:
+            zip_file -- ZIP package
+
+        Return value:
+            None when the package is sound, error message otherwise.
+
+        """
+        try:
+            with zipfile.ZipFile(zip_file, 'r') as package:
+                if not package.namelist():
+                    return 'empty package'
+                if not [name for name in package.namelist() if name.endswith('product.xml')]:
+                    return 'no product.xml in package'
+                bad_member = package.testzip()
+                if bad_member is not None:
+                    return 'CRC error in ' + bad_member
+            return None
+
+        except (IOError, OSError, RuntimeError, zipfile.BadZipfile, zipfile.LargeZipFile) as e:
+            return str(e) or e.__class__.__name__
+
+
+    def check_all(self, zip_files):
+        """
+        Verify packages in parallel
+
+        Parameters:
+            zip_files -- ZIP packages
+
+        Return value:
+            Dictionary {zip file: None when sound, error message otherwise}
+
+        """
+        logging.info('       Executing: PackageCheck.check_all')
+        zip_files = list(zip_files)
+        if not zip_files:
+            return {}
+        pool = ThreadPool(min(self.num_threads, len(zip_files)))
+        try:
+            results = dict(zip(zip_files, pool.map(self.check, zip_files)))
+        finally:
+            pool.close()
+            pool.join()
+        for zip_file, message in sorted(results.items()):
+            if message:
+                logging.warning('          Corrupt package ' + zip_file + ': ' + message)
+        logging.info('          Successfully completed PackageCheck.check_all: '
+                     '{0} of {1} packages sound'.format(
+                     len([message for message in results.values() if message is None]),
+                     len(results)))
+        return results
+
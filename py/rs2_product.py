@@ -0,0 +1,225 @@
+################################################################################
+# Name : rs2_product.py
+"""
+    Module used to read the metadata of a RADARSAT-2 product (product.xml)
+
+    Usage:
+        -- Read scene attributes (satellite, beam, acquisition time, pass)
+        -- Read raster attributes (size, pixel spacing, time ordering)
+        -- Read geolocation grid tie points
+        -- Read incidence angles, image files and calibration lookup tables
+        -- Compute the scene footprint from the geolocation grid
+
+    Limits and constraints:
+        This module has only been tested on RADARSAT-2 SGF and SGX products.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+from xml.etree import cElementTree as ElementTree
+
+import numpy
+
+# Namespace used by all RADARSAT-2 product.xml elements
+RS2_NAMESPACE = '{http://www.rsi.ca/rs2/prod/xml/schemas}'
+
+# Single valued elements read from product.xml (first occurrence is kept)
+SCENE_TAGS = frozenset(['satellite', 'beamModeMnemonic', 'rawDataStartTime', 'passDirection',
+                        'antennaPointing', 'productType', 'numberOfLines',
+                        'numberOfSamplesPerLine', 'sampledPixelSpacing', 'sampledLineSpacing',
+                        'lineTimeOrdering', 'pixelTimeOrdering', 'incidenceAngleNearRange',
+                        'incidenceAngleFarRange'])
+
+# Bulky elements not used by the flood processing, released once parsed
+RELEASED_TAGS = frozenset(['stateVector', 'attitudeAngles', 'dopplerCentroid',
+                           'dopplerRateValues', 'slantRangeToGroundRange'])
+
+
+class RS2Product:
+    """
+    Class used to read the metadata of a RADARSAT-2 product.
+
+    The product.xml file is parsed once when the object is created and the
+    attributes required by the flood processing are kept as instance
+    attributes.  The file is streamed so that large geolocation grids are
+    not held in memory as an element tree.  The following functionality is performed by this class.
+    -- Read scene, raster and geolocation attributes
+    -- Interpolate the incidence angle across the swath
+    -- Compute the scene footprint and bounds from the geolocation grid
+
+    Notes:
+        Tie point array columns are: line, pixel, latitude, longitude, height.
+    """
+
+
+    def __init__(self, product_xml):
+        """Initialisation of RS2Product class
+
+        Parameters:
+            product_xml -- product.xml file of the RADARSAT-2 product
+
+        """
+        self.product_xml = product_xml
+        self.product_dir = os.path.dirname(os.path.abspath(product_xml))
+        self.parse()
+
+
+    def parse(self):
+        """
+        Parse product.xml
+
+        Reads the attributes required by the flood processing and assigns
+        them to the instance.
+
+        Return value:
+            None, raises ValueError if product.xml is not a RADARSAT-2 product.
+
+        Limits and constraints:
+
+        """
+        self.polarizations = []
+        self.image_files   = []
+        self.lut_files     = {}
+        values     = {}
+        tie_points = []
+        root       = None
+        # Stream the file: the geolocation grid and orbit state vectors make
+        # up most of product.xml and are released as soon as they are read
+        for event, element in ElementTree.iterparse(self.product_xml, events=('start', 'end')):
+            if root is None:
+                root = element
+                if not root.tag.endswith('product'):
+                    raise ValueError('Not a RADARSAT-2 product: ' + self.product_xml)
+            if event == 'start':
+                continue
+            tag = element.tag.split('}')[-1]
+            if tag == 'imageTiePoint':
+                tie_points.append([float(self._text(element, 'line')),
+                                   float(self._text(element, 'pixel')),
+                                   float(self._text(element, 'latitude')),
+                                   float(self._text(element, 'longitude')),
+                                   float(self._text(element, 'height', '0.0'))])
+                element.clear()
+            elif tag == 'fullResolutionImageData':
+                self.polarizations.append(element.get('pole'))
+                self.image_files.append(os.path.join(self.product_dir, element.text.strip()))
+            elif tag == 'lookupTable':
+                self.lut_files[element.get('incidenceAngleCorrection')] = \
+                    os.path.join(self.product_dir, element.text.strip())
+            elif tag in SCENE_TAGS:
+                if tag not in values and element.text is not None:
+                    values[tag] = element.text.strip()
+            elif tag in RELEASED_TAGS:
+                element.clear()
+
+        def value(tag, default=None):
+            if tag not in values:
+                if default is None:
+                    raise ValueError('Tag ' + tag + ' missing from: ' + self.product_xml)
+                return default
+            return values[tag]
+
+        self.satellite           = value('satellite')
+        self.beam_mode           = value('beamModeMnemonic')
+        self.acquisition_start   = value('rawDataStartTime')
+        self.pass_direction      = value('passDirection')
+        self.antenna_pointing    = value('antennaPointing', 'Right')
+        self.product_type        = value('productType', '')
+        self.lines               = int(value('numberOfLines'))
+        self.pixels              = int(value('numberOfSamplesPerLine'))
+        self.pixel_spacing       = float(value('sampledPixelSpacing'))
+        self.line_spacing        = float(value('sampledLineSpacing'))
+        self.line_time_ordering  = value('lineTimeOrdering', 'Increasing')
+        self.pixel_time_ordering = value('pixelTimeOrdering', 'Increasing')
+        self.incidence_near      = float(value('incidenceAngleNearRange'))
+        self.incidence_far       = float(value('incidenceAngleFarRange'))
+
+        if len(tie_points) < 4:
+            raise ValueError('Geolocation grid missing from: ' + self.product_xml)
+        self.tie_points = numpy.array(tie_points, dtype=numpy.float64)
+
+
+    def incidence_angle(self, pixel):
+        """
+        Incidence angle across the swath
+
+        The angle is interpolated linearly between the near and far range
+        incidence angles, taking the pixel time ordering into account.
+
+        Parameters:
+            pixel -- Pixel (column) coordinate(s), scalar or numpy array
+
+        Return value:
+            Incidence angle(s) in radians.
+
+        """
+        fraction = numpy.asarray(pixel, dtype=numpy.float64) / max(self.pixels - 1, 1)
+        if self.pixel_time_ordering == 'Decreasing':
+            fraction = 1.0 - fraction
+        angle = self.incidence_near + fraction * (self.incidence_far - self.incidence_near)
+        return numpy.radians(angle)
+
+
+    def footprint(self):
+        """
+        Scene footprint from the geolocation grid
+
+        Walks the outer ring of the tie point grid (first line, last pixel,
+        last line, first pixel) so that the footprint follows the edges of
+        the image rather than only its four corners.
+
+        Return value:
+            List of (longitude, latitude) tuples, closed ring.
+
+        """
+        tie     = self.tie_points
+        lines   = numpy.unique(tie[:, 0])
+        pixels  = numpy.unique(tie[:, 1])
+        first_l = tie[tie[:, 0] == lines[0]]
+        last_l  = tie[tie[:, 0] == lines[-1]]
+        first_p = tie[tie[:, 1] == pixels[0]]
+        last_p  = tie[tie[:, 1] == pixels[-1]]
+
+        ring = []
+        ring.extend(first_l[numpy.argsort(first_l[:, 1])].tolist())
+        ring.extend(last_p[numpy.argsort(last_p[:, 0])].tolist()[1:])
+        ring.extend(last_l[numpy.argsort(last_l[:, 1])[::-1]].tolist()[1:])
+        ring.extend(first_p[numpy.argsort(first_p[:, 0])[::-1]].tolist()[1:])
+        return [(point[3], point[2]) for point in ring]
+
+
+    def bounds(self):
+        """
+        Scene bounding box from the geolocation grid
+
+        Return value:
+            (min longitude, min latitude, max longitude, max latitude)
+
+        """
+        return (float(self.tie_points[:, 3].min()), float(self.tie_points[:, 2].min()),
+                float(self.tie_points[:, 3].max()), float(self.tie_points[:, 2].max()))
+
+
+    def _text(self, element, tag, default=None):
+        """
+        Text of the first descendant element with the given tag
+
+        Parameters:
+            element -- Element to search
+            tag     -- Tag name without namespace
+            default -- Value returned when the tag is absent
+
+        Return value:
+            Element text, default otherwise, raises ValueError when absent
+            and no default is given.
+
+        """
+        found = element.find('.//' + RS2_NAMESPACE + tag)
+        if found is None:
+            found = element.find('.//' + tag)
+        if found is None or found.text is None:
+            if default is None:
+                raise ValueError('Tag ' + tag + ' missing from: ' + self.product_xml)
+            return default
+        return found.text.strip()
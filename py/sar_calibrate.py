@@ -0,0 +1,186 @@
+################################################################################
+# Name : sar_calibrate.py
+"""
+    Module used to calibrate RADARSAT-2 imagery with NumPy
+
+    Usage:
+        -- Read the gains and offset of a calibration lookup table
+        -- Calibrate blocks of digital numbers to sigma nought
+        -- Calibrate windows read by the NumPy/GDAL ortho engine on the fly
+        -- Write calibrated imagery to a tiled Float32 GeoTIFF
+
+    Limits and constraints:
+        This module has only been tested on RADARSAT-2 SGF and SGX (detected)
+        products.  Calibrated values are linear (not dB).  Background pixels
+        (digital number 0) stay 0.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import logging
+from xml.etree import cElementTree as ElementTree
+
+import numpy
+from osgeo import gdal
+
+# Import private modules
+import EGS_utility
+import rs2_product
+
+# Calibration lookup table used by default (lutSigma.xml)
+SIGMA_LUT = 'Sigma Nought'
+
+# Value of background pixels
+NODATA = 0
+
+
+class SarCalibrate:
+    """
+    Class used to calibrate RADARSAT-2 imagery without PCI Geomatica.
+
+    Calibrated values are computed as (DN^2 + offset) / gain[pixel], the
+    gain varying across the swath only.  The gains are held as one vector
+    that NumPy broadcasts over every line of a block, so a block is
+    calibrated in a few array operations.
+    The following functionality is performed by this class.
+    -- Read a calibration lookup table (read_lut)
+    -- Calibrate a block of digital numbers (calibrate)
+    -- Wrap a window reader to return calibrated values (calibrated)
+    -- Write calibrated imagery to file (write)
+
+    """
+
+
+    def __init__(self, product, lut=SIGMA_LUT, block_lines=512):
+        """Initialisation of SarCalibrate class
+
+        Parameters:
+            product     -- product.xml file or rs2_product.RS2Product
+            lut         -- Lookup table, key of RS2Product.lut_files
+                           ('Sigma Nought', 'Beta Nought' or 'Gamma')
+            block_lines -- Number of lines calibrated at a time by write
+
+        """
+        if isinstance(product, basestring):
+            product = rs2_product.RS2Product(product)
+        if lut not in product.lut_files:
+            raise ValueError('Lookup table ' + lut + ' missing from: ' + product.product_xml)
+        self.product     = product
+        self.block_lines = int(block_lines)
+        self.gains, self.offset = self.read_lut(product.lut_files[lut])
+        if self.gains.size != product.pixels:
+            raise ValueError('{0} gains for {1} pixels in {2}'.format(
+                             self.gains.size, product.pixels, product.lut_files[lut]))
+
+
+    def read_lut(self, lut_file):
+        """
+        Read a calibration lookup table
+
+        Parameters:
+            lut_file -- Lookup table file (e.g. lutSigma.xml)
+
+        Return value:
+            (gains, offset), gains as a float32 numpy vector, one per pixel.
+
+        """
+        gains  = None
+        offset = 0.0
+        for event, element in ElementTree.iterparse(lut_file):
+            tag = element.tag.split('}')[-1]
+            if tag == 'gains':
+                gains = numpy.array(element.text.split(), dtype=numpy.float32)
+            elif tag == 'offset':
+                offset = float(element.text)
+        if gains is None or not gains.all():
+            raise ValueError('Missing or zero gains in: ' + lut_file)
+        return gains, offset
+
+
+    def calibrate(self, values, xoff=0):
+        """
+        Calibrate a block of digital numbers
+
+        Parameters:
+            values -- 2-D array of digital numbers
+            xoff   -- Pixel (column) of the first column of the block
+
+        Return value:
+            float32 array of calibrated values.
+
+        """
+        gains  = self.gains[xoff:xoff + values.shape[-1]]
+        power  = numpy.square(values, dtype=numpy.float32)
+        result = (power + numpy.float32(self.offset)) / gains
+        result[values == NODATA] = NODATA
+        return result
+
+
+    def calibrated(self, read_window):
+        """
+        Window reader returning calibrated values
+
+        Used to calibrate the windows read by the NumPy/GDAL ortho engine,
+        so that no calibrated intermediate file is written, e.g.
+        ortho.read_window = calibrate.calibrated(ortho.read_window)
+
+        Parameters:
+            read_window -- Function (band, xoff, yoff, xsize, ysize) returning
+                           a window of digital numbers
+
+        Return value:
+            Function with the same arguments returning calibrated values.
+
+        """
+        def calibrated_window(band, xoff, yoff, xsize, ysize):
+            return self.calibrate(read_window(band, xoff, yoff, xsize, ysize), xoff)
+        return calibrated_window
+
+
+    def write(self, out_file):
+        """
+        Write the calibrated imagery of every polarization
+
+        The image is processed in blocks of block_lines lines; the
+        geolocation (GCPs) and metadata of the first image are carried over.
+
+        Parameters:
+            out_file -- Output GeoTIFF, one Float32 band per polarization
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: SarCalibrate.write')
+            in_ds = [gdal.Open(image_file) for image_file in self.product.image_files]
+            if None in in_ds:
+                raise ValueError('cannot open ' + self.product.image_files[in_ds.index(None)])
+            options = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER',
+                       'BLOCKXSIZE=256', 'BLOCKYSIZE=256']
+            out_ds = gdal.GetDriverByName('GTiff').Create(out_file, self.product.pixels,
+                         self.product.lines, len(in_ds), gdal.GDT_Float32, options)
+            if out_ds is None:
+                raise ValueError('cannot create ' + out_file)
+            if in_ds[0].GetGCPCount():
+                out_ds.SetGCPs(in_ds[0].GetGCPs(), in_ds[0].GetGCPProjection())
+            out_ds.SetMetadata(in_ds[0].GetMetadata())
+            for band, pole in enumerate(self.product.polarizations):
+                out_ds.GetRasterBand(band + 1).SetNoDataValue(NODATA)
+                out_ds.GetRasterBand(band + 1).SetDescription(pole)
+
+            for line in range(0, self.product.lines, self.block_lines):
+                lines = min(self.block_lines, self.product.lines - line)
+                for band, dataset in enumerate(in_ds):
+                    values = dataset.GetRasterBand(1).ReadAsArray(0, line, self.product.pixels, lines)
+                    out_ds.GetRasterBand(band + 1).WriteArray(self.calibrate(values), 0, line)
+            out_ds.FlushCache()
+            out_ds = None
+            in_ds  = None
+            logging.info('          Successfully completed SarCalibrate.write: ' + out_file)
+            return out_file
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('write(): {:s}'.format(e))
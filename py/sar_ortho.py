@@ -0,0 +1,519 @@
+################################################################################
+# Name : sar_ortho.py
+"""
+    Module used to orthorectify RADARSAT-2 imagery with NumPy and GDAL
+
+    Usage:
+        -- Build the image-to-ground model from the product.xml tie point grid
+        -- Correct the model for terrain height using the DEM
+        -- Compute the exact mapping on a sparse grid, interpolate in between
+        -- Resample the imagery bilinearly, output tiles in parallel
+
+    Limits and constraints:
+        This module has only been tested on RADARSAT-2 SGF and SGX products.
+        DEM heights are used as supplied; use elev_offset to bring heights
+        referenced to mean sea level onto the ellipsoid (geoid undulation),
+        as ortho2's elfactor would.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import logging
+import threading
+from multiprocessing import cpu_count
+
+import numpy
+from osgeo import gdal, osr
+
+# Import private modules
+import EGS_utility
+import rs2_product
+import sar_calibrate
+
+# Value used for pixels that are not populated (same as ortho2 outbgd=[0])
+NODATA = 0
+
+# GDAL data types of the output per numpy data type
+GDAL_TYPES = {'uint8'   : gdal.GDT_Byte,
+              'uint16'  : gdal.GDT_UInt16,
+              'int16'   : gdal.GDT_Int16,
+              'uint32'  : gdal.GDT_UInt32,
+              'int32'   : gdal.GDT_Int32,
+              'float32' : gdal.GDT_Float32,
+              'float64' : gdal.GDT_Float64}
+
+
+class SarOrtho:
+    """
+    Class used to orthorectify RADARSAT-2 imagery without PCI Geomatica.
+
+    The image-to-ground model is a pair of cubic polynomials fitted to the
+    geolocation grid of product.xml (forward: line/pixel to latitude/longitude,
+    inverse: latitude/longitude to line/pixel), refined with Newton steps on
+    the forward model.  The tie points lie on the ellipsoid at the height
+    given in the grid; terrain height is applied as a slant range shift
+    across the swath, iterated with the incidence angle at the shifted pixel.
+    The following functionality is performed by this class.
+    -- Map ground coordinates and heights to image coordinates
+    -- Compute the output extent from the scene footprint
+    -- Orthorectify the polarizations into a tiled GeoTIFF
+
+    Notes:
+        As with ortho2 sampling=[4], the exact mapping is only computed every
+        'sampling' output pixels; positions in between are interpolated
+        bilinearly.
+    """
+
+
+    def __init__(self, product, sampling=4, tile_size=512, num_threads=None, lut=None,
+                 polarizations=None):
+        """Initialisation of SarOrtho class
+
+        Parameters:
+            product     -- product.xml file or rs2_product.RS2Product
+            sampling    -- Output pixel interval of the exact mapping
+            tile_size   -- Output tile size (pixels)
+            num_threads -- Number of worker threads, defaults to CPU count
+            lut         -- Calibration lookup table (e.g. 'Sigma Nought'),
+                           windows are calibrated as they are read and the
+                           output is Float32; digital numbers otherwise
+            polarizations -- Polarizations to orthorectify (e.g. ['HH']),
+                           all polarizations of the product otherwise
+
+        """
+        if isinstance(product, basestring):
+            product = rs2_product.RS2Product(product)
+        self.product     = product
+        self.sampling    = max(int(sampling), 1)
+        self.tile_size   = int(tile_size)
+        self.num_threads = num_threads or cpu_count()
+        self.max_iter    = 10       # Height correction iterations
+        self.tolerance   = 0.01     # Height correction convergence (pixels)
+        self.bands       = [band for band, pole in enumerate(product.polarizations)
+                            if not polarizations or pole in polarizations]
+        if not self.bands:
+            raise ValueError('None of the polarizations {0} in: {1}'.format(
+                             polarizations, product.product_xml))
+        self.read_window = self._read_window
+        if lut:
+            self.read_window = sar_calibrate.SarCalibrate(product, lut).calibrated(self._read_window)
+        self._local      = threading.local()
+        self.fit_model()
+
+
+    def fit_model(self):
+        """
+        Fit the forward and inverse polynomial models to the tie points
+
+        Coordinates are normalized to [-1, 1] before fitting to keep the
+        least squares system well conditioned.
+
+        Return value:
+            None
+
+        Limits and constraints:
+            A cubic model needs at least 16 tie points, a first order model
+            is used for smaller grids.
+        """
+        tie = self.product.tie_points
+        self._order = 3 if len(tie) >= 16 else 1
+        self._norm  = [_normalization(tie[:, col]) for col in range(4)]
+
+        line, pixel, lat, lon = [self._normalize(tie[:, col], col) for col in range(4)]
+        image_terms  = _poly_terms(line, pixel, self._order)
+        ground_terms = _poly_terms(lat, lon, self._order)
+
+        self._fwd_lat   = numpy.linalg.lstsq(image_terms, lat, rcond=-1)[0]
+        self._fwd_lon   = numpy.linalg.lstsq(image_terms, lon, rcond=-1)[0]
+        self._inv_line  = numpy.linalg.lstsq(ground_terms, line, rcond=-1)[0]
+        self._inv_pixel = numpy.linalg.lstsq(ground_terms, pixel, rcond=-1)[0]
+        self._ref_hgt   = numpy.linalg.lstsq(image_terms, tie[:, 4], rcond=-1)[0]
+
+
+    def image_to_ground(self, line, pixel):
+        """
+        Forward model, image coordinates to geographic coordinates
+
+        Parameters:
+            line  -- Line coordinate(s), numpy array
+            pixel -- Pixel coordinate(s), numpy array
+
+        Return value:
+            (latitude, longitude, reference height) numpy arrays, at the
+            height of the tie point grid.
+        """
+        terms = _poly_terms(self._normalize(line, 0), self._normalize(pixel, 1), self._order)
+        return (self._denormalize(terms.dot(self._fwd_lat), 2),
+                self._denormalize(terms.dot(self._fwd_lon), 3),
+                terms.dot(self._ref_hgt))
+
+
+    def ground_to_image(self, lat, lon, height):
+        """
+        Inverse model, geographic coordinates and height to image coordinates
+
+        The inverse polynomial gives a first estimate that is refined with
+        two Newton steps on the forward model.  The pixel is then shifted
+        for the difference between the terrain height and the height of the
+        tie point grid.
+
+        Parameters:
+            lat    -- Latitude(s), numpy array
+            lon    -- Longitude(s), numpy array
+            height -- Terrain height(s), numpy array, NaN where unknown
+
+        Return value:
+            (line, pixel) numpy arrays.
+        """
+        terms = _poly_terms(self._normalize(lat, 2), self._normalize(lon, 3), self._order)
+        line  = self._denormalize(terms.dot(self._inv_line), 0)
+        pixel = self._denormalize(terms.dot(self._inv_pixel), 1)
+
+        for step in range(2):
+            f_lat, f_lon, ref = self.image_to_ground(line, pixel)
+            l_lat, l_lon, ref = self.image_to_ground(line + 1.0, pixel)
+            p_lat, p_lon, ref = self.image_to_ground(line, pixel + 1.0)
+            a, b = l_lat - f_lat, p_lat - f_lat
+            c, d = l_lon - f_lon, p_lon - f_lon
+            det  = a * d - b * c
+            det  = numpy.where(det == 0, 1e-30, det)
+            r1, r2 = lat - f_lat, lon - f_lon
+            line   = line  + (d * r1 - b * r2) / det
+            pixel  = pixel + (a * r2 - c * r1) / det
+
+        ref_height = self.image_to_ground(line, pixel)[2]
+        height     = numpy.where(numpy.isfinite(height), height, ref_height)
+        delta      = (height - ref_height) / self.product.pixel_spacing
+        if self.product.pixel_time_ordering == 'Decreasing':
+            delta = -delta
+
+        # Elevated terrain is closer to the sensor; shift towards near range
+        flat_pixel = pixel
+        for iteration in range(self.max_iter):
+            shifted = flat_pixel - delta / numpy.tan(self.product.incidence_angle(pixel))
+            done    = numpy.abs(shifted - pixel).max() < self.tolerance if shifted.size else True
+            pixel   = shifted
+            if done:
+                break
+        return line, pixel
+
+
+    def output_bounds(self, srs, pixelSpacing_x, pixelSpacing_y):
+        """
+        Output extent of the scene in the output projection
+
+        The footprint is projected and its bounding box snapped outwards to
+        the pixel spacing.
+
+        Parameters:
+            srs            -- osr.SpatialReference of the output
+            pixelSpacing_x -- x pixel spacing
+            pixelSpacing_y -- y pixel spacing
+
+        Return value:
+            (ulx, uly, lrx, lry)
+        """
+        transform = osr.CoordinateTransformation(EGS_utility.EGSUtility().geographic_srs(), srs)
+        points    = numpy.array(transform.TransformPoints(
+                                [list(point) for point in self.product.footprint()]))
+        return (numpy.floor(points[:, 0].min() / pixelSpacing_x) * pixelSpacing_x,
+                numpy.ceil(points[:, 1].max() / pixelSpacing_y) * pixelSpacing_y,
+                numpy.ceil(points[:, 0].max() / pixelSpacing_x) * pixelSpacing_x,
+                numpy.floor(points[:, 1].min() / pixelSpacing_y) * pixelSpacing_y)
+
+
+    def orthorectify(self, out_file, DEM, pixelSpacing_x, pixelSpacing_y, proj,
+                     bounds=None, elev_offset=0.0):
+        """
+        Method for orthorectification of radarsat2 image
+
+        Orthorectifies the selected polarizations of the product into a
+        tiled, compressed GeoTIFF, one band per polarization.
+
+        Parameters:
+            out_file        -- Output file
+            DEM             -- DEM file (any GDAL raster, any projection)
+            pixelSpacing_x  -- x pixel spacing
+            pixelSpacing_y  -- y pixel spacing
+            proj            -- data projection (PCI projection string)
+            bounds          -- (ulx, uly, lrx, lry), scene extent otherwise
+            elev_offset     -- Offset added to the DEM heights (metres)
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+            Pixels with value 0 are treated as background, both in the input
+            and in the output.
+        """
+        try:
+            logging.info('       Executing: SarOrtho.orthorectify')
+            pixelSpacing_x = float(pixelSpacing_x)
+            pixelSpacing_y = float(pixelSpacing_y)
+            srs = EGS_utility.EGSUtility().pci_srs(proj)
+            if bounds is None:
+                bounds = self.output_bounds(srs, pixelSpacing_x, pixelSpacing_y)
+            ulx, uly, lrx, lry = [float(value) for value in bounds]
+            cols = int(round((lrx - ulx) / pixelSpacing_x))
+            rows = int(round((uly - lry) / pixelSpacing_y))
+            if cols <= 0 or rows <= 0:
+                raise ValueError('empty output extent {0}'.format(bounds))
+            geotransform = (ulx, pixelSpacing_x, 0.0, uly, 0.0, -pixelSpacing_y)
+
+            heights = self._node_heights(DEM, srs, geotransform, rows, cols) + float(elev_offset)
+            node_line, node_pixel = self._node_mapping(srs, geotransform, heights)
+            logging.info('          Mapped {0} x {1} grid nodes'.format(*heights.shape))
+
+            dtype   = self.read_window(self.bands[0], 0, 0, 1, 1).dtype
+            options = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER',
+                       'BLOCKXSIZE=256', 'BLOCKYSIZE=256']
+            if dtype.kind in 'iu':
+                options.append('PREDICTOR=2')
+            out_ds = gdal.GetDriverByName('GTiff').Create(out_file, cols, rows,
+                         len(self.bands), GDAL_TYPES[dtype.name], options)
+            if out_ds is None:
+                raise ValueError('cannot create ' + out_file)
+            out_ds.SetGeoTransform(geotransform)
+            out_ds.SetProjection(srs.ExportToWkt())
+            for band, source in enumerate(self.bands):
+                out_ds.GetRasterBand(band + 1).SetNoDataValue(NODATA)
+                out_ds.GetRasterBand(band + 1).SetDescription(self.product.polarizations[source])
+
+            tiles = [(row, col, min(self.tile_size, rows - row), min(self.tile_size, cols - col))
+                     for row in range(0, rows, self.tile_size)
+                     for col in range(0, cols, self.tile_size)]
+
+            def tile_task(tile):
+                return tile, self._ortho_tile(tile, node_line, node_pixel, dtype)
+
+            # Tiles are resampled in worker threads, written by this thread
+            for (row, col, nrows, ncols), arrays in \
+                    EGS_utility.EGSUtility().tile_map(tile_task, tiles, self.num_threads):
+                for band, array in enumerate(arrays):
+                    if array is not None:
+                        out_ds.GetRasterBand(band + 1).WriteArray(array, col, row)
+            out_ds.FlushCache()
+            out_ds = None
+            logging.info('          Successfully completed SarOrtho.orthorectify')
+            return out_file
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('orthorectify(): {:s}'.format(e))
+
+
+    def _node_heights(self, DEM, srs, geotransform, rows, cols):
+        """
+        Terrain height at the grid nodes
+
+        The DEM is reprojected once, bilinearly, onto the sparse grid of
+        nodes at which the exact mapping is computed.
+
+        Parameters:
+            DEM          -- DEM file
+            srs          -- osr.SpatialReference of the output
+            geotransform -- Geotransform of the output
+            rows         -- Number of output rows
+            cols         -- Number of output columns
+
+        Return value:
+            Heights numpy array (node rows, node cols), NaN where unknown.
+        """
+        dem_ds = gdal.Open(DEM)
+        if dem_ds is None:
+            raise ValueError('cannot open DEM ' + DEM)
+        step      = self.sampling
+        node_rows = (rows - 1) // step + 2
+        node_cols = (cols - 1) // step + 2
+        ulx, px, rx, uly, ry, py = geotransform
+
+        # Node (i, j) sits at the centre of output pixel (i*step, j*step)
+        node_ds = gdal.GetDriverByName('MEM').Create('', node_cols, node_rows, 1, gdal.GDT_Float32)
+        node_ds.SetGeoTransform((ulx + 0.5 * px * (1 - step), px * step, 0.0,
+                                 uly + 0.5 * py * (1 - step), 0.0, py * step))
+        node_ds.SetProjection(srs.ExportToWkt())
+        band = node_ds.GetRasterBand(1)
+        band.SetNoDataValue(-32767.0)
+        band.Fill(-32767.0)
+        gdal.ReprojectImage(dem_ds, node_ds, dem_ds.GetProjection(), srs.ExportToWkt(),
+                            gdal.GRA_Bilinear)
+
+        heights    = band.ReadAsArray().astype(numpy.float64)
+        dem_nodata = dem_ds.GetRasterBand(1).GetNoDataValue()
+        invalid    = heights == -32767.0
+        if dem_nodata is not None:
+            invalid |= heights == dem_nodata
+        heights[invalid] = numpy.nan
+        return heights
+
+
+    def _node_mapping(self, srs, geotransform, heights):
+        """
+        Exact image coordinates of the grid nodes
+
+        Parameters:
+            srs          -- osr.SpatialReference of the output
+            geotransform -- Geotransform of the output
+            heights      -- Terrain height at the nodes
+
+        Return value:
+            (line, pixel) numpy arrays shaped as heights.
+        """
+        node_rows, node_cols = heights.shape
+        step  = self.sampling
+        ulx, px, rx, uly, ry, py = geotransform
+        x     = ulx + (numpy.arange(node_cols) * step + 0.5) * px
+        line  = numpy.empty(heights.shape)
+        pixel = numpy.empty(heights.shape)
+        chunk = max(1, 65536 // node_cols)
+
+        def map_rows(row):
+            end = min(row + chunk, node_rows)
+            y   = uly + (numpy.arange(row, end) * step + 0.5) * py
+            grid_x, grid_y = numpy.meshgrid(x, y)
+            transform = osr.CoordinateTransformation(srs, EGS_utility.EGSUtility().geographic_srs())
+            points = numpy.array(transform.TransformPoints(
+                         numpy.column_stack([grid_x.ravel(), grid_y.ravel()]).tolist()))
+            rows_line, rows_pixel = self.ground_to_image(points[:, 1], points[:, 0],
+                                                         heights[row:end].ravel())
+            return row, end, rows_line, rows_pixel
+
+        for row, end, rows_line, rows_pixel in \
+                EGS_utility.EGSUtility().tile_map(map_rows, range(0, node_rows, chunk), self.num_threads):
+            line[row:end]  = rows_line.reshape(end - row, node_cols)
+            pixel[row:end] = rows_pixel.reshape(end - row, node_cols)
+        return line, pixel
+
+
+    def _ortho_tile(self, tile, node_line, node_pixel, dtype):
+        """
+        Resample one output tile of the selected polarizations
+
+        Parameters:
+            tile       -- (row, col, rows, cols) of the tile in the output
+            node_line  -- Line coordinates of the grid nodes
+            node_pixel -- Pixel coordinates of the grid nodes
+            dtype      -- numpy data type of the output
+
+        Return value:
+            List of arrays, one per polarization, None if the tile lies
+            outside the image.
+        """
+        row, col, rows, cols = tile
+        step = float(self.sampling)
+        node_r = (row + numpy.arange(rows)) / step
+        node_c = (col + numpy.arange(cols)) / step
+        line   = _interpolate_grid(node_line, node_r, node_c)
+        pixel  = _interpolate_grid(node_pixel, node_r, node_c)
+
+        # Source window covering the tile, one pixel of margin for bilinear
+        line0  = max(int(numpy.floor(line.min())) - 1, 0)
+        pixel0 = max(int(numpy.floor(pixel.min())) - 1, 0)
+        line1  = min(int(numpy.ceil(line.max())) + 2, self.product.lines)
+        pixel1 = min(int(numpy.ceil(pixel.max())) + 2, self.product.pixels)
+        if line1 <= line0 or pixel1 <= pixel0:
+            return [None] * len(self.bands)
+
+        arrays = []
+        for band in self.bands:
+            window = self.read_window(band, pixel0, line0, pixel1 - pixel0, line1 - line0)
+            values = _bilinear(window, line - line0, pixel - pixel0)
+            if dtype.kind in 'iu':
+                info   = numpy.iinfo(dtype)
+                values = numpy.clip(numpy.rint(values), info.min, info.max)
+            arrays.append(values.astype(dtype))
+        return arrays
+
+
+    def _read_window(self, band, xoff, yoff, xsize, ysize):
+        """
+        Read a window of one polarization of the product
+
+        Each worker thread keeps its own GDAL dataset handles since they
+        cannot be shared between threads.
+
+        Parameters:
+            band  -- Index of the polarization (image_files)
+            xoff  -- First pixel
+            yoff  -- First line
+            xsize -- Number of pixels
+            ysize -- Number of lines
+
+        Return value:
+            numpy array
+        """
+        datasets = getattr(self._local, 'datasets', None)
+        if datasets is None:
+            datasets = self._local.datasets = {}
+        if band not in datasets:
+            datasets[band] = gdal.Open(self.product.image_files[band])
+            if datasets[band] is None:
+                raise ValueError('cannot open ' + self.product.image_files[band])
+        return datasets[band].GetRasterBand(1).ReadAsArray(xoff, yoff, xsize, ysize)
+
+
+    def _normalize(self, values, col):
+        """Normalize values of tie point column col to [-1, 1]"""
+        offset, scale = self._norm[col]
+        return (numpy.asarray(values, dtype=numpy.float64) - offset) / scale
+
+
+    def _denormalize(self, values, col):
+        """Reverse of _normalize"""
+        offset, scale = self._norm[col]
+        return values * scale + offset
+
+
+def _normalization(values):
+    """Offset and scale mapping values onto [-1, 1]"""
+    low, high = float(values.min()), float(values.max())
+    return (low + high) / 2.0, max((high - low) / 2.0, 1e-12)
+
+
+def _poly_terms(u, v, order):
+    """Terms of the 2D polynomial of the given order, one row per point"""
+    u = numpy.asarray(u, dtype=numpy.float64).ravel()
+    v = numpy.asarray(v, dtype=numpy.float64).ravel()
+    terms = [u ** (degree - k) * v ** k
+             for degree in range(order + 1) for k in range(degree + 1)]
+    return numpy.column_stack(terms)
+
+
+def _interpolate_grid(grid, rows, cols):
+    """Bilinear interpolation of grid at fractional node rows x cols"""
+    r0 = numpy.minimum(numpy.floor(rows).astype(numpy.intp), grid.shape[0] - 2)
+    c0 = numpy.minimum(numpy.floor(cols).astype(numpy.intp), grid.shape[1] - 2)
+    fr = (rows - r0)[:, numpy.newaxis]
+    fc = (cols - c0)[numpy.newaxis, :]
+    top    = grid[r0][:, c0] * (1 - fc) + grid[r0][:, c0 + 1] * fc
+    bottom = grid[r0 + 1][:, c0] * (1 - fc) + grid[r0 + 1][:, c0 + 1] * fc
+    return top * (1 - fr) + bottom * fr
+
+
+def _bilinear(window, line, pixel):
+    """
+    Bilinear resampling of window at fractional line/pixel positions
+
+    Background (0) source pixels are excluded from the weights, positions
+    outside the window are set to background.
+    """
+    rows, cols = window.shape
+    inside = (line >= -0.5) & (pixel >= -0.5) & (line <= rows - 0.5) & (pixel <= cols - 0.5)
+    line   = numpy.clip(line, 0, rows - 1)
+    pixel  = numpy.clip(pixel, 0, cols - 1)
+    l0 = numpy.minimum(numpy.floor(line).astype(numpy.intp), max(rows - 2, 0))
+    p0 = numpy.minimum(numpy.floor(pixel).astype(numpy.intp), max(cols - 2, 0))
+    l1 = numpy.minimum(l0 + 1, rows - 1)
+    p1 = numpy.minimum(p0 + 1, cols - 1)
+    fl = line - l0
+    fp = pixel - p0
+
+    total  = numpy.zeros(line.shape)
+    weight = numpy.zeros(line.shape)
+    for l, p, w in ((l0, p0, (1 - fl) * (1 - fp)), (l0, p1, (1 - fl) * fp),
+                    (l1, p0, fl * (1 - fp)),       (l1, p1, fl * fp)):
+        value   = window[l, p].astype(numpy.float64)
+        w       = w * (value != NODATA)
+        total  += w * value
+        weight += w
+    valid = inside & (weight > 1e-6)
+    return numpy.where(valid, total / numpy.where(valid, weight, 1.0), NODATA)
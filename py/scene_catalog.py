@@ -0,0 +1,359 @@
+################################################################################
+# Name : scene_catalog.py
+"""
+    Module used to catalog the RADARSAT-2 products of a workspace
+
+    Usage:
+        -- Register products (product.xml) in a SQLite catalog
+        -- Scan a directory tree for new or changed products
+        -- Query scenes by directory, name or acquisition time
+        -- Select the scenes whose footprint intersects an area of interest
+
+    Limits and constraints:
+        product.xml is parsed once per product; a product is parsed again
+        only when the size or modification time of its product.xml changes.
+        Directories already scanned are not listed again unless their
+        modification time changed.
+        Footprints are indexed with the SQLite R*Tree module; where SQLite
+        was built without it, the bounding box columns are searched instead.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import json
+import logging
+import sqlite3
+
+# Import private modules
+import EGS_utility
+import rs2_product
+
+# Default file name of the catalog in a workspace
+CATALOG_NAME = 'scene_catalog.sqlite'
+
+# Name of the metadata file of a RADARSAT-2 product
+PRODUCT_XML = 'product.xml'
+
+# Columns of the scenes table
+SCENE_COLUMNS = ('product_xml', 'product_dir', 'name', 'satellite', 'beam', 'acquired',
+                 'pass_direction', 'polarizations', 'image_files', 'lut_files', 'footprint',
+                 'min_lon', 'min_lat', 'max_lon', 'max_lat', 'size', 'mtime')
+
+
+class SceneCatalog:
+    """
+    Class used to catalog the RADARSAT-2 products of a workspace.
+
+    The metadata required by the flood tools (footprint, acquisition time,
+    beam, polarizations, pass direction and file paths) is read once from
+    product.xml and kept in a SQLite database, so tools query the catalog
+    instead of walking the input directories and parsing product.xml again.
+    The following functionality is performed by this class.
+    -- Register a product (add)
+    -- Scan a directory tree for products (scan)
+    -- Query scenes (scene, scenes)
+    -- Query scenes intersecting an area of interest (intersecting)
+    -- Walk the catalogued products like os.walk (walk)
+
+    Notes:
+        Scenes are returned as dictionaries keyed by the column names;
+        polarizations and image_files are lists, lut_files a dictionary
+        and bounds a (min lon, min lat, max lon, max lat) tuple.
+    """
+
+
+    def __init__(self, db_file):
+        """Initialisation of SceneCatalog class
+
+        Parameters:
+            db_file -- SQLite catalog file, created when it does not exist
+
+        """
+        self.db_file = db_file
+        db_dir = os.path.dirname(os.path.abspath(db_file))
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        self.connection = sqlite3.connect(db_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.text_factory = str
+        self.create()
+
+
+    def create(self):
+        """
+        Create the catalog tables when they do not exist
+
+        Return value:
+            None
+
+        """
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS scenes ('
+                'product_xml TEXT PRIMARY KEY, product_dir TEXT, name TEXT, satellite TEXT, '
+                'beam TEXT, acquired TEXT, pass_direction TEXT, polarizations TEXT, '
+                'image_files TEXT, lut_files TEXT, footprint TEXT, min_lon REAL, '
+                'min_lat REAL, max_lon REAL, max_lat REAL, size INTEGER, mtime INTEGER)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS scenes_dir ON scenes (product_dir)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS directories ('
+                'path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT, product INTEGER)')
+        # Footprint bounding boxes, keyed by the rowid of the scenes table
+        try:
+            with self.connection:
+                self.connection.execute(
+                    'CREATE VIRTUAL TABLE IF NOT EXISTS scene_index USING '
+                    'rtree(id, min_lon, max_lon, min_lat, max_lat)')
+                self.connection.execute(
+                    'INSERT INTO scene_index SELECT rowid, min_lon, max_lon, min_lat, '
+                    'max_lat FROM scenes WHERE rowid NOT IN (SELECT id FROM scene_index)')
+            self.rtree = True
+        except sqlite3.OperationalError:
+            logging.info('          SQLite R*Tree module not available, '
+                         'footprints searched by bounding box')
+            self.rtree = False
+
+
+    def add(self, product_xml):
+        """
+        Register a product in the catalog
+
+        Parameters:
+            product_xml -- product.xml file of the product
+
+        Return value:
+            Scene dictionary when successful, error statement otherwise.
+
+        Limits and constraints:
+            product.xml is only parsed when the product is new or its
+            product.xml changed.
+
+        """
+        try:
+            product_xml = os.path.abspath(product_xml)
+            stamp = [os.path.getsize(product_xml), int(os.path.getmtime(product_xml))]
+            row = self.connection.execute('SELECT * FROM scenes WHERE product_xml = ?',
+                                          (product_xml,)).fetchone()
+            if row is not None and [row['size'], row['mtime']] == stamp:
+                return self._scene(row)
+
+            logging.info('       Executing: SceneCatalog.add')
+            product = rs2_product.RS2Product(product_xml)
+            footprint = product.footprint()
+            values = (product_xml,
+                      product.product_dir,
+                      os.path.basename(product.product_dir),
+                      product.satellite,
+                      product.beam_mode,
+                      product.acquisition_start,
+                      product.pass_direction,
+                      json.dumps(product.polarizations),
+                      json.dumps(product.image_files),
+                      json.dumps(product.lut_files),
+                      'POLYGON ((' + ', '.join('%.8f %.8f' % point for point in footprint) + '))') + \
+                     product.bounds() + tuple(stamp)
+            with self.connection:
+                if row is not None and self.rtree:
+                    self.connection.execute('DELETE FROM scene_index WHERE id = '
+                                            '(SELECT rowid FROM scenes WHERE product_xml = ?)',
+                                            (product_xml,))
+                rowid = self.connection.execute('INSERT OR REPLACE INTO scenes VALUES (' +
+                                                ', '.join('?' * len(SCENE_COLUMNS)) + ')',
+                                                values).lastrowid
+                if self.rtree:
+                    min_lon, min_lat, max_lon, max_lat = product.bounds()
+                    self.connection.execute('INSERT INTO scene_index VALUES (?, ?, ?, ?, ?)',
+                                            (rowid, min_lon, max_lon, min_lat, max_lat))
+            logging.info('          Successfully completed SceneCatalog.add: ' + product_xml)
+            return self.scene(product_xml)
+
+        except (OSError, IOError, SyntaxError, ValueError, sqlite3.Error) as e:
+            EGS_utility.EGSUtility().error('add(): {:s}'.format(e))
+
+
+    def scan(self, root_dir):
+        """
+        Register all products found under a directory
+
+        Directories are listed only when they are new or their modification
+        time changed; the subdirectories of the others are taken from the
+        catalog.  Product directories are not descended into.
+
+        Parameters:
+            root_dir -- Directory to scan
+
+        Return value:
+            List of the scene dictionaries under root_dir, ordered by
+            acquisition time.
+
+        Limits and constraints:
+            Products that cannot be parsed are logged and left out.
+
+        """
+        logging.info('       Executing: SceneCatalog.scan')
+        root_dir = os.path.abspath(root_dir)
+        known = dict((row['path'], row) for row in
+                     self.connection.execute('SELECT * FROM directories'))
+        listed = []
+        stack  = [root_dir]
+        while stack:
+            path  = stack.pop()
+            if not os.path.isdir(path):
+                continue
+            mtime = os.path.getmtime(path)
+            row   = known.get(path)
+            if row is not None and row['mtime'] == mtime:
+                subdirs = json.loads(row['subdirs'])
+                product = row['product']
+            else:
+                names   = os.listdir(path)
+                subdirs = [name for name in names if os.path.isdir(os.path.join(path, name))]
+                product = int(PRODUCT_XML in names)
+                listed.append((path, mtime, json.dumps(subdirs), product))
+            if product:
+                self.add(os.path.join(path, PRODUCT_XML))
+            else:
+                stack.extend(os.path.join(path, name) for name in sorted(subdirs, reverse=True))
+        if listed:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)',
+                                            listed)
+        scenes = [scene for scene in self.scenes(root_dir)
+                  if os.path.isfile(scene['product_xml'])]
+        logging.info('          Successfully completed SceneCatalog.scan: '
+                     '{0} scenes, {1} directories listed'.format(len(scenes), len(listed)))
+        return scenes
+
+
+    def scene(self, product_xml):
+        """
+        Scene of a product
+
+        Parameters:
+            product_xml -- product.xml file, or product directory
+
+        Return value:
+            Scene dictionary, None when the product is not catalogued.
+
+        """
+        path = os.path.abspath(product_xml)
+        row  = self.connection.execute('SELECT * FROM scenes WHERE product_xml = ? OR '
+                                       'product_dir = ?', (path, path)).fetchone()
+        if row is None:
+            return None
+        return self._scene(row)
+
+
+    def scenes(self, root_dir=None, **criteria):
+        """
+        Scenes of the catalog
+
+        Parameters:
+            root_dir -- Only scenes under this directory, all scenes otherwise
+            criteria -- Column values the scenes must match,
+                        e.g. satellite='RADARSAT-2', beam='F0W2'
+
+        Return value:
+            List of scene dictionaries, ordered by acquisition time.
+
+        """
+        return self._query('SELECT * FROM scenes', [], [], root_dir, criteria)
+
+
+    def intersecting(self, aoi, root_dir=None, **criteria):
+        """
+        Scenes whose footprint intersects an area of interest
+
+        Candidate scenes are selected through the footprint index by
+        bounding box; when the area of interest is a geometry, the candidate
+        footprints are then tested against it exactly.
+
+        Parameters:
+            aoi      -- (min longitude, min latitude, max longitude,
+                        max latitude), or ogr.Geometry in geographic
+                        coordinates (see EGSUtility.geographic_geometry)
+            root_dir -- Only scenes under this directory, all scenes otherwise
+            criteria -- Column values the scenes must match
+
+        Return value:
+            List of scene dictionaries, ordered by acquisition time.
+
+        Limits and constraints:
+            Footprints crossing the antimeridian are not supported.
+
+        """
+        geometry = None
+        if hasattr(aoi, 'GetEnvelope'):
+            geometry = aoi
+            min_lon, max_lon, min_lat, max_lat = geometry.GetEnvelope()
+        else:
+            min_lon, min_lat, max_lon, max_lat = aoi
+        if self.rtree:
+            query = 'SELECT scenes.* FROM scenes JOIN scene_index ON scenes.rowid = scene_index.id'
+            where = ['scene_index.min_lon <= ?', 'scene_index.max_lon >= ?',
+                     'scene_index.min_lat <= ?', 'scene_index.max_lat >= ?']
+        else:
+            query = 'SELECT * FROM scenes'
+            where = ['min_lon <= ?', 'max_lon >= ?', 'min_lat <= ?', 'max_lat >= ?']
+        scenes = self._query(query, where, [max_lon, min_lon, max_lat, min_lat],
+                             root_dir, criteria)
+        if geometry is not None:
+            from osgeo import ogr
+            scenes = [scene for scene in scenes
+                      if ogr.CreateGeometryFromWkt(scene['footprint']).Intersects(geometry)]
+        return scenes
+
+
+    def walk(self, root_dir):
+        """
+        Catalogued products under a directory, in the form of os.walk
+
+        Scans root_dir and yields one (product directory, [], [product.xml])
+        entry per product, so loops written for os.walk only visit the
+        product directories.
+
+        Parameters:
+            root_dir -- Directory to scan
+
+        Return value:
+            Generator of (directory, subdirectories, files) tuples.
+
+        """
+        for scene in self.scan(root_dir):
+            yield scene['product_dir'], [], [os.path.basename(scene['product_xml'])]
+
+
+    def close(self):
+        """Close the catalog database"""
+        self.connection.close()
+
+
+    def _query(self, query, where, params, root_dir, criteria):
+        """Scenes selected by query, where clauses and column criteria"""
+        where  = list(where)
+        params = list(params)
+        if root_dir is not None:
+            where.append('(product_dir = ? OR substr(product_dir, 1, ?) = ?)')
+            root_dir = os.path.abspath(root_dir)
+            prefix   = os.path.join(root_dir, '')
+            params.extend([root_dir, len(prefix), prefix])
+        for column, value in sorted(criteria.items()):
+            if column not in SCENE_COLUMNS:
+                raise ValueError('Unknown scene column: ' + column)
+            where.append(column + ' = ?')
+            params.append(value)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY acquired, name'
+        return [self._scene(row) for row in self.connection.execute(query, params)]
+
+
+    def _scene(self, row):
+        """Scene dictionary of a scenes table row"""
+        scene = dict((column, row[column]) for column in SCENE_COLUMNS)
+        for column in ('polarizations', 'image_files', 'lut_files'):
+            scene[column] = json.loads(scene[column])
+        scene['bounds'] = (row['min_lon'], row['min_lat'], row['max_lon'], row['max_lat'])
+        return scene
@@ -0,0 +1,245 @@
+################################################################################
+# Name : seed_stats.py
+"""
+    Module used to compute the statistics of threshold calibration seeds
+
+    Usage:
+        -- Rasterize the seed shapefiles into one class-label array
+        -- Compute the count, mean, standard deviation and histogram of the
+           filtered DB values of every seed class in a single pass
+
+    Limits and constraints:
+        Only the window of the image covered by the seeds is rasterized and
+        read (plus the halo of the speckle filter), and only the seed
+        features intersecting that window are rasterized (see vector_subset).
+        Where seeds overlap, the seed file listed last wins.  Histogram bins
+        beyond the DB range are accumulated in the first and last bins.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import math
+import logging
+from multiprocessing import cpu_count
+
+import numpy
+from osgeo import gdal, ogr, osr
+
+# Import private modules
+import EGS_utility
+import speckle_filter
+import vector_subset
+
+
+class SeedStats:
+    """
+    Class used to compute the statistics of threshold calibration seeds.
+
+    The seeds (e.g. water.shp, veg_non_flood.shp, veg_flood.shp) are burnt
+    into a single array of class labels, 1 for the first seed file and so
+    on, covering the seed window of the image only.  Tiles of the window
+    holding seeds are filtered and scaled to DB as the threshold stage sees
+    them, then reduced per class with numpy.bincount (count, sum, sum of
+    squares and histogram), tiles in worker threads.
+    The following functionality is performed by this class.
+    -- Find the image window covered by the seeds (seed_window)
+    -- Rasterize the seeds into class labels (rasterize)
+    -- Compute the statistics of every seed class (statistics)
+
+    """
+
+
+    def __init__(self, speckle=None, db=True, bin_width=0.1, db_range=(-40.0, 20.0),
+                 tile_size=512, num_threads=None):
+        """Initialisation of SeedStats class
+
+        Parameters:
+            speckle     -- speckle_filter.SpeckleFilter, Gamma-MAP 5x5 with
+                           4 looks (as fgamma) otherwise
+            db          -- True when the input is intensity, to be filtered
+                           and scaled to DB; False when the input channel is
+                           already filtered and scaled (e.g. scale_sar output)
+            bin_width   -- Histogram bin width (DB)
+            db_range    -- (minimum, maximum) DB of the histogram
+            tile_size   -- Tile size (pixels)
+            num_threads -- Number of worker threads, defaults to CPU count
+
+        """
+        self.speckle     = speckle or speckle_filter.SpeckleFilter()
+        self.db          = db
+        self.bin_width   = float(bin_width)
+        self.db_range    = (float(db_range[0]), float(db_range[1]))
+        self.num_bins    = int(math.ceil((self.db_range[1] - self.db_range[0]) / self.bin_width))
+        self.tile_size   = int(tile_size)
+        self.num_threads = num_threads or cpu_count()
+
+
+    def seed_window(self, dataset, seed_files):
+        """
+        Find the image window covered by the seeds
+
+        Parameters:
+            dataset    -- GDAL dataset of the image (north up)
+            seed_files -- Seed vector files
+
+        Return value:
+            (xoff, yoff, xsize, ysize) of the window, None if the seeds do
+            not overlap the image.
+
+        """
+        image_srs = osr.SpatialReference()
+        image_srs.ImportFromWkt(dataset.GetProjection())
+        ulx, px, rx, uly, ry, py = dataset.GetGeoTransform()
+        envelopes = []
+        for seed_file in seed_files:
+            source = ogr.Open(seed_file)
+            if source is None:
+                raise ValueError('cannot open ' + seed_file)
+            layer = source.GetLayer(0)
+            if not layer.GetFeatureCount():
+                continue
+            minx, maxx, miny, maxy = layer.GetExtent()
+            ring = ogr.Geometry(ogr.wkbLinearRing)
+            for x, y in ((minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy), (minx, miny)):
+                ring.AddPoint_2D(x, y)
+            extent = ogr.Geometry(ogr.wkbPolygon)
+            extent.AddGeometry(ring)
+            layer_srs = layer.GetSpatialRef()
+            if layer_srs is not None and not layer_srs.IsSame(image_srs):
+                extent.Segmentize(max(maxx - minx, maxy - miny) / 20.0)
+                extent.Transform(osr.CoordinateTransformation(layer_srs, image_srs))
+            envelopes.append(extent.GetEnvelope())
+        if not envelopes:
+            return None
+        minx = min(envelope[0] for envelope in envelopes)
+        maxx = max(envelope[1] for envelope in envelopes)
+        miny = min(envelope[2] for envelope in envelopes)
+        maxy = max(envelope[3] for envelope in envelopes)
+        x0 = max(int(math.floor((minx - ulx) / px)), 0)
+        x1 = min(int(math.ceil((maxx - ulx) / px)), dataset.RasterXSize)
+        y0 = max(int(math.floor((maxy - uly) / py)), 0)
+        y1 = min(int(math.ceil((miny - uly) / py)), dataset.RasterYSize)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+
+    def rasterize(self, dataset, seed_files, window):
+        """
+        Rasterize the seeds into class labels
+
+        Parameters:
+            dataset    -- GDAL dataset of the image (north up)
+            seed_files -- Seed vector files, labelled 1, 2, ...
+            window     -- (xoff, yoff, xsize, ysize) of the image window
+
+        Return value:
+            uint8 array of class labels of the window, 0 outside the seeds.
+
+        """
+        xoff, yoff, xsize, ysize = window
+        ulx, px, rx, uly, ry, py = dataset.GetGeoTransform()
+        labels_ds = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Byte)
+        labels_ds.SetGeoTransform((ulx + xoff * px, px, rx, uly + yoff * py, ry, py))
+        labels_ds.SetProjection(dataset.GetProjection())
+        image_srs = osr.SpatialReference()
+        image_srs.ImportFromWkt(dataset.GetProjection())
+        x0, y0 = ulx + xoff * px, uly + yoff * py
+        x1, y1 = x0 + xsize * px, y0 + ysize * py
+        extent = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+        for label, seed_file in enumerate(seed_files, 1):
+            subset = vector_subset.VectorSubset(seed_file)
+            subset.index()
+            layer  = subset.layer(extent, image_srs)
+            if gdal.RasterizeLayer(labels_ds, [1], layer, burn_values=[label]) != 0:
+                raise ValueError('cannot rasterize ' + seed_file)
+        return labels_ds.GetRasterBand(1).ReadAsArray()
+
+
+    def statistics(self, in_file, in_band, seed_files):
+        """
+        Compute the statistics of every seed class
+
+        Parameters:
+            in_file    -- Input raster (e.g. ortho PCIDSK file)
+            in_band    -- Input band, intensity or DB (see db)
+            seed_files -- Seed vector files
+
+        Return value:
+            List of dictionaries, one per seed file: 'count', 'mean', 'std'
+            (DB, NaN without seed pixels) and 'histogram' (pixel counts of
+            the bins of bin_width from db_range[0]), when successful,
+            error statement otherwise.
+
+        Limits and constraints:
+            Background pixels (value 0) are excluded.
+        """
+        try:
+            logging.info('       Executing: SeedStats.statistics')
+            dataset = gdal.Open(in_file)
+            if dataset is None:
+                raise ValueError('cannot open ' + in_file)
+            num_classes = len(seed_files) + 1
+            count     = numpy.zeros(num_classes, dtype=numpy.int64)
+            total     = numpy.zeros(num_classes)
+            square    = numpy.zeros(num_classes)
+            histogram = numpy.zeros(num_classes * self.num_bins, dtype=numpy.int64)
+
+            window = self.seed_window(dataset, seed_files)
+            if window is not None:
+                logging.info('          Seed window: {0}'.format(window))
+                labels = self.rasterize(dataset, seed_files, window)
+
+                util   = EGS_utility.EGSUtility()
+                read_window = util.window_reader(dataset)
+                reader = read_window
+                if self.db:
+                    reader = self.speckle.filtered(read_window, dataset.RasterXSize,
+                                                   dataset.RasterYSize)
+                xoff, yoff, xsize, ysize = window
+                tiles = [tile for tile in util.image_tiles(xsize, ysize, self.tile_size)
+                         if labels[tile[1]:tile[1] + tile[3], tile[0]:tile[0] + tile[2]].any()]
+
+                def tile_task(tile):
+                    col, row, cols, rows = tile
+                    values = reader(in_band, xoff + col, yoff + row, cols, rows).astype(numpy.float64)
+                    label  = labels[row:row + rows, col:col + cols].astype(numpy.intp)
+                    valid  = values != 0
+                    if self.db:
+                        valid &= values > 0
+                        values[valid] = 10.0 * numpy.log10(values[valid])
+                    label  = numpy.where(valid, label, 0).ravel()
+                    values = numpy.where(valid, values, 0.0).ravel()
+                    bins   = numpy.clip(((values - self.db_range[0]) / self.bin_width).astype(numpy.intp),
+                                        0, self.num_bins - 1)
+                    return (numpy.bincount(label, minlength=num_classes),
+                            numpy.bincount(label, weights=values, minlength=num_classes),
+                            numpy.bincount(label, weights=values * values, minlength=num_classes),
+                            numpy.bincount(label * self.num_bins + bins,
+                                           minlength=num_classes * self.num_bins))
+
+                for tile_count, tile_total, tile_square, tile_histogram in \
+                        util.tile_map(tile_task, tiles, self.num_threads):
+                    count     += tile_count
+                    total     += tile_total
+                    square    += tile_square
+                    histogram += tile_histogram
+            dataset = None
+
+            histogram = histogram.reshape(num_classes, self.num_bins)
+            results = []
+            for label, seed_file in enumerate(seed_files, 1):
+                result = {'count' : int(count[label]), 'mean' : float('nan'), 'std' : float('nan'),
+                          'histogram' : histogram[label]}
+                if count[label]:
+                    mean = total[label] / count[label]
+                    result['mean'] = mean
+                    result['std']  = math.sqrt(max(square[label] / count[label] - mean * mean, 0.0))
+                logging.info('          {0}: {1} pixels, mean {2}, std {3}'.format(
+                             seed_file, result['count'], result['mean'], result['std']))
+                results.append(result)
+            logging.info('          Successfully completed SeedStats.statistics')
+            return results
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('statistics(): {:s}'.format(e))
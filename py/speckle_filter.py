@@ -0,0 +1,293 @@
+################################################################################
+# Name : speckle_filter.py
+"""
+    Module used to reduce the speckle of SAR imagery with NumPy
+
+    Usage:
+        -- Compute local mean and variance with summed-area tables
+        -- Filter speckle with the Gamma-MAP, Lee or Frost filter
+        -- Filter windows read by another stage on the fly (halos included)
+        -- Filter a raster into a tiled Float32 GeoTIFF, tiles in parallel
+
+    Limits and constraints:
+        The input is intensity (power), e.g. calibrated sigma nought, as for
+        fgamma imagefmt='POW'.  Background pixels (value 0) are excluded from
+        the local statistics and stay 0.  Summed-area tables are accumulated
+        in float64 per tile, tiles and halos are small enough for the
+        rounding of the variance to stay negligible.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import logging
+from multiprocessing import cpu_count
+
+import numpy
+from osgeo import gdal
+
+# Import private modules
+import EGS_utility
+
+# Filters
+GAMMA_MAP = 'Gamma-MAP'
+LEE       = 'Lee'
+FROST     = 'Frost'
+FILTERS   = (GAMMA_MAP, LEE, FROST)
+
+# Value of background pixels
+NODATA = 0
+
+
+class SpeckleFilter:
+    """
+    Class used to reduce the speckle of SAR imagery without PCI Geomatica.
+
+    The local mean and variance are computed from summed-area tables (sum,
+    sum of squares and count of valid pixels), at a cost independent of the
+    filter size.  Gamma-MAP (as PCI fgamma), Lee and Frost are computed from
+    these statistics over whole blocks; Frost sums the window by rings of
+    equal distance to the centre, one shifted block per window position.
+    Each tile is read with a halo of half the filter size so that tiles
+    filtered separately match the whole image filtered at once.
+    The following functionality is performed by this class.
+    -- Compute local statistics (local_stats)
+    -- Filter a block read with its halo (filter_block)
+    -- Wrap a window reader to return filtered values (filtered)
+    -- Filter an image tile by tile in worker threads (filter_blocks)
+    -- Write filtered imagery to file (write)
+
+    """
+
+
+    def __init__(self, method=GAMMA_MAP, filter_size=5, num_looks=4.0, damping=1.0,
+                 tile_size=512, num_threads=None):
+        """Initialisation of SpeckleFilter class
+
+        Parameters:
+            method      -- GAMMA_MAP, LEE or FROST
+            filter_size -- Filter size (odd number of pixels)
+            num_looks   -- Equivalent number of looks
+            damping     -- Frost damping factor
+            tile_size   -- Tile size (pixels) of filter_blocks and write
+            num_threads -- Number of worker threads, defaults to CPU count
+
+        """
+        if method not in FILTERS:
+            raise ValueError('Unknown speckle filter: {0}'.format(method))
+        if int(filter_size) < 3 or int(filter_size) % 2 == 0:
+            raise ValueError('Filter size must be odd and at least 3: {0}'.format(filter_size))
+        self.method      = method
+        self.filter_size = int(filter_size)
+        self.halo        = self.filter_size // 2
+        self.num_looks   = float(num_looks)
+        self.damping     = float(damping)
+        self.tile_size   = int(tile_size)
+        self.num_threads = num_threads or cpu_count()
+        self.cu2         = 1.0 / self.num_looks    # Squared speckle variation coefficient
+
+
+    def local_stats(self, values):
+        """
+        Compute local statistics
+
+        Parameters:
+            values -- 2-D array, including a halo of filter_size // 2 pixels
+
+        Return value:
+            (mean, variance, count) of the valid pixels of the window around
+            every pixel of the block inside the halo, float64 arrays.
+
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        valid  = values != NODATA
+        count  = self._window_sum(valid.astype(numpy.float64))
+        total  = self._window_sum(values)
+        square = self._window_sum(values * values)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            mean     = numpy.where(count > 0, total / count, 0.0)
+            variance = numpy.where(count > 0, square / count - mean * mean, 0.0)
+        return mean, numpy.maximum(variance, 0.0), count
+
+
+    def filter_block(self, values):
+        """
+        Filter a block read with its halo
+
+        Parameters:
+            values -- 2-D array of intensities, including a halo of
+                      filter_size // 2 pixels (background beyond the image)
+
+        Return value:
+            float32 array of the filtered block inside the halo.
+
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        halo   = self.halo
+        centre = values[halo:values.shape[0] - halo, halo:values.shape[1] - halo]
+        mean, variance, count = self.local_stats(values)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            ci2 = numpy.where(mean > 0, variance / (mean * mean), 0.0)
+            if self.method == GAMMA_MAP:
+                result = self._gamma_map(centre, mean, ci2)
+            elif self.method == LEE:
+                result = self._lee(centre, mean, ci2)
+            else:
+                result = self._frost(values, ci2)
+        result = result.astype(numpy.float32)
+        result[(centre == NODATA) | (count == 0)] = NODATA
+        return result
+
+
+    def filtered(self, read_window, pixels, lines):
+        """
+        Window reader returning filtered values
+
+        The window is read with its halo, clipped to the image, so that the
+        next stage (e.g. scaling to dB, thresholds) receives filtered blocks
+        without an intermediate file, e.g.
+        read_window = speckle.filtered(calibrate.calibrated(read_window), pixels, lines)
+
+        Parameters:
+            read_window -- Function (band, xoff, yoff, xsize, ysize) returning
+                           a window of intensities
+            pixels      -- Number of pixels of the image
+            lines       -- Number of lines of the image
+
+        Return value:
+            Function with the same arguments returning float32 filtered values.
+
+        """
+        halo = self.halo
+
+        def filtered_window(band, xoff, yoff, xsize, ysize):
+            x0, y0 = max(xoff - halo, 0), max(yoff - halo, 0)
+            x1, y1 = min(xoff + xsize + halo, pixels), min(yoff + ysize + halo, lines)
+            block  = numpy.zeros((ysize + 2 * halo, xsize + 2 * halo), dtype=numpy.float64)
+            block[y0 - yoff + halo:y1 - yoff + halo, x0 - xoff + halo:x1 - xoff + halo] = \
+                read_window(band, x0, y0, x1 - x0, y1 - y0)
+            return self.filter_block(block)
+        return filtered_window
+
+
+    def filter_blocks(self, read_window, pixels, lines, band=0):
+        """
+        Filter an image tile by tile in worker threads
+
+        Tiles are yielded as they complete, not in image order.
+
+        Parameters:
+            read_window -- Function (band, xoff, yoff, xsize, ysize) returning
+                           a window of intensities, called from worker threads
+            pixels      -- Number of pixels of the image
+            lines       -- Number of lines of the image
+            band        -- Band passed to read_window
+
+        Return value:
+            Iterator of (xoff, yoff, float32 array) tiles.
+
+        """
+        filtered_window = self.filtered(read_window, pixels, lines)
+        util = EGS_utility.EGSUtility()
+
+        def tile_task(tile):
+            xoff, yoff, xsize, ysize = tile
+            return xoff, yoff, filtered_window(band, xoff, yoff, xsize, ysize)
+
+        return util.tile_map(tile_task, util.image_tiles(pixels, lines, self.tile_size),
+                             self.num_threads)
+
+
+    def write(self, in_file, out_file, in_band=1):
+        """
+        Write filtered imagery
+
+        Parameters:
+            in_file  -- Input raster (intensity)
+            in_band  -- Input band
+            out_file -- Output GeoTIFF, one Float32 band
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: SpeckleFilter.write: ' + self.method)
+            in_ds = gdal.Open(in_file)
+            if in_ds is None:
+                raise ValueError('cannot open ' + in_file)
+            pixels, lines = in_ds.RasterXSize, in_ds.RasterYSize
+            options = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER',
+                       'BLOCKXSIZE=256', 'BLOCKYSIZE=256']
+            out_ds = gdal.GetDriverByName('GTiff').Create(out_file, pixels, lines, 1,
+                                                          gdal.GDT_Float32, options)
+            if out_ds is None:
+                raise ValueError('cannot create ' + out_file)
+            out_ds.SetGeoTransform(in_ds.GetGeoTransform())
+            out_ds.SetProjection(in_ds.GetProjection())
+            if in_ds.GetGCPCount():
+                out_ds.SetGCPs(in_ds.GetGCPs(), in_ds.GetGCPProjection())
+            out_band = out_ds.GetRasterBand(1)
+            out_band.SetNoDataValue(NODATA)
+
+            read_window = EGS_utility.EGSUtility().window_reader(in_ds, in_band)
+            for xoff, yoff, block in self.filter_blocks(read_window, pixels, lines):
+                out_band.WriteArray(block, xoff, yoff)
+            out_ds.FlushCache()
+            out_ds = None
+            in_ds  = None
+            logging.info('          Successfully completed SpeckleFilter.write: ' + out_file)
+            return out_file
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('write(): {:s}'.format(e))
+
+
+    def _window_sum(self, values):
+        """Sum over the filter window of every pixel inside the halo"""
+        size = self.filter_size
+        sat  = numpy.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=numpy.float64)
+        numpy.cumsum(numpy.cumsum(values, axis=0), axis=1, out=sat[1:, 1:])
+        return sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] + sat[:-size, :-size]
+
+
+    def _gamma_map(self, centre, mean, ci2):
+        """Gamma-MAP (Lopes et al.) estimate from the local statistics"""
+        cu2    = self.cu2
+        looks  = self.num_looks
+        alpha  = (1.0 + cu2) / numpy.maximum(ci2 - cu2, 1e-12)
+        b      = alpha - looks - 1.0
+        d      = mean * mean * b * b + 4.0 * alpha * looks * mean * centre
+        result = (b * mean + numpy.sqrt(numpy.maximum(d, 0.0))) / (2.0 * alpha)
+        result = numpy.where(ci2 <= cu2, mean, result)          # Homogeneous area
+        return numpy.where(ci2 >= 2.0 * cu2, centre, result)    # Point target, edge
+
+
+    def _lee(self, centre, mean, ci2):
+        """Lee estimate from the local statistics"""
+        weight = numpy.where(ci2 > 0, (1.0 - self.cu2 / ci2) / (1.0 + self.cu2), 0.0)
+        weight = numpy.clip(weight, 0.0, 1.0)
+        return mean + weight * (centre - mean)
+
+
+    def _frost(self, values, ci2):
+        """Frost estimate, exponential weights of the distance to the centre"""
+        size   = self.filter_size
+        rows   = values.shape[0] - size + 1
+        cols   = values.shape[1] - size + 1
+        k      = self.damping * ci2
+        total  = numpy.zeros((rows, cols))
+        weight = numpy.zeros((rows, cols))
+        rings  = {}
+        for dy in range(size):
+            for dx in range(size):
+                distance = numpy.hypot(dy - self.halo, dx - self.halo)
+                rings.setdefault(distance, []).append(values[dy:dy + rows, dx:dx + cols])
+        for distance, shifted in rings.items():
+            ring_sum   = sum(shifted)
+            ring_count = sum((window != NODATA).astype(numpy.float64) for window in shifted)
+            decay      = numpy.exp(-k * distance)
+            total     += decay * ring_sum
+            weight    += decay * ring_count
+        return numpy.where(weight > 0, total / numpy.maximum(weight, 1e-12), 0.0)
@@ -0,0 +1,175 @@
+################################################################################
+# Name : stage_manifest.py
+"""
+    Module used to record the processing stages of a product, for restart
+
+    Usage:
+        -- Compute the key of a stage from its input files, parameters and
+           upstream stages
+        -- Check whether a stage recorded with the same key is still current
+        -- Record the outputs of a completed stage (files, channels, segments,
+           thresholds)
+        -- Invalidate a stage
+
+    Limits and constraints:
+        Input files are identified by path, size and modification time, not
+        by content.  A stage recorded again gets a new run id, so that every
+        stage downstream of it is recomputed, even with the same key.  The
+        manifest is rewritten after each stage; it is read and written by one
+        process at a time.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+
+
+class StageManifest:
+    """
+    Class used to record the processing stages of a product, for restart.
+
+    Each stage of a product (import, ortho, filter, scale, calibrate,
+    threshold, vegcover, export) is recorded in a JSON manifest with its key
+    and its outputs once completed.  The key is a hash of the identity of the
+    input files, the parameters and the run ids of the upstream stages, so
+    that a rerun after a crash resumes after the last completed stage, and a
+    rerun with different thresholds recomputes the threshold and export
+    stages only.
+    The following functionality is performed by this class.
+    -- Key of a stage (key)
+    -- Check whether a stage is current (current)
+    -- Outputs recorded for a stage (values)
+    -- Record a completed stage (record)
+    -- Invalidate a stage (invalidate)
+
+    """
+
+
+    def __init__(self, manifest_file):
+        """Initialisation of StageManifest class
+
+        Parameters:
+            manifest_file -- JSON manifest of the product, created when missing
+
+        """
+        self.manifest_file = os.path.abspath(manifest_file)
+        self.stages = {}
+        if os.path.isfile(self.manifest_file):
+            try:
+                with open(self.manifest_file) as manifest:
+                    self.stages = json.load(manifest)['stages']
+            except (ValueError, KeyError):
+                logging.info('          Ignoring unreadable manifest: ' + self.manifest_file)
+
+
+    def key(self, inputs=(), params=None, upstream=()):
+        """
+        Key of a stage
+
+        Parameters:
+            inputs   -- Input files, identified by path, size and modification
+                        time (None when missing)
+            params   -- Dictionary of parameters, JSON serializable
+            upstream -- Names of the upstream stages, identified by run id
+                        (None when not recorded)
+
+        Return value:
+            Hexadecimal key.
+
+        """
+        identity = {'inputs'   : [self._identity(in_file) for in_file in inputs],
+                    'params'   : params or {},
+                    'upstream' : [self.stages.get(stage, {}).get('run') for stage in upstream]}
+        return hashlib.sha1(json.dumps(identity, sort_keys=True)).hexdigest()
+
+
+    def current(self, stage, key, check_files=True):
+        """
+        Check whether a stage is current
+
+        Parameters:
+            stage       -- Stage name
+            key         -- Key of the stage (see key)
+            check_files -- Check that the output files still exist
+
+        Return value:
+            True when the stage was recorded with the same key (and its output
+            files exist), False otherwise.
+
+        """
+        record = self.stages.get(stage)
+        if record is None or record['key'] != key:
+            return False
+        if check_files:
+            return all(os.path.exists(out_file) for out_file in record['files'])
+        return True
+
+
+    def values(self, stage):
+        """
+        Outputs recorded for a stage
+
+        Parameters:
+            stage -- Stage name
+
+        Return value:
+            Dictionary of output values, empty when not recorded.
+
+        """
+        return dict(self.stages.get(stage, {}).get('values', {}))
+
+
+    def record(self, stage, key, files=(), values=None):
+        """
+        Record a completed stage, replacing its previous record
+
+        Parameters:
+            stage  -- Stage name
+            key    -- Key of the stage (see key)
+            files  -- Output files (or directories) of the stage
+            values -- Dictionary of output values, JSON serializable (e.g.
+                      channel and segment numbers)
+
+        """
+        self.stages[stage] = {'key'    : key,
+                              'run'    : uuid.uuid4().hex,
+                              'files'  : [os.path.abspath(out_file) for out_file in files],
+                              'values' : values or {},
+                              'completed' : time.strftime('%Y-%m-%d %H:%M:%S')}
+        self._write()
+        logging.info('          Stage recorded: ' + stage)
+
+
+    def invalidate(self, stage):
+        """
+        Invalidate a stage
+
+        Parameters:
+            stage -- Stage name
+
+        """
+        if self.stages.pop(stage, None) is not None:
+            self._write()
+
+
+    def _identity(self, in_file):
+        """Path, size and modification time of a file, None when missing"""
+        if in_file is None or not os.path.exists(in_file):
+            return None
+        return [os.path.normcase(os.path.abspath(in_file)), os.path.getsize(in_file),
+                int(os.path.getmtime(in_file))]
+
+
+    def _write(self):
+        """Write the manifest through a temporary file, not left half written"""
+        temp = self.manifest_file + '.tmp'
+        with open(temp, 'w') as manifest:
+            json.dump({'stages' : self.stages}, manifest, indent=2, sort_keys=True)
+        if os.name == 'nt' and os.path.isfile(self.manifest_file):
+            os.remove(self.manifest_file)
+        os.rename(temp, self.manifest_file)
@@ -0,0 +1,213 @@
+################################################################################
+# Name : vector_subset.py
+"""
+    Module used to read the features of a vector layer within an extent
+
+    Usage:
+        -- Build the spatial index of a vector file once (.qix for
+           shapefiles, a SQLite R*Tree sidecar otherwise)
+        -- Read only the features intersecting an extent, e.g. a scene or a
+           block of the output grid, for rasterization
+        -- Write the features intersecting an extent to a shapefile, e.g.
+           for import into a PCIDSK file
+
+    Limits and constraints:
+        Only the first layer of the vector file is read.  The .qix index is
+        written next to the shapefile; when that directory is read-only the
+        sidecar index is written to the index directory instead.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import hashlib
+import logging
+import sqlite3
+import tempfile
+
+from osgeo import ogr, osr
+
+# Import private modules
+import EGS_utility
+
+# Index types
+QIX     = 'qix'
+NATIVE  = 'native'
+SIDECAR = 'sidecar'
+
+
+class VectorSubset:
+    """
+    Class used to read the features of a vector layer within an extent.
+
+    Shapefiles are given a .qix quadtree (CREATE SPATIAL INDEX), which the
+    OGR shapefile driver uses for spatial filters; formats with a spatial
+    index of their own (e.g. GeoPackage, file geodatabase) are used as is.
+    Other files get a sidecar SQLite database of feature bounding boxes
+    (R*Tree when available), keyed by file identity, from which candidate
+    features are fetched by FID.  Either way a land cover layer of millions
+    of polygons only yields the features of the extent to the rasterizer.
+    The following functionality is performed by this class.
+    -- Build or find the spatial index (index)
+    -- Layer of the features intersecting an extent (layer)
+    -- Write the features intersecting an extent to a shapefile (write)
+
+    """
+
+
+    def __init__(self, vector_file, index_dir=None):
+        """Initialisation of VectorSubset class
+
+        Parameters:
+            vector_file -- Vector file (e.g. shapefile)
+            index_dir   -- Directory of sidecar indexes, EGS_VectorIndex in
+                           the temporary directory otherwise
+
+        """
+        self.vector_file = os.path.abspath(vector_file)
+        self.index_dir   = index_dir or os.path.join(tempfile.gettempdir(), 'EGS_VectorIndex')
+        self.source      = ogr.Open(self.vector_file)
+        if self.source is None:
+            raise ValueError('cannot open ' + self.vector_file)
+        self.sidecar     = None
+        self.memory      = None     # Data source of the last sidecar subset
+
+
+    def index(self):
+        """
+        Build or find the spatial index
+
+        Return value:
+            Index type used: QIX, NATIVE or SIDECAR.
+
+        """
+        layer = self.source.GetLayer(0)
+        if self.source.GetDriver().GetName() == 'ESRI Shapefile':
+            qix_file = os.path.splitext(self.vector_file)[0] + '.qix'
+            if not os.path.isfile(qix_file) and os.access(os.path.dirname(qix_file), os.W_OK):
+                logging.info('          Creating spatial index: ' + qix_file)
+                update = ogr.Open(self.vector_file, 1)
+                if update is not None:
+                    update.ExecuteSQL('CREATE SPATIAL INDEX ON "{0}"'.format(layer.GetName()))
+                    update = None
+                    self.source = ogr.Open(self.vector_file)    # Reopened to read the index
+            if os.path.isfile(qix_file):
+                return QIX
+        elif layer.TestCapability(ogr.OLCFastSpatialFilter):
+            return NATIVE
+        self.sidecar = self._sidecar_index()
+        return SIDECAR
+
+
+    def layer(self, extent=None, srs=None):
+        """
+        Layer of the features intersecting an extent
+
+        Parameters:
+            extent -- (min x, min y, max x, max y), all features otherwise
+            srs    -- osr.SpatialReference of the extent, layer's otherwise
+
+        Return value:
+            OGR layer, valid while this object exists.
+
+        """
+        layer = self.source.GetLayer(0)
+        if extent is None:
+            layer.SetSpatialFilter(None)
+            return layer
+        min_x, min_y, max_x, max_y = extent
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in ((min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y), (min_x, min_y)):
+            ring.AddPoint_2D(x, y)
+        geometry = ogr.Geometry(ogr.wkbPolygon)
+        geometry.AddGeometry(ring)
+        layer_srs = layer.GetSpatialRef()
+        if srs is not None and layer_srs is not None and not srs.IsSame(layer_srs):
+            geometry.Segmentize(max(max_x - min_x, max_y - min_y) / 20.0)
+            geometry.Transform(osr.CoordinateTransformation(srs, layer_srs))
+
+        if self.sidecar is None:
+            layer.SetSpatialFilter(geometry)
+            return layer
+
+        env_min_x, env_max_x, env_min_y, env_max_y = geometry.GetEnvelope()
+        connection = sqlite3.connect(self.sidecar)
+        fids = [row[0] for row in connection.execute(
+                    'SELECT id FROM features WHERE max_x >= ? AND min_x <= ? '
+                    'AND max_y >= ? AND min_y <= ?',
+                    (env_min_x, env_max_x, env_min_y, env_max_y))]
+        connection.close()
+        self.memory = ogr.GetDriverByName('Memory').CreateDataSource('')
+        subset = self.memory.CreateLayer(layer.GetName(), layer_srs, layer.GetGeomType())
+        definition = layer.GetLayerDefn()
+        for field in range(definition.GetFieldCount()):
+            subset.CreateField(definition.GetFieldDefn(field))
+        for fid in sorted(fids):
+            feature = layer.GetFeature(fid)
+            if feature is not None and feature.GetGeometryRef() is not None and \
+               feature.GetGeometryRef().Intersects(geometry):
+                subset.CreateFeature(feature)
+        return subset
+
+
+    def write(self, out_file, extent=None, srs=None):
+        """
+        Write the features intersecting an extent to a shapefile
+
+        Parameters:
+            out_file -- Output shapefile, replaced if it exists
+            extent   -- (min x, min y, max x, max y), all features otherwise
+            srs      -- osr.SpatialReference of the extent, layer's otherwise
+
+        Return value:
+            Number of features written.
+
+        """
+        driver = ogr.GetDriverByName('ESRI Shapefile')
+        if os.path.exists(out_file):
+            driver.DeleteDataSource(out_file)
+        target = driver.CreateDataSource(out_file)
+        if target is None:
+            raise ValueError('cannot create ' + out_file)
+        layer  = self.layer(extent, srs)
+        output = target.CopyLayer(layer, os.path.splitext(os.path.basename(out_file))[0])
+        count  = output.GetFeatureCount()
+        target = None
+        layer.SetSpatialFilter(None)
+        return count
+
+
+    def _sidecar_index(self):
+        """Sidecar index of the feature bounding boxes, built when missing"""
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir)
+        identity = EGS_utility.EGSUtility().file_stamp(self.vector_file)
+        sidecar  = os.path.join(self.index_dir, 'vector_' +
+                                hashlib.sha1(repr(identity)).hexdigest()[:20] + '.sqlite')
+        if os.path.isfile(sidecar):
+            return sidecar
+
+        logging.info('          Creating spatial index: ' + sidecar)
+        temp = sidecar + '.{0}.tmp'.format(os.getpid())
+        connection = sqlite3.connect(temp)
+        try:
+            connection.execute('CREATE VIRTUAL TABLE features USING '
+                               'rtree(id, min_x, max_x, min_y, max_y)')
+        except sqlite3.OperationalError:
+            # SQLite built without the R*Tree module
+            connection.execute('CREATE TABLE features (id INTEGER PRIMARY KEY, '
+                               'min_x REAL, max_x REAL, min_y REAL, max_y REAL)')
+        layer = self.source.GetLayer(0)
+        layer.SetSpatialFilter(None)
+        layer.ResetReading()
+        rows = []
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is not None:
+                min_x, max_x, min_y, max_y = geometry.GetEnvelope()
+                rows.append((feature.GetFID(), min_x, max_x, min_y, max_y))
+        connection.executemany('INSERT INTO features VALUES (?, ?, ?, ?, ?)', rows)
+        connection.commit()
+        connection.close()
+        # An index built meanwhile by another process is used
+        return EGS_utility.EGSUtility().publish_file(temp, sidecar)
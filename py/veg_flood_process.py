@@ -9,8 +9,13 @@
         -- Filter data
         -- Scale data from linear to DB
         -- Threshold data
+        -- Filter, scale and threshold data in one pass (NumPy engine)
+        -- Rasterize vegetation land cover through a cache (NumPy engine)
+        -- Subset vegetation land cover to the image extent
         -- Combine vegetation products
         -- Export resulting flooded vegetation area product as a geotiff
+        -- Combine and export in one pass on bit-packed masks (NumPy engine)
+        -- Keep intermediates in a working store instead of channels (NumPy engine)
 
     Limits and constraints:
         This method has only been tested
@@ -26,6 +31,7 @@ import sys
 import string
 #from osgeo import gdal
 import gdal
+import osr
 from gdalconst import *
 import logging
 import numpy
@@ -59,6 +65,11 @@ canRunInBackground = True
 
 # Import private modules
 import EGS_utility
+import flood_threshold
+import landcover_cache
+import mask_algebra
+import speckle_filter
+import vector_subset
 
 class VegFloodProcess:
     """
@@ -69,8 +80,12 @@ class VegFloodProcess:
     -- Filter data
     -- Scale data from linear to DB
     -- Threshold data
+    -- Filter, scale and threshold data in one pass (NumPy engine)
+    -- Rasterize vegetation land cover through a cache (NumPy engine)
+    -- Subset vegetation land cover to the image extent
     -- Combine vegetation products
     -- Export resulting flooded vegetation area product as a geotiff
+    -- Combine and export in one pass on bit-packed masks (NumPy engine)
 
     Notes:
         This method has only been tested
@@ -89,6 +104,8 @@ class VegFloodProcess:
 
         """
         self.canRunInBackground = True
+        self.class_chan = None          # Class array of threshold_fused
+        self.veg_cover_chan = None      # Land cover channel of vegcover_cached
 
     def filter_sar(self, in_file, in_chan = 1, filter_size = 5, num_looks = 4.0):
         """
@@ -260,8 +277,8 @@ class VegFloodProcess:
             min_pixel = imstat[0] + 1
 
             # Create and name newly created segment, 'thr' does not rename segments
-            dataset = ds.open_dataset(in_file, ds.eAM_WRITE)
-            veg_seg = dataset.create_bitmap() #  Get the number of the newly created bitmap segment
+            tracker = EGS_utility.EGSUtility().allocation_tracker(in_file)
+            veg_seg = tracker.bitmap() #  Get the number of the newly created bitmap segment
             file=in_file
             dbsl=[veg_seg]
             dbsn="vegflood"
@@ -285,7 +302,7 @@ class VegFloodProcess:
 
 
             # Create and name newly created segment, 'thr' does not rename segments
-            water_seg = dataset.create_bitmap() #  Get the number of the newly created bitmap segment
+            water_seg = tracker.bitmap() #  Get the number of the newly created bitmap segment
             file=in_file
             dbsl=[water_seg]
             dbsn="openwate"
@@ -314,6 +331,50 @@ class VegFloodProcess:
             EGS_utility.EGSUtility().error('threshold_sar(): {:s}'.format(e))
 
 
+    def threshold_fused(self, in_file, store, in_chan = 1, veg_thr = -3.5, openwater_thres = -12.5,
+                        filter_size = 5, num_looks = 4.0):
+        """
+        Filter, scale to DB and threshold high and low in one pass
+
+        Replaces filter_sar, scale_sar and threshold_sar: the filtered and DB
+        values are only computed block by block in memory (Gamma-MAP filter, as
+        fgamma), no 32-bit channel is added.  Both masks are encoded in a single
+        8-bit 'classes' array of the working store, instead of channels and
+        bitmaps.
+
+        Parameters:
+            in_file -- Input file (GeoTIFF of sar_ortho)
+            store -- work_store.WorkStore receiving the classes, released by
+                     export_vegflood_masks
+            in_chan -- Input channel (calibrated intensity)
+            veg_thr -- Minimum threshold for vegetation flooded area
+            openwater_thres -- Maximum threshold for open water flooded areas
+            filter_size -- Filter size
+            num_looks -- Number of looks
+
+        Return value:
+            Class array name twice (vegetation and open water) when
+            successful, Error statement otherwise.
+
+        Limits and constraints:
+
+        """
+
+        try:
+            logging.info('       Executing: VegFloodProcess.threshold_fused')
+            speckle = speckle_filter.SpeckleFilter(speckle_filter.GAMMA_MAP, filter_size, num_looks)
+            classify = flood_threshold.FloodThreshold(veg_thr, openwater_thres, speckle)
+            classes = self._store_array(in_file, store, 'classes')
+            if classify.write_band(in_file, in_chan, classes) is None:
+                raise ValueError('classification failed: ' + in_file)
+            self.class_chan = 'classes'
+            logging.info('          Successfully completed VegFloodProcess.threshold_fused: classes array')
+            return ['classes', 'classes']
+
+        except (OSError, ValueError) as e:
+            EGS_utility.EGSUtility().error('threshold_fused(): {:s}'.format(e))
+
+
     def vegcover2bit(self, in_file, out_file, veg_channel = 4, size_pixel = 10):
         """
         IIA Veg Cover Shapefile to ortho file
@@ -333,8 +394,8 @@ class VegFloodProcess:
         """
         try:
             logging.info('       Executing: VegFloodProcess.vegcover2bit')
-            util = EGS_utility.EGSUtility()
-            bitmap_ids_before = util.bitmap_list(out_file) # Run bitmap_list to get a list of IDs from before poly2bit
+            # Number of the bitmap segment poly2bit creates
+            bit_seg = EGS_utility.EGSUtility().allocation_tracker(out_file).reserve_segment()
             fili    =       in_file
             dbvs    =       [veg_channel]               # polygon layer
             filo    =       out_file
@@ -347,9 +408,7 @@ class VegFloodProcess:
             logging.info('          Successfully completed VegFloodProcess.vegcover2bit: poly2bit')
 
             enableDefaultReport('term')
-            bitmap_ids_after = util.bitmap_list(out_file) # Run bitmap_list to get a list of IDs from after poly2bit
-            bit_seg = list(set(bitmap_ids_after)-set(bitmap_ids_before)) # Get the difference between the two lists
-            return bit_seg[0]
+            return bit_seg
 
         except PCIException, e:
             EGS_utility.EGSUtility().error('vegcover2bit(): {:s}'.format(e))
@@ -357,6 +416,103 @@ class VegFloodProcess:
             EGS_utility.EGSUtility().error('vegcover2bit(): {:s}'.format(e))
 
 
+    def vegcover_cached(self, in_file, lc_cache, store = None):
+        """
+        Veg Cover bitmap from the rasterized land cover cache
+
+        Replaces import_vegcover and vegcover2bit: the land cover is not
+        transferred to the file, the mask of the image grid is read from the
+        cache (see landcover_cache) into an 8-bit channel and thresholded to
+        a bitmap.  With a working store, the mask is written to its
+        'veg_cover' array instead, without channel or bitmap.
+
+        Parameters:
+            in_file -- Input file
+            lc_cache -- landcover_cache.LandcoverCache of the land cover file
+            store -- work_store.WorkStore receiving the mask, released by
+                     export_vegflood_masks
+
+        Return value:
+            Newly create vegetation land cover bitmap segment # (the mask array
+            name with a working store) when successful,
+            Error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: VegFloodProcess.vegcover_cached')
+            if store is not None:
+                veg_cover = self._store_array(in_file, store, 'veg_cover')
+                dataset = gdal.Open(in_file)
+                veg_cover.WriteArray(lc_cache.mask(dataset))
+                dataset = None
+                self.veg_cover_chan = 'veg_cover'
+                logging.info('          Successfully completed VegFloodProcess.vegcover_cached: veg_cover array')
+                return 'veg_cover'
+
+            util = EGS_utility.EGSUtility()
+            new_chans = util.add_8_channel(in_file)
+            veg_chan = int(new_chans[0])
+            if lc_cache.write_channel(in_file, veg_chan) is None:
+                raise ValueError('land cover mask failed: ' + in_file)
+            self.veg_cover_chan = veg_chan
+
+            # Create and name newly created segment, 'thr' does not rename segments
+            bit_seg = util.allocation_tracker(in_file).bitmap()
+            mas(in_file, [bit_seg], 'vegcover', 'Veg Land Cover')
+            Report.clear()
+            thr(in_file, [veg_chan], [bit_seg], [1, 1], 'OFF', 'vegcover', 'Veg Land Cover')
+            enableDefaultReport('term')
+            logging.info('          Successfully completed VegFloodProcess.vegcover_cached: thr')
+            return bit_seg
+
+        except PCIException, e:
+            EGS_utility.EGSUtility().error('vegcover_cached(): {:s}'.format(e))
+        except ValueError as e:
+            EGS_utility.EGSUtility().error('vegcover_cached(): {:s}'.format(e))
+
+
+    def subset_vegcover(self, in_file, land_cover, out_file):
+        """
+        Subset the Veg Cover Shapefile to the extent of an image
+
+        Only the polygons intersecting the image are read, through the
+        spatial index of the land cover (see vector_subset), so that
+        import_vegcover transfers the scene's polygons only.
+
+        Parameters:
+            in_file -- Input file (image)
+            land_cover -- Veg Cover Shapefile
+            out_file -- Output shapefile
+
+        Return value:
+            Output shapefile when successful, Error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: VegFloodProcess.subset_vegcover')
+            dataset = gdal.Open(in_file)
+            if dataset is None:
+                raise ValueError('cannot open ' + in_file)
+            ulx, px, rx, uly, ry, py = dataset.GetGeoTransform()
+            lrx = ulx + dataset.RasterXSize * px
+            lry = uly + dataset.RasterYSize * py
+            image_srs = osr.SpatialReference()
+            image_srs.ImportFromWkt(dataset.GetProjection())
+            dataset = None
+            subset = vector_subset.VectorSubset(land_cover)
+            subset.index()
+            count = subset.write(out_file, (min(ulx, lrx), min(uly, lry), max(ulx, lrx), max(uly, lry)),
+                                 image_srs)
+            logging.info('          Successfully completed VegFloodProcess.subset_vegcover: {0} polygons'.format(count))
+            return out_file
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('subset_vegcover(): {:s}'.format(e))
+
     def import_vegcover(self, in_file, out_file):
         """
         IIA Veg Cover Shapefile to ortho file
@@ -446,6 +602,8 @@ class VegFloodProcess:
             dbob    =   []              # output bitmap
             lasc    =   []
             blo( file, logfunc, dbsn, dbsd, dbib, dbob, lasc )
+            tracker =   EGS_utility.EGSUtility().allocation_tracker(in_file)
+            tracker.record_segment(lasc[0])
             logging.info('          Successfully completed VegFloodProcess.combine_veglayers: blo')
 
             file    =   in_file    # input file name
@@ -456,6 +614,7 @@ class VegFloodProcess:
             dbob    =   []              # output bitmap
             lasc    =   []
             blo( file, logfunc, dbsn, dbsd, dbib, dbob, lasc )
+            tracker.record_segment(lasc[0])
             logging.info('          Successfully completed VegFloodProcess.combine_veglayers: blo')
             return lasc[0]
 
@@ -465,7 +624,7 @@ class VegFloodProcess:
             EGS_utility.EGSUtility().error('combine_veglayers(): {:s}'.format(e))
 
 
-    def export_vegflood(self, in_file, out_file, veg_chan):
+    def export_vegflood(self, in_file, out_file, veg_chan, compact = False):
         """
         Export flooded vegetation as a geotiff
 
@@ -473,6 +632,8 @@ class VegFloodProcess:
             in_file  -- Input file
             out_file -- Out file
             veg_chan -- Bit segment of vegetation land cover
+            compact  -- Rewrite the export as a 1-bit, DEFLATE compressed, tiled
+                        geotiff without the empty tiles (see mask_algebra)
 
         Return value:
             Error statement if error occurs.
@@ -480,10 +641,15 @@ class VegFloodProcess:
         Limits and constraints:
 
         """
-        try:
-            os.remove(out_file)
-        except OSError:
-            pass
+        # 8-bit export of fexport, rewritten compact
+        pci_file = out_file
+        if compact:
+            pci_file = os.path.splitext(out_file)[0] + '_8bit.tif'
+        for old_file in set([out_file, pci_file]):
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
 
         util        =       EGS_utility.EGSUtility()
         new_chans   =       util.add_8_channel(in_file)
@@ -505,7 +671,7 @@ class VegFloodProcess:
             logging.info('          Successfully completed VegFloodProcess.export_vegflood: map')
 
             fili    =       in_file
-            filo    =       out_file
+            filo    =       pci_file
             dbiw    =       []
             dbic    =       [int(new_chans[0])]
             dbib    =       []
@@ -517,8 +683,69 @@ class VegFloodProcess:
             fexport( fili, filo, dbiw, dbic, dbib, dbvs, dblut, dbpct, ftype, foptions )
             logging.info('          Successfully completed VegFloodProcess.export_vegflood: fexport')
 
+            if compact:
+                masks = mask_algebra.MaskAlgebra({'vegflood' : (pci_file, 1, 1, 255)})
+                if masks.write('vegflood', out_file, 1, sparse = True) is None:
+                    raise ValueError('compact export failed: ' + out_file)
+                os.remove(pci_file)
+                logging.info('          Successfully completed VegFloodProcess.export_vegflood: compact')
+
         except PCIException, e:
             EGS_utility.EGSUtility().error('export_vegflood(): {:s}'.format(e))
         except ValueError as e:
             EGS_utility.EGSUtility().error('export_vegflood(): {:s}'.format(e))
 
+
+    def export_vegflood_masks(self, out_file, class_chan, veg_chan, store, nbits = 8, sparse = False):
+        """
+        Combine vegetation layers and export flooded vegetation as a geotiff in one pass
+
+        Replaces combine_veglayers and export_vegflood: the masks are read from
+        the class array (see threshold_fused) and the land cover array (see
+        vegcover_cached) of the working store, combined on bit-packed blocks
+        (see mask_algebra) and written directly, without bitmap segments or an
+        export channel.  Both arrays are then released.
+
+        Parameters:
+            out_file   -- Out file
+            class_chan -- Class array name of flood_threshold
+            veg_chan   -- Array name of vegetation land cover (1 = vegetation)
+            store      -- work_store.WorkStore of the class and land cover arrays
+            nbits      -- 8 (as export_vegflood) or 1 bit per pixel
+            sparse     -- Do not store the tiles without flooded vegetation
+
+        Return value:
+            Out file when successful, Error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: VegFloodProcess.export_vegflood_masks')
+            classes, veg_cover = store.array(class_chan), store.array(veg_chan)
+            masks = mask_algebra.MaskAlgebra({
+                'flood_veg'  : (classes, 1, flood_threshold.BOTH, flood_threshold.VEG_FLOOD),
+                'open_water' : (classes, 1, flood_threshold.OPEN_WATER, flood_threshold.BOTH),
+                'veg_cover'  : (veg_cover, 1, 1, 1)})
+            if masks.write('(flood_veg | open_water) & veg_cover', out_file, nbits,
+                           sparse = sparse) is None:
+                raise ValueError('export failed: ' + out_file)
+            store.release(class_chan)
+            store.release(veg_chan)
+            logging.info('          Successfully completed VegFloodProcess.export_vegflood_masks: ' + out_file)
+            return out_file
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('export_vegflood_masks(): {:s}'.format(e))
+
+
+    def _store_array(self, in_file, store, name):
+        """8-bit array of the working store on the grid of in_file, read by one consumer"""
+        dataset = gdal.Open(in_file)
+        if dataset is None:
+            raise ValueError('cannot open ' + in_file)
+        array = store.create(name, dataset.RasterXSize, dataset.RasterYSize, numpy.uint8,
+                             dataset.GetGeoTransform(), dataset.GetProjection(), consumers = 1)
+        dataset = None
+        return array
+
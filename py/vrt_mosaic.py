@@ -0,0 +1,240 @@
+################################################################################
+# Name : vrt_mosaic.py
+"""
+    Module used to mosaic orthorectified segments as GDAL virtual rasters
+
+    Usage:
+        -- Build a multi-band VRT mosaic over the ortho segments
+        -- Build one single-band VRT per polarization
+        -- Materialize a VRT as a GeoTIFF on request
+
+    Limits and constraints:
+        All segments must share the same projection, pixel size and band
+        layout, as is the case for the ortho outputs of one FT1 run.
+        Overlaps are resolved last-wins with no blending (automos BLEND=[0]);
+        pixels with value 0 are background and never overwrite.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import logging
+from xml.etree import cElementTree as ElementTree
+
+from osgeo import gdal
+
+# Import private modules
+import EGS_utility
+
+# Background value of the ortho segments and mosaics
+NODATA = 0
+
+
+class VrtMosaic:
+    """
+    Class used to mosaic orthorectified segments as GDAL virtual rasters.
+
+    A VRT only records where each segment falls in the mosaic, so building
+    the mosaic and the per-polarization views copies no pixels.  Readers
+    (GDAL, ArcGIS) stream the pixels from the segments on access.
+    The following functionality is performed by this class.
+    -- Build a multi-band mosaic (build_mosaic)
+    -- Build single-band polarization views (build_band_views)
+    -- Materialize a VRT (materialize)
+
+    """
+
+
+    def __init__(self, ortho_files):
+        """Initialisation of VrtMosaic class
+
+        Parameters:
+            ortho_files -- Ortho segment files, in mosaicking order (last wins)
+
+        """
+        self.ortho_files = list(ortho_files)
+        self.layout()
+
+
+    def layout(self):
+        """
+        Compute the mosaic grid and the position of every segment within it
+
+        Return value:
+            None, raises ValueError if the segments cannot be mosaicked.
+
+        Limits and constraints:
+
+        """
+        if not self.ortho_files:
+            raise ValueError('no ortho segments to mosaic')
+        self.segments = []
+        for ortho_file in self.ortho_files:
+            dataset = gdal.Open(ortho_file)
+            if dataset is None:
+                raise ValueError('cannot open ' + ortho_file)
+            self.segments.append({'file'         : os.path.abspath(ortho_file),
+                                  'cols'         : dataset.RasterXSize,
+                                  'rows'         : dataset.RasterYSize,
+                                  'bands'        : dataset.RasterCount,
+                                  'geotransform' : dataset.GetGeoTransform(),
+                                  'projection'   : dataset.GetProjection(),
+                                  'data_type'    : gdal.GetDataTypeName(
+                                                   dataset.GetRasterBand(1).DataType)})
+            dataset = None
+
+        util  = EGS_utility.EGSUtility()
+        first = self.segments[0]
+        px, py = first['geotransform'][1], first['geotransform'][5]
+        for segment in self.segments[1:]:
+            gt = segment['geotransform']
+            if abs(gt[1] - px) > 1e-6 * abs(px) or abs(gt[5] - py) > 1e-6 * abs(py) or \
+               segment['bands'] != first['bands']:
+                raise ValueError('segment grid or bands differ: ' + segment['file'])
+            if not util.same_projection(segment['projection'], first['projection']):
+                raise ValueError('segment projection differs: ' + segment['file'])
+
+        ulx = min(segment['geotransform'][0] for segment in self.segments)
+        uly = max(segment['geotransform'][3] for segment in self.segments)
+        lrx = max(segment['geotransform'][0] + segment['cols'] * px for segment in self.segments)
+        lry = min(segment['geotransform'][3] + segment['rows'] * py for segment in self.segments)
+        self.geotransform = (ulx, px, 0.0, uly, 0.0, py)
+        self.cols         = int(round((lrx - ulx) / px))
+        self.rows         = int(round((lry - uly) / py))
+        self.bands        = first['bands']
+        self.projection   = first['projection']
+        self.data_type    = first['data_type']
+        for segment in self.segments:
+            try:
+                segment['xoff'] = util.grid_offset(ulx, segment['geotransform'][0], px)
+                segment['yoff'] = util.grid_offset(uly, segment['geotransform'][3], py)
+            except ValueError as e:
+                raise ValueError('segment not on the mosaic grid ({0}): {1}'.format(e, segment['file']))
+
+
+    def build_mosaic(self, out_vrt, band_names=None):
+        """
+        Write the multi-band VRT mosaic
+
+        Parameters:
+            out_vrt    -- Output VRT file
+            band_names -- Band descriptions (e.g. polarizations)
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: VrtMosaic.build_mosaic')
+            band_names = band_names or [''] * self.bands
+            self._write(out_vrt, [(band + 1, band_names[band]) for band in range(self.bands)])
+            logging.info('          Successfully completed VrtMosaic.build_mosaic: ' + out_vrt)
+            return out_vrt
+
+        except (IOError, ValueError) as e:
+            EGS_utility.EGSUtility().error('build_mosaic(): {:s}'.format(e))
+
+
+    def build_band_views(self, out_pattern, band_names):
+        """
+        Write one single-band VRT per band of the mosaic
+
+        Parameters:
+            out_pattern -- Output file pattern, %s is replaced by the band name
+            band_names  -- Band names (e.g. polarizations)
+
+        Return value:
+            List of output files when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: VrtMosaic.build_band_views')
+            out_files = []
+            for band, name in enumerate(band_names):
+                out_vrt = out_pattern % (name)
+                self._write(out_vrt, [(band + 1, name)])
+                out_files.append(out_vrt)
+            logging.info('          Successfully completed VrtMosaic.build_band_views')
+            return out_files
+
+        except (IOError, ValueError) as e:
+            EGS_utility.EGSUtility().error('build_band_views(): {:s}'.format(e))
+
+
+    def materialize(self, in_vrt, out_file):
+        """
+        Copy a VRT to a tiled, compressed GeoTIFF
+
+        Parameters:
+            in_vrt   -- VRT file
+            out_file -- Output GeoTIFF
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: VrtMosaic.materialize')
+            options = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER']
+            if self.data_type not in ('Float32', 'Float64'):
+                options.append('PREDICTOR=2')
+            dataset = gdal.Translate(out_file, in_vrt, format='GTiff', creationOptions=options)
+            if dataset is None:
+                raise ValueError('cannot write ' + out_file)
+            dataset = None
+            logging.info('          Successfully completed VrtMosaic.materialize: ' + out_file)
+            return out_file
+
+        except (RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('materialize(): {:s}'.format(e))
+
+
+    def _write(self, out_vrt, bands):
+        """
+        Write a VRT holding the given bands of the segments
+
+        Parameters:
+            out_vrt -- Output VRT file
+            bands   -- List of (source band number, description)
+
+        """
+        vrt_dir = os.path.dirname(os.path.abspath(out_vrt))
+        root = ElementTree.Element('VRTDataset', rasterXSize=str(self.cols),
+                                   rasterYSize=str(self.rows))
+        ElementTree.SubElement(root, 'SRS').text = self.projection
+        ElementTree.SubElement(root, 'GeoTransform').text = \
+            ', '.join(repr(value) for value in self.geotransform)
+
+        for out_band, (src_band, name) in enumerate(bands):
+            band = ElementTree.SubElement(root, 'VRTRasterBand', dataType=self.data_type,
+                                          band=str(out_band + 1))
+            ElementTree.SubElement(band, 'Description').text = name
+            ElementTree.SubElement(band, 'NoDataValue').text = str(NODATA)
+            # Later sources are drawn over earlier ones, NODATA is transparent
+            for segment in self.segments:
+                source = ElementTree.SubElement(band, 'ComplexSource')
+                filename, relative = _relative_path(segment['file'], vrt_dir)
+                ElementTree.SubElement(source, 'SourceFilename',
+                                       relativeToVRT=relative).text = filename
+                ElementTree.SubElement(source, 'SourceBand').text = str(src_band)
+                size = {'xSize' : str(segment['cols']), 'ySize' : str(segment['rows'])}
+                ElementTree.SubElement(source, 'SrcRect', xOff='0', yOff='0', **size)
+                ElementTree.SubElement(source, 'DstRect', xOff=str(segment['xoff']),
+                                       yOff=str(segment['yoff']), **size)
+                ElementTree.SubElement(source, 'NODATA').text = str(NODATA)
+
+        ElementTree.ElementTree(root).write(out_vrt)
+
+
+def _relative_path(path, start):
+    """Path relative to start when possible (same drive), absolute otherwise"""
+    try:
+        return os.path.relpath(path, start), '1'
+    except ValueError:
+        return path, '0'
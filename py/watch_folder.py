@@ -0,0 +1,329 @@
+################################################################################
+# Name : watch_folder.py
+"""
+    Module used to start flood processing as SAR packages arrive
+
+    Usage:
+        -- Poll an inbox directory for fully written RADARSAT-2 ZIP packages
+        -- Group the packages into passes (acquisition groups)
+        -- Run FT0_FloodMaster (FT1 -> FT2 -> FT3) per pass in a bounded pool
+        -- Keep a state file so that a restarted watcher resumes its work
+
+        python watch_folder.py -in D:\\Floods\\Inbox -root D:\\Floods\\QC_Richelieu
+                               -dem D:\\Floods\\BaseData\\QC\\DEM\\QC_Richelieu_UTM18_DEM_30.img
+                               -- -proj "UTM 18 D122" -pol HH
+
+    Limits and constraints:
+        Plain polling, no file system notifications or external services.
+        A package is stable once its size and modification time have not
+        changed for the settle time; a pass is complete once no package of
+        it has arrived for the quiet time.
+        Each pass is processed by a separate Python process, so the watcher
+        must be run with the Python used for the Flood Tools (ArcGIS and
+        PCI Geomatica).
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import logging
+import argparse
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+# Import private modules
+from FT1_R2ReadOrthoMosaic import FT1_R2ReadOrthoMosaic
+
+# Script run for every pass
+FT0_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'FT0_FloodMaster.py')
+
+# States of a pass
+QUEUED  = 'queued'
+RUNNING = 'running'
+DONE    = 'done'
+FAILED  = 'failed'
+
+
+class WatchFolder:
+    """
+    Class used to start flood processing as SAR packages arrive.
+
+    Packages dropped in the inbox (e.g. by RS2Pull) are moved, one pass at a
+    time, to a workspace named after the first segment of the pass
+    (<date>_<time>_<beam>, under the root directory) where FT0_FloodMaster
+    is run on them.  The packages seen, the passes formed and their progress
+    are kept in a JSON state file, rewritten after every change.
+    The following functionality is performed by this class.
+    -- Poll the inbox once (poll)
+    -- Poll until interrupted (run)
+    -- Resume the passes of an earlier run (resume)
+
+    """
+
+
+    def __init__(self, inbox, root_dir, dem_file, ft0_args=None, workers=1, settle=60,
+                 quiet=300, state_file=None, python=None):
+        """Initialisation of WatchFolder class
+
+        Parameters:
+            inbox      -- Directory polled for ZIP packages
+            root_dir   -- Directory in which the pass workspaces are created
+            dem_file   -- DEM file (or directory of DEM tiles) passed to FT0
+            ft0_args   -- Further FT0_FloodMaster.py arguments
+                          (e.g. ['-proj', 'UTM 18 D122', '-pol', 'HH'])
+            workers    -- Maximum number of passes processed at a time
+            settle     -- Seconds a package must be unchanged to be stable
+            quiet      -- Seconds without a new package before a pass is
+                          processed
+            state_file -- State file, watch_folder.json in root_dir otherwise
+            python     -- Python interpreter running FT0, this one otherwise
+
+        """
+        self.inbox      = os.path.abspath(inbox)
+        self.root_dir   = os.path.abspath(root_dir)
+        self.dem_file   = os.path.abspath(dem_file)
+        self.ft0_args   = list(ft0_args or [])
+        self.settle     = settle
+        self.quiet      = quiet
+        self.state_file = state_file or os.path.join(self.root_dir, 'watch_folder.json')
+        self.python     = python or sys.executable
+        self.pool       = ThreadPool(max(int(workers), 1))
+        self.lock       = threading.Lock()
+        self.state      = {'packages' : {}, 'passes' : {}}
+        if os.path.isfile(self.state_file):
+            with open(self.state_file) as state_in:
+                self.state = json.load(state_in)
+
+
+    def poll(self):
+        """
+        Poll the inbox once
+
+        Records new and changed packages, forms the passes whose packages
+        are all stable and quiet, moves their packages to the pass workspace
+        and submits the pass for processing.
+
+        Return value:
+            List of the passes submitted.
+
+        """
+        now = time.time()
+        with self.lock:
+            packages = self.state['packages']
+            present  = set()
+            for zip_file in glob.glob(os.path.join(self.inbox, '*.zip')):
+                name = os.path.basename(zip_file)
+                try:
+                    stamp = [os.path.getsize(zip_file), os.path.getmtime(zip_file)]
+                except OSError:
+                    continue    # Moved or removed meanwhile
+                present.add(name)
+                entry = packages.get(name)
+                if entry is None or entry['stamp'] != stamp:
+                    packages[name] = {'stamp' : stamp, 'since' : now, 'pass' : None}
+                    logging.info('          Package arriving: ' + name)
+            for name in [name for name, entry in packages.items()
+                         if name not in present and entry['pass'] is None]:
+                del packages[name]
+
+            stable = [name for name, entry in packages.items()
+                      if entry['pass'] is None and now - entry['since'] >= self.settle]
+            for name in stable:
+                if FT1_R2ReadOrthoMosaic.parseSceneName(name) is None:
+                    logging.warning('          Not a RADARSAT-2 package, ignored: ' + name)
+                    packages[name]['pass'] = ''
+
+            # Packages still arriving are grouped as well, so that a pass only
+            # waits for its own packages
+            candidates = [name for name in packages if packages[name]['pass'] is None and
+                          FT1_R2ReadOrthoMosaic.parseSceneName(name) is not None]
+            zip_names  = dict((os.path.splitext(name)[0], name) for name in candidates)
+            submitted  = []
+            for sceneGroup in FT1_R2ReadOrthoMosaic.groupScenes(candidates):
+                names = [zip_names[scene['name']] for scene in sceneGroup]
+                # Wait for the rest of the pass while its packages keep arriving
+                if [name for name in names if name not in stable]:
+                    continue
+                if now - max(packages[name]['since'] for name in names) < self.quiet:
+                    continue
+                pass_name = '%s_%s_%s' % (sceneGroup[0]['date'], sceneGroup[0]['time'],
+                                          sceneGroup[0]['beam'])
+                workspace = os.path.join(self.root_dir, pass_name)
+                if not os.path.isdir(workspace):
+                    os.makedirs(workspace)
+                for name in names:
+                    shutil.move(os.path.join(self.inbox, name), os.path.join(workspace, name))
+                    packages[name]['pass'] = pass_name
+                self.state['passes'][pass_name] = {'workspace' : workspace,
+                                                   'packages'  : names,
+                                                   'state'     : QUEUED,
+                                                   'status'    : None}
+                logging.info('          Pass queued: {0} ({1} packages)'.format(pass_name, len(names)))
+                submitted.append(pass_name)
+            self.save()
+
+        for pass_name in submitted:
+            self.pool.apply_async(self.process, (pass_name,))
+        return submitted
+
+
+    def resume(self):
+        """
+        Resume the passes of an earlier run
+
+        Passes still queued, or running when the watcher stopped, are
+        submitted again.  FT1 expects the packages in the workspace root,
+        packages it had already moved to Raw are moved back.
+
+        Return value:
+            List of the passes submitted.
+
+        """
+        with self.lock:
+            resumed = [pass_name for pass_name, entry in sorted(self.state['passes'].items())
+                       if entry['state'] in (QUEUED, RUNNING)]
+            for pass_name in resumed:
+                entry = self.state['passes'][pass_name]
+                for name in entry['packages']:
+                    raw_file = os.path.join(entry['workspace'], 'Raw', name)
+                    if os.path.isfile(raw_file) and \
+                       not os.path.isfile(os.path.join(entry['workspace'], name)):
+                        shutil.move(raw_file, os.path.join(entry['workspace'], name))
+                entry['state'] = QUEUED
+                logging.info('          Pass resumed: ' + pass_name)
+            self.save()
+        for pass_name in resumed:
+            self.pool.apply_async(self.process, (pass_name,))
+        return resumed
+
+
+    def process(self, pass_name):
+        """
+        Run FT0_FloodMaster on the workspace of a pass
+
+        The output of FT0 is written to FT0_FloodMaster.log in the workspace.
+
+        Parameters:
+            pass_name -- Name of the pass
+
+        Return value:
+            Exit status of FT0_FloodMaster.
+
+        """
+        with self.lock:
+            entry = self.state['passes'][pass_name]
+            entry['state'] = RUNNING
+            self.save()
+        command = [self.python, FT0_SCRIPT, '-ws', entry['workspace'],
+                   '-dem', self.dem_file] + self.ft0_args
+        logging.info('       Executing: ' + ' '.join(command))
+        try:
+            with open(os.path.join(entry['workspace'], 'FT0_FloodMaster.log'), 'a') as log_out:
+                status = subprocess.call(command, cwd=entry['workspace'],
+                                         stdout=log_out, stderr=subprocess.STDOUT)
+        except (IOError, OSError) as e:
+            logging.error('          Cannot run FT0_FloodMaster: {0}'.format(e))
+            status = -1
+        with self.lock:
+            entry['state']  = DONE if status == 0 else FAILED
+            entry['status'] = status
+            self.save()
+        if status == 0:
+            logging.info('          Successfully completed pass: ' + pass_name)
+        else:
+            logging.error('          Pass failed (status {0}): {1}'.format(status, pass_name))
+        return status
+
+
+    def run(self, interval=30, once=False):
+        """
+        Poll the inbox until interrupted
+
+        Parameters:
+            interval -- Seconds between polls
+            once     -- Poll until the packages of the inbox are queued as
+                        passes, wait for the passes to complete and return
+
+        Return value:
+            None
+
+        """
+        logging.info('       Executing: WatchFolder.run: ' + self.inbox)
+        self.resume()
+        try:
+            self.poll()
+            while not once or self._pending():
+                time.sleep(interval)
+                self.poll()
+        except KeyboardInterrupt:
+            logging.info('          Interrupted, waiting for running passes')
+        self.pool.close()
+        self.pool.join()
+
+
+    def _pending(self):
+        """True while packages of the inbox are not queued as a pass (or ignored)"""
+        with self.lock:
+            return any(entry['pass'] is None for entry in self.state['packages'].values())
+
+
+    def save(self):
+        """Rewrite the state file, replacing it only once fully written"""
+        temp_file = self.state_file + '.tmp'
+        with open(temp_file, 'w') as state_out:
+            json.dump(self.state, state_out, indent=1, sort_keys=True)
+        if os.path.isfile(self.state_file):
+            os.remove(self.state_file)  # os.rename does not replace on Windows
+        os.rename(temp_file, self.state_file)
+
+
+def main():
+    """
+        Allows the watcher to be run from the command line.
+
+        Usage:
+            watch_folder.py [-h] -in INBOX -root ROOTDIR -dem DEMFILE
+                            [-workers WORKERS] [-poll SECONDS]
+                            [-settle SECONDS] [-quiet SECONDS] [-once]
+                            [-- FT0 ARGUMENTS]
+
+        Arguments following "--" are passed to FT0_FloodMaster.py as is.
+    """
+    parser = argparse.ArgumentParser(prog='watch_folder.py',
+                                     description='Run FT0_FloodMaster on each pass of '
+                                                 'RADARSAT-2 packages arriving in a folder.')
+    parser.add_argument('-in', '--inbox', required=True, dest='inbox',
+                        help='Directory polled for ZIP packages')
+    parser.add_argument('-root', '--rootdir', required=True, dest='rootDir',
+                        help='Directory in which the pass workspaces are created')
+    parser.add_argument('-dem', '--demfile', required=True, dest='demFile',
+                        help='DEM file or directory of DEM tiles')
+    parser.add_argument('-workers', '--workers', type=int, default=1, dest='workers',
+                        help='Maximum number of passes processed at a time (default 1)')
+    parser.add_argument('-poll', '--poll', type=float, default=30, dest='poll',
+                        help='Seconds between polls (default 30)')
+    parser.add_argument('-settle', '--settle', type=float, default=60, dest='settle',
+                        help='Seconds a package must be unchanged (default 60)')
+    parser.add_argument('-quiet', '--quiet', type=float, default=300, dest='quiet',
+                        help='Seconds without a new package of a pass (default 300)')
+    parser.add_argument('-once', '--once', action='store_true', dest='once',
+                        help='Poll until the packages present are queued, wait for the passes and exit')
+    parser.add_argument('ft0Args', nargs=argparse.REMAINDER,
+                        help='-- followed by further FT0_FloodMaster.py arguments')
+    args = parser.parse_args()
+    ft0Args = args.ft0Args[1:] if args.ft0Args[:1] == ['--'] else args.ft0Args
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+    watcher = WatchFolder(args.inbox, args.rootDir, args.demFile, ft0Args, args.workers,
+                          args.settle, args.quiet)
+    watcher.run(args.poll, args.once)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+################################################################################
+# Name : work_store.py
+"""
+    Module used to keep intermediate rasters as named, chunked arrays
+
+    Usage:
+        -- Create, write and read named arrays of a working store by window
+        -- Hand the arrays to stages expecting a GDAL dataset or band
+           (ReadAsArray, WriteArray)
+        -- Remove an array once its consumers have read it
+        -- Export an array to a GeoTIFF
+
+    Limits and constraints:
+        Each array is a directory of the store: meta.json and one compressed
+        NumPy file (.npz) per chunk of chunk_size x chunk_size pixels.  Chunks
+        holding only the fill value are not written.  Arrays are written by
+        one process at a time; windows of an array may be written from
+        several threads.
+"""
+__revision__ = "--REVISION-- : $Id$"
+################################################################################
+# Import public modules
+import os
+import json
+import shutil
+import logging
+import threading
+
+import numpy
+from osgeo import gdal
+
+# Import private modules
+import EGS_utility
+
+# GDAL data types of the NumPy data types
+GDAL_TYPES = {'uint8' : gdal.GDT_Byte, 'int16' : gdal.GDT_Int16, 'uint16' : gdal.GDT_UInt16,
+              'int32' : gdal.GDT_Int32, 'uint32' : gdal.GDT_UInt32,
+              'float32' : gdal.GDT_Float32, 'float64' : gdal.GDT_Float64}
+
+
+class WorkStore:
+    """
+    Class used to keep intermediate rasters as named, chunked arrays.
+
+    Stages write their results to named arrays of the store instead of
+    channels added to the PCIDSK file, and read their inputs by name.  Each
+    array counts its consumers; the array is removed when the last consumer
+    releases it, so that intermediates do not outlive the stages reading
+    them.  Arrays are returned as StoreArray, which reads and writes windows
+    as a GDAL band does.
+    The following functionality is performed by this class.
+    -- Create a named array (create)
+    -- Open a named array (array)
+    -- List the named arrays (names)
+    -- Release an array after a consumer has read it (release)
+    -- Remove an array (remove)
+    -- Remove all arrays (clear)
+    -- Size of the store on disk (size)
+
+    """
+
+
+    def __init__(self, root_dir, chunk_size=512):
+        """Initialisation of WorkStore class
+
+        Parameters:
+            root_dir   -- Store directory, created when missing
+            chunk_size -- Chunk size of new arrays (pixels)
+
+        """
+        self.root_dir   = os.path.abspath(root_dir)
+        self.chunk_size = int(chunk_size)
+        self.lock       = threading.Lock()
+        if not os.path.isdir(self.root_dir):
+            os.makedirs(self.root_dir)
+
+
+    def create(self, name, xsize, ysize, dtype, geotransform=None, projection=None,
+               consumers=0, fill=0):
+        """
+        Create a named array, replacing an array of the same name
+
+        Parameters:
+            name         -- Array name
+            xsize        -- Number of pixels
+            ysize        -- Number of lines
+            dtype        -- NumPy data type
+            geotransform -- GDAL geotransform, for export
+            projection   -- Projection WKT, for export
+            consumers    -- Number of release calls before removal, 0 to keep
+                            the array until removed
+            fill         -- Value of pixels never written
+
+        Return value:
+            StoreArray of the new array.
+
+        """
+        self.remove(name)
+        meta = {'xsize' : int(xsize), 'ysize' : int(ysize), 'dtype' : numpy.dtype(dtype).name,
+                'chunk_size' : self.chunk_size, 'geotransform' : list(geotransform or []),
+                'projection' : projection or '', 'consumers' : int(consumers), 'fill' : fill}
+        os.makedirs(self._path(name))
+        self._write_meta(name, meta)
+        logging.info('          Working store array created: {0} ({1} x {2} {3})'.format(
+                     name, meta['xsize'], meta['ysize'], meta['dtype']))
+        return StoreArray(self._path(name), meta)
+
+
+    def array(self, name):
+        """
+        Open a named array
+
+        Parameters:
+            name -- Array name
+
+        Return value:
+            StoreArray of the array.
+
+        """
+        meta_file = os.path.join(self._path(name), 'meta.json')
+        if not os.path.isfile(meta_file):
+            raise ValueError('no array {0} in working store {1}'.format(name, self.root_dir))
+        with open(meta_file) as meta:
+            return StoreArray(self._path(name), json.load(meta))
+
+
+    def names(self):
+        """
+        List the named arrays
+
+        Return value:
+            Sorted list of array names.
+
+        """
+        return sorted(name for name in os.listdir(self.root_dir)
+                      if os.path.isfile(os.path.join(self.root_dir, name, 'meta.json')))
+
+
+    def release(self, name):
+        """
+        Release an array after a consumer has read it
+
+        Parameters:
+            name -- Array name
+
+        Return value:
+            True when the array was removed (last consumer), False otherwise.
+
+        """
+        with self.lock:
+            meta = self.array(name).meta
+            if meta['consumers'] <= 0:
+                return False
+            meta['consumers'] -= 1
+            if meta['consumers']:
+                self._write_meta(name, meta)
+                return False
+        self.remove(name)
+        logging.info('          Working store array released: ' + name)
+        return True
+
+
+    def remove(self, name):
+        """
+        Remove an array
+
+        Parameters:
+            name -- Array name
+
+        """
+        if os.path.isdir(self._path(name)):
+            shutil.rmtree(self._path(name))
+
+
+    def clear(self):
+        """Remove all arrays"""
+        for name in self.names():
+            self.remove(name)
+
+
+    def size(self):
+        """
+        Size of the store on disk
+
+        Return value:
+            Size of all chunk and meta files (bytes).
+
+        """
+        return sum(os.path.getsize(os.path.join(path, file_name))
+                   for path, dirs, files in os.walk(self.root_dir) for file_name in files)
+
+
+    def _path(self, name):
+        """Directory of an array"""
+        if not name or os.sep in name or name != os.path.basename(name):
+            raise ValueError('invalid array name: {0}'.format(name))
+        return os.path.join(self.root_dir, name)
+
+
+    def _write_meta(self, name, meta):
+        """Write the meta file of an array"""
+        temp = os.path.join(self._path(name), 'meta.json.tmp')
+        with open(temp, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        meta_file = os.path.join(self._path(name), 'meta.json')
+        if os.path.isfile(meta_file):
+            os.remove(meta_file)
+        os.rename(temp, meta_file)
+
+
+class StoreArray:
+    """
+    Class used to read and write windows of a named array of a WorkStore.
+
+    The methods used by the NumPy stages on GDAL datasets and bands are
+    provided (RasterXSize, RasterYSize, GetRasterBand, GetGeoTransform,
+    GetProjection, ReadAsArray, WriteArray, FlushCache), so that an array can
+    be passed where a single band dataset or a band is expected.
+    The following functionality is performed by this class.
+    -- Read a window (ReadAsArray)
+    -- Write a window (WriteArray)
+    -- Export the array to a GeoTIFF (export)
+
+    """
+
+
+    def __init__(self, path, meta):
+        """Initialisation of StoreArray class
+
+        Parameters:
+            path -- Directory of the array
+            meta -- Meta data of the array, see WorkStore.create
+
+        """
+        self.path        = path
+        self.meta        = meta
+        self.dtype       = numpy.dtype(meta['dtype'])
+        self.chunk_size  = meta['chunk_size']
+        self.RasterXSize = self.XSize = meta['xsize']
+        self.RasterYSize = self.YSize = meta['ysize']
+        self.RasterCount = 1
+        self.lock        = threading.Lock()
+
+
+    def GetRasterBand(self, band):
+        """The array itself, as band 1 of a dataset"""
+        if band != 1:
+            raise ValueError('working store arrays have a single band: {0}'.format(band))
+        return self
+
+
+    def GetGeoTransform(self):
+        """GDAL geotransform of the array"""
+        return tuple(self.meta['geotransform']) or None
+
+
+    def GetProjection(self):
+        """Projection WKT of the array"""
+        return self.meta['projection']
+
+
+    def FlushCache(self):
+        """Chunks are written by WriteArray, nothing is cached"""
+        pass
+
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        """
+        Read a window
+
+        Parameters:
+            xoff  -- First pixel
+            yoff  -- First line
+            xsize -- Number of pixels, to the right edge otherwise
+            ysize -- Number of lines, to the bottom edge otherwise
+
+        Return value:
+            Array of the window.
+
+        """
+        xsize = self.XSize - xoff if xsize is None else xsize
+        ysize = self.YSize - yoff if ysize is None else ysize
+        self._check_window(xoff, yoff, xsize, ysize)
+        window = numpy.empty((ysize, xsize), dtype=self.dtype)
+        for cx, cy, x0, y0, x1, y1 in self._chunks(xoff, yoff, xsize, ysize):
+            chunk = self._read_chunk(cx, cy)
+            window[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = \
+                chunk[y0 - cy * self.chunk_size:y1 - cy * self.chunk_size,
+                      x0 - cx * self.chunk_size:x1 - cx * self.chunk_size]
+        return window
+
+
+    def WriteArray(self, array, xoff=0, yoff=0):
+        """
+        Write a window
+
+        Parameters:
+            array -- 2-D array of the window
+            xoff  -- First pixel
+            yoff  -- First line
+
+        Return value:
+            0, as GDAL.
+
+        """
+        array = numpy.asarray(array)
+        ysize, xsize = array.shape
+        self._check_window(xoff, yoff, xsize, ysize)
+        size = self.chunk_size
+        for cx, cy, x0, y0, x1, y1 in self._chunks(xoff, yoff, xsize, ysize):
+            values = array[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff]
+            with self.lock:
+                if (x1 - x0, y1 - y0) == self._chunk_shape(cx, cy)[::-1]:
+                    chunk = values.astype(self.dtype)
+                else:
+                    chunk = self._read_chunk(cx, cy)
+                    chunk[y0 - cy * size:y1 - cy * size, x0 - cx * size:x1 - cx * size] = values
+                self._write_chunk(cx, cy, chunk)
+        return 0
+
+
+    def export(self, out_file, options=None):
+        """
+        Export the array to a GeoTIFF
+
+        Parameters:
+            out_file -- Output GeoTIFF
+            options  -- GDAL creation options, tiled and DEFLATE otherwise
+
+        Return value:
+            Output file when successful, error statement otherwise.
+
+        Limits and constraints:
+
+        """
+        try:
+            logging.info('       Executing: StoreArray.export')
+            if self.dtype.name not in GDAL_TYPES:
+                raise ValueError('no GDAL data type for ' + self.dtype.name)
+            options = options or ['TILED=YES', 'COMPRESS=DEFLATE']
+            out_ds = gdal.GetDriverByName('GTiff').Create(out_file, self.XSize, self.YSize, 1,
+                                                          GDAL_TYPES[self.dtype.name], options)
+            if out_ds is None:
+                raise ValueError('cannot create ' + out_file)
+            if self.GetGeoTransform():
+                out_ds.SetGeoTransform(self.GetGeoTransform())
+            out_ds.SetProjection(self.GetProjection())
+            out_band = out_ds.GetRasterBand(1)
+            for yoff in range(0, self.YSize, self.chunk_size):
+                out_band.WriteArray(self.ReadAsArray(0, yoff, self.XSize,
+                                                     min(self.chunk_size, self.YSize - yoff)), 0, yoff)
+            out_ds.FlushCache()
+            out_ds = None
+            logging.info('          Successfully completed StoreArray.export: ' + out_file)
+            return out_file
+
+        except (OSError, RuntimeError, ValueError) as e:
+            EGS_utility.EGSUtility().error('export(): {:s}'.format(e))
+
+
+    def _check_window(self, xoff, yoff, xsize, ysize):
+        """Raise ValueError when a window is not within the array"""
+        if xoff < 0 or yoff < 0 or xsize < 0 or ysize < 0 or \
+           xoff + xsize > self.XSize or yoff + ysize > self.YSize:
+            raise ValueError('window ({0}, {1}, {2}, {3}) outside of {4}'.format(
+                             xoff, yoff, xsize, ysize, self.path))
+
+
+    def _chunks(self, xoff, yoff, xsize, ysize):
+        """(cx, cy, x0, y0, x1, y1) of the chunks overlapping a window"""
+        size = self.chunk_size
+        for cy in range(yoff // size, (yoff + ysize - 1) // size + 1):
+            for cx in range(xoff // size, (xoff + xsize - 1) // size + 1):
+                yield (cx, cy, max(cx * size, xoff), max(cy * size, yoff),
+                       min((cx + 1) * size, xoff + xsize), min((cy + 1) * size, yoff + ysize))
+
+
+    def _chunk_shape(self, cx, cy):
+        """(lines, pixels) of a chunk, smaller at the right and bottom edges"""
+        size = self.chunk_size
+        return min(size, self.YSize - cy * size), min(size, self.XSize - cx * size)
+
+
+    def _chunk_file(self, cx, cy):
+        """File of a chunk"""
+        return os.path.join(self.path, '{0}_{1}.npz'.format(cy, cx))
+
+
+    def _read_chunk(self, cx, cy):
+        """Chunk array, fill value when not written"""
+        chunk_file = self._chunk_file(cx, cy)
+        if os.path.isfile(chunk_file):
+            with numpy.load(chunk_file) as chunk:
+                return chunk['chunk']
+        return numpy.full(self._chunk_shape(cx, cy), self.meta['fill'], dtype=self.dtype)
+
+
+    def _write_chunk(self, cx, cy, chunk):
+        """Write a chunk, remove it when it only holds the fill value"""
+        chunk_file = self._chunk_file(cx, cy)
+        if os.path.isfile(chunk_file):
+            os.remove(chunk_file)
+        if not (chunk == self.meta['fill']).all():
+            temp = os.path.join(self.path, 'tmp_{0}_{1}.npz'.format(cy, cx))
+            numpy.savez_compressed(temp, chunk=chunk)
+            os.rename(temp, chunk_file)